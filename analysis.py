@@ -2,34 +2,125 @@
 import os
 import pandas as pd
 import json
-from tinydb import TinyDB
-from datetime import datetime, timedelta
+import time
+import logging
+import threading
 from binance import Client
 from dotenv import load_dotenv
 
+from archive import FillSource, source_paths, to_columns, merge_columns
+from prices import PriceCache, TickerStream, StubTickerStream, PRICE_TTL
+from stats import HOUR, DAY
+from pnl import SymbolLedger, to_timestamp
+
 load_dotenv()
 
-client = Client(
-    api_key=os.environ.get("API_KEY"), api_secret=os.environ.get("API_SECRET")
-)
+TRADES_PAGE = 100
+MAX_TRADES_PAGE = 1000
+REFRESH_INTERVAL = float(os.environ.get("DASHBOARD_REFRESH", 1.0))
+
+logger = logging.getLogger("grid.analysis")
+
+
+def open_ticker(cache):
+    """Stream live prices, or serve the fixed prices of PRICES_FILE if set."""
+    prices_file = os.environ.get("PRICES_FILE")
+    if prices_file:
+        with open(prices_file) as f:
+            return StubTickerStream(cache, json.load(f))
+    client = Client(
+        api_key=os.environ.get("API_KEY"), api_secret=os.environ.get("API_SECRET")
+    )
+    return TickerStream(cache, client)
 
 
 class Analyzer:
-    df_cache = {}
-    filled_count = 0
+    prices = PriceCache()
+    ticker = None
+    # the fill store of the bot and those of the shards of the supervisor,
+    # a symbol is traded by one of them
+    sources: list[FillSource] = None
+    ledgers: dict[str, SymbolLedger] = {}
+    # records of symbols whose ledger has not been loaded yet
+    backlog: dict[str, list[dict]] = {}
+    lock = threading.Lock()
+    # fall back to a REST call for symbols the ticker stream has not sent yet
+    fetch_prices = True
 
     def __init__(self) -> None:
-        filled = TinyDB("db.json").table("filled")
-        if len(filled) == len(Analyzer.df_cache):
-            self.df_cache = Analyzer.df_cache
-        else:
-            Analyzer.last_count = len(filled)
-            Analyzer.df_cache = self.df_cache = {}
-        self.data = pd.DataFrame(
-            filled.all(), columns=["s", "p", "q", "Z", "S", "O", "T", "cancel"]
+        with Analyzer.lock:
+            if Analyzer.ticker is None:
+                Analyzer.ticker = open_ticker(Analyzer.prices)
+                Analyzer.ticker.start()
+            if Analyzer.sources is None:
+                Analyzer.open_store()
+        self.refresh()
+
+    @staticmethod
+    def open_store() -> None:
+        """Open the archives and the journals after them, the ledgers start over."""
+        Analyzer.sources = [FillSource(*paths) for paths in source_paths()]
+        Analyzer.ledgers = {}
+        Analyzer.backlog = {}
+
+    def refresh(self) -> None:
+        """Queue the fills added to the store since the last refresh."""
+        with Analyzer.lock:
+            paths = [(source.path, source.archive_path) for source in Analyzer.sources]
+            if paths != source_paths():
+                logger.info("the shard fill stores changed, reloading the fills")
+                Analyzer.open_store()
+            elif any(source.stale() for source in Analyzer.sources):
+                # compacted meanwhile, its previous generation is deleted by
+                # the next compaction
+                logger.info("the fill archive was compacted, reloading it")
+                Analyzer.open_store()
+            symbols = []
+            for source in Analyzer.sources:
+                for record in source.new_records():
+                    if record["op"] == "fill":
+                        symbol = record["msg"]["s"]
+                    else:
+                        symbol = record["s"]
+                    Analyzer.backlog.setdefault(symbol, []).append(record)
+                if source.archive is not None:
+                    symbols += source.archive.symbols
+            symbols += list(Analyzer.ledgers) + list(Analyzer.backlog)
+        self.symbols = list(dict.fromkeys(symbols))
+
+    @staticmethod
+    def ledger(symbol) -> SymbolLedger:
+        """Return the up to date ledger, memory-mapping the archive on first use.
+
+        A symbol that moved between shards has fills in several sources, they
+        are merged in time order on the first load.
+        """
+        records = Analyzer.backlog.pop(symbol, [])
+        fills = sorted(
+            (r["msg"] for r in records if r["op"] == "fill"), key=lambda msg: msg["T"]
         )
-        self.symbols = self.data.s.unique()
-        self.prices = {}
+        ledger = Analyzer.ledgers.get(symbol)
+        if ledger is None:
+            ledger = Analyzer.ledgers[symbol] = SymbolLedger(symbol)
+            parts = [
+                source.archive.load(symbol)
+                for source in Analyzer.sources
+                if source.archive is not None and symbol in source.archive
+            ]
+            late = parts and fills and fills[0]["T"] < parts[0]["T"][-1]
+            if len(parts) > 1 or late:
+                if fills:
+                    parts.append(to_columns(fills))
+                ledger.extend_columns(merge_columns(parts))
+                fills = []
+            elif parts:
+                ledger.extend_columns(parts[0])
+        ledger.extend(fills)
+        # the store already marked cancelled fills it had not handed out yet
+        for record in records:
+            if record["op"] == "cancel":
+                ledger.cancel(record["i"])
+        return ledger
 
     def all_states_table(self):
         df = self.all_states_df()
@@ -47,227 +138,184 @@ class Analyzer:
         return state.to_html()
 
     def symbol_trades_table(self, symbol):
-        df = self.one_symbol_df(symbol)
+        df = self.one_symbol_df(symbol).copy()
         df.insert(2, "filled_at", df.index)
         df["created_at"] = df.created_at.dt.strftime("%Y-%m-%d %H:%M:%S.%f").str[:-3]
         df["filled_at"] = df.filled_at.dt.strftime("%Y-%m-%d %H:%M:%S.%f").str[:-3]
         return df.reset_index(drop=True).to_html()
 
+    def trades_page(self, symbol, before=None, limit=TRADES_PAGE):
+        """One page of symbol_trades_table as JSON, see SymbolLedger.page.
+
+        limit is clamped to 1..MAX_TRADES_PAGE.
+        """
+        limit = min(max(limit, 1), MAX_TRADES_PAGE)
+        with Analyzer.lock:
+            df, next_before = self.ledger(symbol).page(before, limit)
+        df.insert(2, "filled_at", df.index)
+        df["created_at"] = df.created_at.dt.strftime("%Y-%m-%d %H:%M:%S.%f").str[:-3]
+        df["filled_at"] = df.filled_at.dt.strftime("%Y-%m-%d %H:%M:%S.%f").str[:-3]
+        return {
+            "symbol": symbol,
+            "columns": list(df.columns),
+            "rows": df.values.tolist(),
+            "before": next_before,
+        }
+
     def all_states_df(self):
         df = pd.DataFrame.from_dict(self.all_states(), orient="index")
         df.loc["ALL", "value_change":"profit"] = df.loc[:, "value_change":"profit"].sum()
-        df.loc["ALL", "buy":"sell_last_hour"] = df.loc[:, "buy":"sell_last_hour"].sum()
+        df.loc["ALL", "buy":"profit_7d"] = df.loc[:, "buy":"profit_7d"].sum()
         df.loc["ALL", "last_trade_time"] = df.last_trade_time.max()
         df = df.astype({
             'buy': int,
             'sell': int,
             'buy_last_hour': int,
             'sell_last_hour': int,
+            'trades_24h': int,
+            'trades_7d': int,
         })
-        return df
+        return df.round(
+            {"volume_24h": 2, "profit_24h": 2, "fees_24h": 2, "profit_7d": 2}
+        )
 
     def all_states(self):
-        res = client.get_all_tickers()
-        self.prices = {item['symbol']: float(item['price']) for item in res}
         return {s: self.one_symbol_state(s) for s in self.symbols}
 
     def one_symbol_state(self, symbol):
-        df = self.one_symbol_df(symbol)
-        last_trade = df.iloc[-1]
-        one_hour_ago = pd.Timestamp.utcnow() - pd.Timedelta(1, "h")
-        df_last_hour = df[one_hour_ago:]
-        current_price = self.prices.get(
-            symbol, float(client.get_ticker(symbol=symbol).get("lastPrice"))
-        )
-        value_change = (
-            last_trade.base * current_price + last_trade.quote - last_trade.comm
-        )
+        """State of the symbol from the running totals of its ledger.
+
+        The windows are sums of the FillStats buckets, the cost does not grow
+        with the history.
+        """
+        with Analyzer.lock:
+            ledger = self.ledger(symbol)
+            now = int(pd.Timestamp.utcnow().timestamp() * 1000)
+            last_hour = ledger.stats.since(now - HOUR)
+            last_day = ledger.stats.since(now - DAY)
+            last_week = ledger.stats.since(now - 7 * DAY)
+            total = dict(zip(["buy", "sell"], ledger.stats.total))
+        current_price = self.current_price(symbol)
+        value_change = ledger.base * current_price + ledger.quote - ledger.comm
         state = {
             "value_change": value_change,
-            "profit": round(last_trade.profit_in_quote, 2),
-            "last_trade_time": df.index[-1],
-            "last_trade_price": last_trade.price,
+            "profit": round(
+                ledger.base_profit * ledger.last_price + ledger.quote_profit, 2
+            ),
+            "last_trade_time": to_timestamp(ledger.last_time),
+            "last_trade_price": ledger.last_price,
             "current_price": str(current_price).rstrip("0"),
-            "buy": sum(df.side == "BUY"),
-            "sell": sum(df.side == "SELL"),
-            "buy_last_hour": sum(df_last_hour.side == "BUY"),
-            "sell_last_hour": sum(df_last_hour.side == "SELL"),
+            "buy": total["buy"],
+            "sell": total["sell"],
+            "buy_last_hour": last_hour["buy"],
+            "sell_last_hour": last_hour["sell"],
+            "trades_24h": last_day["buy"] + last_day["sell"],
+            "volume_24h": last_day["volume"],
+            "profit_24h": last_day["profit"],
+            "fees_24h": last_day["fees"],
+            "trades_7d": last_week["buy"] + last_week["sell"],
+            "profit_7d": last_week["profit"],
         }
         return state
 
+    def profit_series(self, symbol=None):
+        """Realized profit per day and its running sum, of one or all symbols."""
+        days: dict[int, float] = {}
+        with Analyzer.lock:
+            for s in [symbol] if symbol else self.symbols:
+                for start, row in self.ledger(s).stats.series(DAY):
+                    days[start] = days.get(start, 0.0) + row["profit"]
+        total, series = 0.0, []
+        for start, profit in sorted(days.items()):
+            total += profit
+            series.append(
+                {
+                    "day": to_timestamp(start).strftime("%Y-%m-%d"),
+                    "profit": profit,
+                    "cumulative": total,
+                }
+            )
+        return series
+
+    def current_price(self, symbol):
+        price = Analyzer.prices.get(symbol)
+        if price is None and self.fetch_prices:
+            # the stream has not delivered this symbol yet, one REST call
+            # refreshes every symbol
+            Analyzer.prices.update(Analyzer.ticker.fetch())
+            price = Analyzer.prices.get(symbol)
+        return float("nan") if price is None else price
+
     def one_symbol_table(self, symbol):
         df = self.one_symbol_df(symbol)
         return df.to_html()
 
     def one_symbol_df(self, symbol):
-        if symbol in self.df_cache:
-            return self.df_cache[symbol]
-
-        data = self.data.query("s == @symbol")
-        data.reset_index(drop=True, inplace=True)
-        data.columns = [
-            "symbol",
-            "price",
-            "base_quantity",
-            "quote_quantity",
-            "side",
-            "created_at",
-            "filled_at",
-            "cancel",
-        ]
-        data = data.astype(
-            {
-                "symbol": str,
-                "price": float,
-                "base_quantity": float,
-                "quote_quantity": float,
-                "side": str,
-                "created_at": int,
-                "filled_at": int,
-            }
-        )
-        s = pd.Series("", index=data.index)
-        s[data.cancel == True] = "*"
-        data["cancel"] = s
-
-        data["created_at"] = pd.to_datetime(
-            data["created_at"], unit="ms", utc=True
-        ).dt.tz_convert("Asia/Shanghai")
-        data["filled_at"] = pd.to_datetime(
-            data["filled_at"], unit="ms", utc=True
-        ).dt.tz_convert("Asia/Shanghai")
-
-        data["buy"] = 1
-        data.loc[data.side == "SELL", "buy"] = -1
-        data["trade_base"] = data.buy * data.base_quantity
-        data["trade_quote"] = data.buy * data.quote_quantity * (-1)
-        data["trade_comm"] = data.quote_quantity * 0.001
-        data["base"] = data.trade_base.cumsum()
-        data["quote"] = data.trade_quote.cumsum()
-        data["comm"] = data.trade_comm.cumsum()
-
-        buy_indices = []
-        sell_indices = []
-        trade_pairs = []
-        for i, side in enumerate(data.side):
-            if side == "BUY":
-                if sell_indices:
-                    trade_pairs.append((i, sell_indices.pop()))
-                else:
-                    buy_indices.append(i)
-            else:
-                if buy_indices:
-                    trade_pairs.append((buy_indices.pop(), i))
-                else:
-                    sell_indices.append(i)
-
-        data["trade_base_profit"] = 0
-        data["trade_quote_profit"] = 0
-
-        for trade_pair in trade_pairs:
-            open_index, close_index = min(trade_pair), max(trade_pair)
-            open_trade = data.iloc[open_index]
-            close_trade = data.iloc[close_index]
-            trade_base_profit = close_trade.trade_base + open_trade.trade_base
-            trade_quote_profit = close_trade.trade_quote + open_trade.trade_quote
-            data.loc[close_index, "trade_base_profit"] = trade_base_profit
-            trade_comm = (
-                data.loc[open_index, "trade_comm"] + data.loc[close_index, "trade_comm"]
-            )
-            data.loc[close_index, "trade_quote_profit"] = (
-                trade_quote_profit - trade_comm
-            )
-
-        data["base_profit"] = data.trade_base_profit.cumsum()
-        data["quote_profit"] = data.trade_quote_profit.cumsum()
-
-        data["profit_in_quote"] = data.base_profit * data.price + data.quote_profit
-        data["value_change_in_quote"] = data.base * data.price + data.quote - data.comm
-
-        del data["base_quantity"]
-        del data["quote_quantity"]
-        del data["buy"]
-        data = data.reindex(
-            columns=[
-                "cancel",
-                "created_at",
-                "symbol",
-                "price",
-                "side",
-                "filled_at",
-                "trade_base",
-                "trade_quote",
-                "trade_comm",
-                "base",
-                "quote",
-                "comm",
-                "trade_base_profit",
-                "base_profit",
-                "trade_quote_profit",
-                "quote_profit",
-                "profit_in_quote",
-                "value_change_in_quote",
-            ]
-        )
-        data.set_index("filled_at", inplace=True)
-        self.df_cache[symbol] = data
-        return data
-
-    def all_symbols(self):
-        return [self.analyze_symbol(symbol) for symbol in self.symbols]
-
-    def one_table(self, symbol):
-        return self.analyze_symbol(symbol).to_html()
-
-    def last_or_0(self, s):
-        return 0 if s.empty else s[-1]
-
-    def one_info(self, symbol):
-        result = self.analyze_symbol(symbol)
-
-        if len(result) == 0:
-            days = hours = minutes = 0
-        else:
-            td = result.index[-1] - result.index[0]
-            days, seconds = td.days, td.seconds
-            mins = seconds // 60
-            hours = mins // 60
-            minutes = mins % 60
-
-        dt = datetime.now() - timedelta(hours=1)
-        one_hour = result[dt:]
-        info = {
-            "buy": sum(result.side == "BUY"),
-            "sell": sum(result.side == "SELL"),
-            "buy_1hour": sum(one_hour.side == "BUY"),
-            "sell_1hour": sum(one_hour.side == "SELL"),
-            "profit": round(self.last_or_0(result.profit_in_quote), 2),
-            "value change": round(self.last_or_0(result.value_change_in_quote), 2),
-            "time": f"{days} days, {hours} hours, {minutes} minutes",
-        }
-        return info
-
-    def info(self):
-        info_dict = {symbol: self.one_info(symbol) for symbol in self.symbols}
-        with open("config.json") as f:
-            config = json.load(f)
-        for symbol, info in info_dict.items():
-            if symbol in config:
-                info["step"] = config[symbol].get("step", "default")
-                info["quote"] = config[symbol].get("quote", "default")
-                info["status"] = "trading"
-            else:
-                info["status"] = "not trading"
-
-        all_info = {}
-        for key in ["buy", "sell", "profit", "value change"]:
-            all_info[key] = round(sum(info[key] for info in info_dict.values()), 2)
-        info_dict["ALL"] = all_info
-        return info_dict
+        with Analyzer.lock:
+            return self.ledger(symbol).frame()
+
+
+class AnalyticsService:
+    """The Analyzer of a web process, shared by all requests.
+
+    A daemon thread refreshes it every interval seconds: it reads the fills
+    added to the store, brings the ledgers up to date, makes the one REST
+    call for prices the ticker stream has not sent and renders the index
+    table. Requests read that snapshot and the hot ledgers, they never touch
+    the store or the exchange, so more users do not mean more load.
+    """
+
+    def __init__(self, interval=REFRESH_INTERVAL):
+        self.interval = interval
+        self.analyzer: Analyzer = None
+        self.symbols: list[str] = []
+        self.states_table = ""
+        self.refreshed_at = 0.0
+        self.fetched_at = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self) -> "AnalyticsService":
+        """Load the state once, then keep it up to date in the background."""
+        with self.lock:
+            if self.thread is None:
+                self.analyzer = Analyzer()
+                self.analyzer.fetch_prices = False
+                self.refresh()
+                self.thread = threading.Thread(
+                    target=self.run, name="analytics", daemon=True
+                )
+                self.thread.start()
+        return self
 
     def run(self):
-        r = self.all_symbols()
-        print(r)
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("failed to refresh the analytics")
+
+    def refresh(self) -> None:
+        self.analyzer.refresh()
+        symbols = self.analyzer.symbols
+        now = time.monotonic()
+        # at most one REST call per PRICE_TTL, for symbols the exchange
+        # does not list any more too
+        if any(Analyzer.prices.get(symbol) is None for symbol in symbols) and (
+            self.fetched_at is None or now - self.fetched_at >= PRICE_TTL
+        ):
+            self.fetched_at = now
+            try:
+                Analyzer.prices.update(Analyzer.ticker.fetch())
+            except Exception as e:
+                logger.warning(f"failed to fetch prices: {e!r}")
+        table = self.analyzer.all_states_table() if symbols else ""
+        self.symbols, self.states_table = symbols, table
+        self.refreshed_at = time.time()
+
+
+analytics = AnalyticsService()
 
 
 # # Analyzer().analyze_symbol('DOGEUSDT')
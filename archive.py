@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import shutil
+
+import numpy as np
+
+from store import JournalFillStore, open_fill_store
+from store import fill_store_path, shard_names, shard_path
+
+# executionReport field -> dtype of the archived column, "S" is stored as is_buy
+FIELDS = {
+    "p": np.float64,
+    "q": np.float64,
+    "Z": np.float64,
+    "S": np.bool_,
+    "O": np.int64,
+    "T": np.int64,
+    "i": np.int64,
+    "cancel": np.bool_,
+}
+
+
+def to_columns(msgs) -> dict[str, np.ndarray]:
+    return {
+        "p": np.array([float(msg["p"]) for msg in msgs], dtype=np.float64),
+        "q": np.array([float(msg["q"]) for msg in msgs], dtype=np.float64),
+        "Z": np.array([float(msg["Z"]) for msg in msgs], dtype=np.float64),
+        "S": np.array([msg["S"] == "BUY" for msg in msgs], dtype=np.bool_),
+        "O": np.array([msg["O"] for msg in msgs], dtype=np.int64),
+        "T": np.array([msg["T"] for msg in msgs], dtype=np.int64),
+        "i": np.array([msg["i"] for msg in msgs], dtype=np.int64),
+        "cancel": np.array([msg.get("cancel") == True for msg in msgs], dtype=np.bool_),
+    }
+
+
+def merge_columns(parts) -> dict[str, np.ndarray]:
+    """Concatenate the columns of the parts in the order of T, ties kept."""
+    columns = {
+        field: np.concatenate([part[field] for part in parts]) for field in FIELDS
+    }
+    order = np.argsort(columns["T"], kind="stable")
+    return {field: column[order] for field, column in columns.items()}
+
+
+class FillArchive:
+    """Per-symbol columnar copy of the fill journal.
+
+    Every compaction writes a new generation directory with one .npy file per
+    field and symbol, then atomically points meta.json at it together with
+    the journal position it covers. Readers memory-map only the symbols they
+    need and read the journal from that position on.
+    """
+
+    def __init__(self, path="archive"):
+        self.path = path
+        self.generation = 0
+        self.position = None
+        self.symbols: list[str] = []
+        meta = os.path.join(path, "meta.json")
+        if os.path.exists(meta):
+            with open(meta) as f:
+                meta = json.load(f)
+            self.generation = meta["generation"]
+            self.position = tuple(meta["position"])
+            self.symbols = meta["symbols"]
+
+    def stale(self) -> bool:
+        """True once a compaction replaced the generation this archive read."""
+        meta = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta):
+            return False
+        with open(meta) as f:
+            return json.load(f)["generation"] != self.generation
+
+    def __contains__(self, symbol):
+        return symbol in self.symbols
+
+    def symbol_path(self, symbol, generation=None):
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.path, f"{generation:08d}", symbol)
+
+    def load(self, symbol) -> dict[str, np.ndarray]:
+        path = self.symbol_path(symbol)
+        return {
+            field: np.load(os.path.join(path, f"{field}.npy"), mmap_mode="r")
+            for field in FIELDS
+        }
+
+    def compact(self, journal: JournalFillStore):
+        """Fold the journal records after self.position into a new generation."""
+        tail: dict[str, list[dict]] = {}
+        cancels = []
+        for record in journal.records:
+            if record["op"] == "fill":
+                tail.setdefault(record["msg"]["s"], []).append(record["msg"])
+            elif record["op"] == "cancel":
+                cancels.append(record)
+
+        generation = self.generation + 1
+        symbols = list(dict.fromkeys(self.symbols + list(tail)))
+        for symbol in symbols:
+            columns = {
+                field: np.array(column)
+                for field, column in (
+                    self.load(symbol).items() if symbol in self else []
+                )
+            }
+            if symbol in tail:
+                new = to_columns(tail[symbol])
+                columns = {
+                    field: (
+                        np.concatenate([columns[field], new[field]])
+                        if columns
+                        else new[field]
+                    )
+                    for field in FIELDS
+                }
+            for record in cancels:
+                if record["s"] == symbol:
+                    columns["cancel"][columns["i"] == record["i"]] = True
+
+            path = self.symbol_path(symbol, generation)
+            os.makedirs(path, exist_ok=True)
+            for field, dtype in FIELDS.items():
+                np.save(
+                    os.path.join(path, f"{field}.npy"), columns[field].astype(dtype)
+                )
+
+        meta = os.path.join(self.path, "meta.json")
+        with open(meta + ".tmp", "w") as f:
+            json.dump(
+                {
+                    "generation": generation,
+                    "position": journal.position,
+                    "symbols": symbols,
+                },
+                f,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(meta + ".tmp", meta)
+
+        # the previous generation stays until the next compaction, readers
+        # that opened it load their symbols from it until they see stale()
+        old = os.path.join(self.path, f"{self.generation - 1:08d}")
+        if self.generation > 1 and os.path.exists(old):
+            shutil.rmtree(old)
+        self.generation, self.position, self.symbols = (
+            generation,
+            tuple(journal.position),
+            symbols,
+        )
+
+
+def source_paths(path=None, archive_path=None) -> list[tuple[str, str]]:
+    """(store, archive) paths of the fill store and of the shards next to it.
+
+    They default to FILL_STORE_PATH and ARCHIVE_PATH. The archive path is
+    None for the tinydb store, which is not archived.
+    """
+    path = path or fill_store_path()
+    archive_path = archive_path or os.environ.get("ARCHIVE_PATH", "archive")
+    if os.environ.get("FILL_STORE", "journal") != "journal":
+        archive_path = None
+    sources = [(path, archive_path)]
+    for name in shard_names(path):
+        sources.append(
+            (shard_path(path, name), archive_path and shard_path(archive_path, name))
+        )
+    return sources
+
+
+class FillSource:
+    """A fill store and its archive, of the bot or of one shard of it.
+
+    The archive has the columns of the fills up to its position, the store
+    the records after it.
+    """
+
+    def __init__(self, path, archive_path=None):
+        self.path = path
+        self.archive_path = archive_path
+        self.open()
+
+    def open(self) -> None:
+        self.archive = None
+        if self.archive_path is not None:
+            self.archive = FillArchive(self.archive_path)
+        position = self.archive.position if self.archive is not None else None
+        self.store = open_fill_store(position, self.path)
+        self.loaded = False
+
+    def stale(self) -> bool:
+        return self.archive is not None and self.archive.stale()
+
+    def new_records(self) -> list[dict]:
+        """Records added to the store since the last call, all on the first."""
+        new = self.store.refresh()
+        if not self.loaded:
+            self.loaded = True
+            return self.store.records
+        return new
+
+
+if __name__ == "__main__":
+    # the store of the bot and the stores of the shards of the supervisor
+    for path, archive_path in source_paths(
+        archive_path=sys.argv[1] if len(sys.argv) > 1 else None
+    ):
+        if not os.path.exists(path):
+            continue
+        archive = FillArchive(archive_path)
+        journal = JournalFillStore(path, position=archive.position)
+        count = len(journal)
+        archive.compact(journal)
+        print(
+            f"compacted {count} fills into {archive.path}, "
+            f"generation {archive.generation}"
+        )
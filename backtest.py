@@ -0,0 +1,205 @@
+import os
+import json
+import argparse
+from decimal import Decimal as D
+
+import numpy as np
+import pandas as pd
+
+import utils
+from utils import quantize_qty, get_quote, get_price, in_range
+from pnl import analyze
+
+SEARCH_CHUNK = 4096
+
+# headerless CSVs of data.binance.vision
+KLINE_COLUMNS = [
+    "open_time",
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume",
+    "close_time",
+    "quote_volume",
+    "trades",
+    "taker_base_volume",
+    "taker_quote_volume",
+    "ignore",
+]
+AGG_TRADE_COLUMNS = [
+    "agg_trade_id",
+    "price",
+    "quantity",
+    "first_trade_id",
+    "last_trade_id",
+    "transact_time",
+    "is_buyer_maker",
+    "is_best_match",
+]
+
+
+def read_frame(path) -> pd.DataFrame:
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    df = pd.read_csv(path, header=None)
+    if isinstance(df.iloc[0, 0], str):
+        # the file has a header row
+        df = pd.read_csv(path)
+    elif len(df.columns) == len(KLINE_COLUMNS):
+        df.columns = KLINE_COLUMNS
+    elif len(df.columns) in (len(AGG_TRADE_COLUMNS), len(AGG_TRADE_COLUMNS) - 1):
+        df.columns = AGG_TRADE_COLUMNS[: len(df.columns)]
+    return df
+
+
+def load_ticks(paths) -> tuple[np.ndarray, np.ndarray]:
+    """Read kline or aggTrade files into (times in ms, prices) arrays.
+
+    A kline is replayed as open, low, high, close if it closed up, and as
+    open, high, low, close otherwise.
+    """
+    times, prices = [], []
+    for path in paths:
+        df = read_frame(path)
+        if "high" in df.columns:
+            up = (df.close >= df.open).to_numpy()
+            path_prices = np.stack(
+                [
+                    df.open,
+                    np.where(up, df.low, df.high),
+                    np.where(up, df.high, df.low),
+                    df.close,
+                ],
+                axis=1,
+            ).astype(np.float64)
+            open_time = df.open_time.to_numpy(np.int64)
+            close_time = df.close_time.to_numpy(np.int64)
+            path_times = np.stack(
+                [open_time, open_time, close_time, close_time], axis=1
+            )
+            prices.append(path_prices.ravel())
+            times.append(path_times.ravel())
+        else:
+            time_column = "transact_time" if "transact_time" in df else "T"
+            price_column = "price" if "price" in df else "p"
+            prices.append(df[price_column].to_numpy(np.float64))
+            times.append(df[time_column].to_numpy(np.int64))
+    return np.concatenate(times), np.concatenate(prices)
+
+
+def first_cross(prices, start, low, high):
+    """Index of the first price at or after start that is <= low or >= high."""
+    chunk = SEARCH_CHUNK
+    while start < len(prices):
+        block = prices[start : start + chunk]
+        hit = np.flatnonzero((block <= low) | (block >= high))
+        if len(hit):
+            return start + hit[0]
+        start += chunk
+        chunk *= 2
+    return None
+
+
+def backtest(grid: dict, times: np.ndarray, prices: np.ndarray) -> list[dict]:
+    """Replay the single buy/sell grid of Main over the ticks.
+
+    Orders are priced with the same rules as Main.quote and fill at their
+    limit price once the market trades through them. Returns the fills as
+    executionReport-like dicts.
+    """
+    grid = dict(grid)
+    symbol = grid["symbol"]
+    grid.setdefault("start", float(prices[0]))
+    grid["mid"] = grid["start"]
+    fills = []
+    placed_at = int(times[0])
+    position = 0
+    while True:
+        orders = {}
+        for side in ["buy", "sell"]:
+            price = get_price(grid, side)
+            if in_range(grid, side, price):
+                orders[side] = price
+        if not orders:
+            # both sides broke the range, the live grid would sit idle too
+            break
+
+        low = float(orders["buy"]) if "buy" in orders else -np.inf
+        high = float(orders["sell"]) if "sell" in orders else np.inf
+        index = first_cross(prices, position, low, high)
+        if index is None:
+            break
+
+        side = "buy" if prices[index] <= low else "sell"
+        price = orders[side]
+        qty = quantize_qty(symbol, get_quote(grid) / price)
+        fills.append(
+            {
+                "s": symbol,
+                "i": len(fills),
+                "p": str(price),
+                "q": str(qty),
+                "Z": str(price * qty),
+                "S": side.upper(),
+                "O": placed_at,
+                "T": int(times[index]),
+            }
+        )
+        grid["mid"] = float(price)
+        placed_at = int(times[index])
+        position = index + 1
+    return fills
+
+
+def set_filters(symbol, tick_size, step_size, min_notional):
+    """Use the given sizes instead of loading the exchange info."""
+    utils.filters[symbol] = utils.SymbolFilters(
+        D(tick_size), D(step_size), D(min_notional)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay the grid over local kline/aggTrade CSV or Parquet files"
+    )
+    parser.add_argument("symbol")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument(
+        "--config", default=os.environ.get("GRID_CONFIG_FILE", "config.json")
+    )
+    parser.add_argument("--step", type=float)
+    parser.add_argument("--bottom", type=float)
+    parser.add_argument("--top", type=float)
+    parser.add_argument("--bottom-ratio", type=float)
+    parser.add_argument("--top-ratio", type=float)
+    parser.add_argument("--quote", type=D)
+    parser.add_argument("--start", type=float)
+    parser.add_argument("--tick-size", help="skip loading the exchange info")
+    parser.add_argument("--step-size")
+    parser.add_argument("--min-notional", default="10")
+    parser.add_argument("--output", help="write the ledger to this CSV file")
+    args = parser.parse_args()
+
+    grid = {}
+    if os.path.exists(args.config):
+        with open(args.config) as f:
+            grid = json.load(f).get(args.symbol, {})
+    for key in ["step", "bottom", "top", "bottom_ratio", "top_ratio", "quote", "start"]:
+        if getattr(args, key) is not None:
+            grid[key] = getattr(args, key)
+    grid["symbol"] = args.symbol
+
+    if args.tick_size and args.step_size:
+        set_filters(args.symbol, args.tick_size, args.step_size, args.min_notional)
+
+    times, prices = load_ticks(args.files)
+    fills = backtest(grid, times, prices)
+    df, summary = analyze(args.symbol, fills, float(prices[-1]))
+    if args.output and fills:
+        df.to_csv(args.output)
+    print(json.dumps({k: round(v, 4) for k, v in summary.items()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
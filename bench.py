@@ -0,0 +1,376 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from decimal import Decimal as D
+
+import numpy as np
+import pandas as pd
+
+import utils
+from pnl import (
+    SymbolLedger,
+    pair_trades,
+    synthetic_fills,
+    to_columns,
+    benchmark as pnl_benchmark,
+)
+
+SECTIONS = ["quantize", "handle_msg", "store", "analyzer", "memory", "pnl", "pairing"]
+STORE_SIZES = [1000, 10_000, 100_000, 1_000_000]
+TOLERANCE = 0.25
+
+# metrics ending in these are better when higher, all others when lower
+HIGHER_IS_BETTER = ("_per_second",)
+
+
+def set_filters(symbols, tick_size="0.00001", step_size="0.1", min_notional="5"):
+    for symbol in symbols:
+        utils.filters[symbol] = utils.SymbolFilters(
+            D(tick_size), D(step_size), D(min_notional)
+        )
+
+
+def rate(n, seconds) -> float:
+    return round(n / seconds, 1)
+
+
+def percentiles_ms(seconds) -> dict:
+    values = np.array(seconds) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 4),
+        "p99_ms": round(float(np.percentile(values, 99)), 4),
+        "max_ms": round(float(values.max()), 4),
+    }
+
+
+def bench_quantize(n) -> dict:
+    set_filters(["BENCHUSDT"])
+    prices = (1 + np.random.default_rng(0).random(n)).tolist()
+    started = time.perf_counter()
+    for price in prices:
+        utils.quantize_price("BENCHUSDT", price)
+    price_time = time.perf_counter() - started
+    started = time.perf_counter()
+    for price in prices:
+        utils.quantize_qty("BENCHUSDT", 20 / price)
+    qty_time = time.perf_counter() - started
+    return {
+        "quantize_price_per_second": rate(n, price_time),
+        "quantize_qty_per_second": rate(n, qty_time),
+    }
+
+
+def bench_handle_msg(n, symbols=10) -> dict:
+    """Fills through Main.handle_msg and the actor's requote decision.
+
+    No exchange is involved: the order coroutines the actor spawns are
+    closed instead of being scheduled, so only the bot's own work is timed.
+    """
+    from main import Main, logger, alert_handler
+
+    logger.removeHandler(alert_handler)
+    names = [f"BENCH{k:03d}USDT" for k in range(symbols)]
+    set_filters(names)
+    grids = {
+        s: {
+            "symbol": s,
+            "start": 1.0,
+            "mid": 1.0,
+            "quote": 20,
+            "bottom": 1e-4,
+            "top": 1e4,
+        }
+        for s in names
+    }
+    bot = Main(grids)
+    bot.spawn = lambda coro: coro.close()
+    fills = synthetic_fills(n)
+    for fill, symbol in zip(fills, names * (n // symbols + 1)):
+        fill.update(e="executionReport", X="FILLED", E=fill["T"], s=symbol)
+        fill["c"] = f"bench{fill['i']}"
+
+    async def handle():
+        for fill in fills:
+            await bot.handle_msg(fill)
+
+    started = time.perf_counter()
+    asyncio.run(handle())
+    handle_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for fill in fills:
+        grid = grids[fill["s"]]
+        grid["mid"] = 1.0
+        grid["buy_cid"] = fill["c"]
+        bot.on_event(grid, fill)
+    requote_time = time.perf_counter() - started
+    bot.filled.close()
+    return {
+        "handle_msg_per_second": rate(n, handle_time),
+        "requote_per_second": rate(n, requote_time),
+    }
+
+
+def prefill_tinydb(path, fills) -> None:
+    """Write fills as the db.json of TinyFillStore, without a rewrite per fill."""
+    with open(path, "w") as f:
+        json.dump({"filled": {str(i + 1): fill for i, fill in enumerate(fills)}}, f)
+
+
+def bench_store(kind, sizes, inserts, tmp) -> dict:
+    """Latency of one insert into a store that already holds size fills."""
+    from store import JournalFillStore, TinyFillStore
+
+    results = {}
+    fills = synthetic_fills(max(sizes) + inserts)
+    for size in sizes:
+        path = os.path.join(tmp, f"{kind}-{size}")
+        if kind == "tinydb":
+            path += ".json"
+            prefill_tinydb(path, fills[:size])
+            store = TinyFillStore(path)
+            # every insert rewrites the file, a few are enough at 1M
+            count = max(3, min(inserts, 10**6 // size))
+        else:
+            store = JournalFillStore(path, fsync_every=10**9, fsync_interval=1e9)
+            for fill in fills[:size]:
+                store.insert(fill)
+            store.close()
+            store = JournalFillStore(path)
+            count = inserts
+        latencies = []
+        for fill in fills[size : size + count]:
+            started = time.perf_counter()
+            store.insert(fill)
+            latencies.append(time.perf_counter() - started)
+        store.close()
+        for key, value in percentiles_ms(latencies).items():
+            results[f"store_{kind}_{size}_insert_{key}"] = value
+    return results
+
+
+def bench_analyzer(n, symbols, tmp) -> dict:
+    """Load and build times of the dashboard Analyzer over a journal of n fills."""
+    names = [f"BENCH{k:03d}USDT" for k in range(symbols)]
+    prices_file = os.path.join(tmp, "prices.json")
+    with open(prices_file, "w") as f:
+        json.dump(dict.fromkeys(names, 1.0), f)
+    os.environ.update(
+        FILL_STORE="journal",
+        FILL_STORE_PATH=os.path.join(tmp, "analyzer-fills"),
+        ARCHIVE_PATH=os.path.join(tmp, "analyzer-archive"),
+        PRICES_FILE=prices_file,
+    )
+    from store import JournalFillStore
+    from analysis import Analyzer
+
+    fills = synthetic_fills(n + 1000)
+    for fill, symbol in zip(fills, names * (len(fills) // symbols + 1)):
+        fill["s"] = symbol
+    store = JournalFillStore(os.environ["FILL_STORE_PATH"], fsync_every=10**9)
+    for fill in fills[:n]:
+        store.insert(fill)
+    store.sync()
+
+    started = time.perf_counter()
+    a = Analyzer()
+    load = time.perf_counter() - started
+    started = time.perf_counter()
+    a.one_symbol_df(names[0])
+    one_cold = time.perf_counter() - started
+    started = time.perf_counter()
+    a.all_states_df()
+    all_cold = time.perf_counter() - started
+    started = time.perf_counter()
+    a.all_states_df()
+    all_warm = time.perf_counter() - started
+
+    for fill in fills[n:]:
+        store.insert(fill)
+    store.close()
+    started = time.perf_counter()
+    a.refresh()
+    a.one_symbol_df(names[0])
+    one_update = time.perf_counter() - started
+    return {
+        "analyzer_load_ms": round(load * 1000, 3),
+        "one_symbol_df_cold_ms": round(one_cold * 1000, 3),
+        "one_symbol_df_update_ms": round(one_update * 1000, 3),
+        "all_states_df_cold_ms": round(all_cold * 1000, 3),
+        "all_states_df_warm_ms": round(all_warm * 1000, 3),
+    }
+
+
+def traced(build) -> int:
+    """Bytes still allocated after build() returns, its result kept alive."""
+    tracemalloc.start()
+    try:
+        kept = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return size
+
+
+def bench_memory(n) -> dict:
+    fills = synthetic_fills(n)
+    columns = to_columns(fills)
+
+    def state():
+        ledger = SymbolLedger("BENCHUSDT")
+        ledger.extend_columns(columns)
+        return ledger
+
+    def cold():
+        ledger = SymbolLedger("BENCHUSDT")
+        ledger.extend(fills)
+        ledger.frame()
+        return ledger
+
+    def incremental():
+        ledger = SymbolLedger("BENCHUSDT")
+        for fill in fills:
+            ledger.add(fill)
+        ledger.frame()
+        return ledger
+
+    return {
+        "ledger_state_bytes_per_fill": round(traced(state) / n, 1),
+        "ledger_cold_bytes_per_fill": round(traced(cold) / n, 1),
+        "ledger_incremental_bytes_per_fill": round(traced(incremental) / n, 1),
+    }
+
+
+def stack_pairs(is_buy):
+    """The buy/sell index stacks of SymbolLedger.add, as (open, close) pairs."""
+    buy_indices, sell_indices, pairs = [], [], []
+    for i, buy in enumerate(is_buy):
+        if buy:
+            if sell_indices:
+                pairs.append((sell_indices.pop(), i))
+            else:
+                buy_indices.append(i)
+        else:
+            if buy_indices:
+                pairs.append((buy_indices.pop(), i))
+            else:
+                sell_indices.append(i)
+    return pairs, buy_indices + sell_indices
+
+
+def bench_pairing(n) -> dict:
+    """Time pair_trades and check it against the stack loop on n fills."""
+    is_buy = np.random.default_rng(0).random(n) < 0.5
+    started = time.perf_counter()
+    open_index, close_index, unmatched = pair_trades(is_buy)
+    elapsed = time.perf_counter() - started
+    pairs, left = stack_pairs(is_buy.tolist())
+    if sorted(zip(open_index.tolist(), close_index.tolist())) != sorted(pairs):
+        raise AssertionError(f"pair_trades differs from the stack loop at {n} fills")
+    if unmatched.tolist() != sorted(left):
+        raise AssertionError(f"pair_trades leaves other fills open at {n} fills")
+    return {"pair_trades_per_second": rate(n, elapsed)}
+
+
+def compare(results: dict, baseline: dict, tolerance=TOLERANCE) -> list[str]:
+    """Metrics that got worse than the baseline by more than tolerance."""
+    regressions = []
+    for key, value in results.items():
+        old = baseline.get(key)
+        if not isinstance(old, (int, float)) or not old:
+            continue
+        if key.endswith(HIGHER_IS_BETTER):
+            worse = value < old * (1 - tolerance)
+        else:
+            worse = value > old * (1 + tolerance)
+        if worse:
+            regressions.append(f"{key}: {old} -> {value}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the hot paths of the bot and the dashboard offline"
+    )
+    parser.add_argument("--only", nargs="+", choices=SECTIONS, default=SECTIONS)
+    parser.add_argument("--quantize", type=int, default=200_000)
+    parser.add_argument("--fills", type=int, default=20_000, help="for handle_msg")
+    parser.add_argument(
+        "--store-sizes",
+        type=lambda s: [int(v) for v in s.split(",")],
+        default=STORE_SIZES,
+    )
+    parser.add_argument("--store-inserts", type=int, default=200)
+    parser.add_argument("--store", nargs="+", default=["journal", "tinydb"])
+    parser.add_argument("--analyzer-fills", type=int, default=200_000)
+    parser.add_argument("--analyzer-symbols", type=int, default=20)
+    parser.add_argument("--memory-fills", type=int, default=100_000)
+    parser.add_argument("--pnl-fills", type=int, default=1_000_000)
+    parser.add_argument("--pairing-fills", type=int, default=1_000_000)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DEBUG_LOG_FILE"] = os.path.join(tmp, "debug.log")
+        os.environ["FILL_STORE_PATH"] = os.path.join(tmp, "fills")
+        os.environ["SNAPSHOT_FILE"] = os.path.join(tmp, "grids.json")
+        for section in args.only:
+            print(f"running {section}", file=sys.stderr)
+            if section == "quantize":
+                results.update(bench_quantize(args.quantize))
+            elif section == "handle_msg":
+                results.update(bench_handle_msg(args.fills))
+            elif section == "store":
+                for kind in args.store:
+                    results.update(
+                        bench_store(kind, args.store_sizes, args.store_inserts, tmp)
+                    )
+            elif section == "analyzer":
+                results.update(
+                    bench_analyzer(args.analyzer_fills, args.analyzer_symbols, tmp)
+                )
+            elif section == "memory":
+                results.update(bench_memory(args.memory_fills))
+            elif section == "pnl":
+                pnl = pnl_benchmark(args.pnl_fills, args.pnl_fills // 10, repeat=1)
+                results["pnl_cold_fills_per_second"] = pnl["cold_fills_per_second"]
+                results["pnl_incremental_fills_per_second"] = pnl[
+                    "incremental_fills_per_second"
+                ]
+            elif section == "pairing":
+                results.update(bench_pairing(args.pairing_fills))
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            raise SystemExit("regressions:\n" + "\n".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
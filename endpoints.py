@@ -0,0 +1,21 @@
+from binance import AsyncClient
+from binance.ws.websocket_api import WebsocketAPI
+
+
+def point_client(client: AsyncClient, url: str) -> AsyncClient:
+    """Send the REST and websocket API requests of the client to url."""
+    client.API_URL = f"{url}/api"
+    client.ws_api = WebsocketAPI(url=f"{url.replace('http', 'ws', 1)}/ws-api/v3")
+    return client
+
+
+def point_socket_manager(bsm, url: str):
+    """Open the listenKey and market streams of the socket manager on url."""
+    bsm.STREAM_URL = f"{url.replace('http', 'ws', 1)}/"
+    return bsm
+
+
+async def mock_client(url: str) -> AsyncClient:
+    """Client of the exchange at url, without keys, like mock_exchange.py."""
+    # AsyncClient.create pings the real exchange before the URL can be changed
+    return point_client(AsyncClient("mock", "mock"), url)
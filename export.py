@@ -0,0 +1,203 @@
+import os
+import io
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from archive import FillArchive, source_paths, to_columns
+from store import read_journal, open_fill_store
+from pnl import LedgerStream, empty_frame
+
+CHUNK_SIZE = 100_000
+FORMATS = ["csv", "parquet"]
+TIMEZONE = "Asia/Shanghai"
+
+
+def to_ms(text):
+    """Time in ms of an ISO date or time in TIMEZONE, or of a number in ms."""
+    if text is None:
+        return None
+    if str(text).isdigit():
+        return int(text)
+    time = pd.Timestamp(text)
+    if time.tzinfo is None:
+        time = time.tz_localize(TIMEZONE)
+    return int(time.timestamp() * 1000)
+
+
+def fill_chunks(symbol, chunk_size=CHUNK_SIZE):
+    """The fills of the symbol as archive columns of up to chunk_size fills.
+
+    Reads every fill store, the one of the bot and those of the shards of
+    the supervisor, a symbol is traded by one of them. Of a journal, reads
+    the memory-mapped archive, then the journal after it, one chunk at a
+    time. The journal is read twice, first for the cancel marks, which may
+    come after the chunk of their fill. A tinydb store is loaded at once,
+    it has no way to read a part of it.
+    """
+    for path, archive_path in source_paths():
+        if not os.path.exists(path):
+            continue
+        if archive_path is None:
+            store = open_fill_store(path=path)
+            msgs = [msg for msg in store.all() if msg["s"] == symbol]
+            for start in range(0, len(msgs), chunk_size):
+                yield to_columns(msgs[start : start + chunk_size])
+        else:
+            yield from journal_chunks(symbol, path, archive_path, chunk_size)
+
+
+def journal_chunks(symbol, path, archive_path, chunk_size=CHUNK_SIZE):
+    archive = FillArchive(archive_path)
+    cancelled = {
+        record["i"]
+        for record in read_journal(path, archive.position)
+        if record["op"] == "cancel" and record["s"] == symbol
+    }
+
+    if symbol in archive:
+        columns = archive.load(symbol)
+        for start in range(0, len(columns["i"]), chunk_size):
+            chunk = {
+                k: np.array(v[start : start + chunk_size]) for k, v in columns.items()
+            }
+            if cancelled:
+                chunk["cancel"] |= np.isin(chunk["i"], list(cancelled))
+            yield chunk
+
+    msgs = []
+    for record in read_journal(path, archive.position):
+        if record["op"] != "fill" or record["msg"]["s"] != symbol:
+            continue
+        msg = record["msg"]
+        if msg["i"] in cancelled:
+            msg["cancel"] = True
+        msgs.append(msg)
+        if len(msgs) == chunk_size:
+            yield to_columns(msgs)
+            msgs = []
+    if msgs:
+        yield to_columns(msgs)
+
+
+def ledger_chunks(symbol, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """The rows of symbol_trades_table in chunks, filled from start to before end.
+
+    The P&L columns are carried over from the fills before start, so they
+    match the dashboard whatever the range.
+    """
+    ledger = LedgerStream(symbol)
+    for columns in fill_chunks(symbol, chunk_size):
+        df = ledger.frame(columns)
+        filled_at = columns["T"]
+        keep = np.ones(len(filled_at), dtype=bool)
+        if start is not None:
+            keep &= filled_at >= start
+        if end is not None:
+            keep &= filled_at < end
+        if keep.any():
+            yield df[keep]
+
+
+def csv_chunks(chunks):
+    """CSV text of the chunks, the header comes with the first one."""
+    header = True
+    for df in chunks:
+        yield df.to_csv(header=header)
+        header = False
+    if header:
+        yield empty_frame().to_csv()
+
+
+class Drain(io.RawIOBase):
+    """Write-only file whose content is taken out as it is written."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self) -> bytes:
+        data, self.buffer = bytes(self.buffer), bytearray()
+        return data
+
+
+def parquet_chunks(chunks):
+    """Parquet bytes of the chunks, one row group per chunk."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = Drain()
+    writer = None
+    for df in chunks:
+        table = pa.Table.from_pandas(df)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.take()
+    if writer is None:
+        writer = pq.ParquetWriter(sink, pa.Table.from_pandas(empty_frame()).schema)
+    writer.close()
+    yield sink.take()
+
+
+def export_chunks(symbol, fmt="csv", start=None, end=None, chunk_size=CHUNK_SIZE):
+    """The ledger of the symbol as CSV text or Parquet bytes, chunk by chunk."""
+    chunks = ledger_chunks(symbol, start, end, chunk_size)
+    if fmt == "csv":
+        return csv_chunks(chunks)
+    elif fmt == "parquet":
+        # optional, only exports to Parquet need pyarrow, fail before the
+        # first chunk if it is missing
+        import pyarrow.parquet
+
+        return parquet_chunks(chunks)
+    raise ValueError(f"unknown export format: {fmt}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the trade ledger of a symbol from the fill store"
+    )
+    parser.add_argument("symbol")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--start", help="ISO time or ms, in Asia/Shanghai if naive")
+    parser.add_argument("--end", help="same as --start, the end is excluded")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--output", "-o", help="file to write, default stdout")
+    args = parser.parse_args()
+
+    chunks = export_chunks(
+        args.symbol,
+        args.format,
+        to_ms(args.start),
+        to_ms(args.end),
+        args.chunk_size,
+    )
+    if args.output:
+        mode = "w" if args.format == "csv" else "wb"
+        with open(args.output, mode) as f:
+            for chunk in chunks:
+                f.write(chunk)
+    elif args.format == "csv":
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+    else:
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+
+
+if __name__ == "__main__":
+    main()
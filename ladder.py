@@ -0,0 +1,114 @@
+import bisect
+
+
+class Ladder:
+    """Resting orders of a multi-level grid, keyed by lattice level.
+
+    Level n is priced start * (1 + step) ** n and the mid level is the level
+    of the last fill. The ladder wants buys on the `levels` levels below mid
+    and sells on the `levels` levels above it, so after a fill only the
+    levels that changed have to be requoted.
+    """
+
+    def __init__(self, start, step, levels, mid=0):
+        self.start = start
+        self.step = step
+        self.levels = levels
+        self.mid = mid
+        self.sorted_levels: list[int] = []
+        self.orders: dict[int, dict] = {}
+        self.cids: dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.orders)
+
+    def state(self) -> dict:
+        return {
+            "start": self.start,
+            "step": self.step,
+            "levels": self.levels,
+            "mid": self.mid,
+            "orders": {str(level): order for level, order in self.orders.items()},
+        }
+
+    @classmethod
+    def from_state(cls, state) -> "Ladder":
+        ladder = cls(state["start"], state["step"], state["levels"], state["mid"])
+        for level, order in state["orders"].items():
+            ladder.add(int(level), order["side"], order["cid"])
+            ladder.ack(order["cid"], order["id"])
+        return ladder
+
+    def price(self, level):
+        return self.start * (1 + self.step) ** level
+
+    def level_of(self, price):
+        """Nearest level of a price."""
+        n, ratio = 0, price / self.start
+        while ratio >= (1 + self.step) ** (n + 0.5):
+            n += 1
+        while ratio < (1 + self.step) ** (n - 0.5):
+            n -= 1
+        return n
+
+    def target(self) -> dict[int, str]:
+        """Side wanted on every level around mid."""
+        target = {self.mid - j: "buy" for j in range(1, self.levels + 1)}
+        target.update({self.mid + j: "sell" for j in range(1, self.levels + 1)})
+        return target
+
+    def add(self, level, side, cid):
+        if level in self.orders:
+            self.remove(level)
+        bisect.insort(self.sorted_levels, level)
+        self.orders[level] = {"side": side, "cid": cid, "id": None}
+        self.cids[cid] = level
+
+    def remove(self, level) -> dict:
+        order = self.orders.pop(level)
+        del self.sorted_levels[bisect.bisect_left(self.sorted_levels, level)]
+        self.cids.pop(order["cid"], None)
+        return order
+
+    def find(self, cid):
+        return self.cids.get(cid)
+
+    def ack(self, cid, order_id):
+        level = self.cids.get(cid)
+        if level is not None:
+            self.orders[level]["id"] = order_id
+
+    def reject(self, cid):
+        level = self.cids.get(cid)
+        if level is not None:
+            self.remove(level)
+
+    def fill(self, cid) -> int:
+        """Remove the filled order and move mid to its level."""
+        level = self.cids[cid]
+        self.remove(level)
+        self.mid = level
+        return level
+
+    def diff(self, allowed=lambda level, side: True):
+        """Return the delta between the resting orders and the target.
+
+        Levels to cancel, levels whose order must change side (replace) and
+        levels to place, each as sorted lists. allowed(level, side) filters
+        out target levels beyond the grid range.
+        """
+        target = {
+            level: side for level, side in self.target().items() if allowed(level, side)
+        }
+        cancel, replace = [], []
+        # resting orders outside the target window sit at both ends
+        lo = bisect.bisect_left(self.sorted_levels, self.mid - self.levels)
+        hi = bisect.bisect_right(self.sorted_levels, self.mid + self.levels)
+        cancel += self.sorted_levels[:lo] + self.sorted_levels[hi:]
+        for level in self.sorted_levels[lo:hi]:
+            if level not in target:
+                cancel.append(level)
+            elif self.orders[level]["side"] != target[level]:
+                replace.append(level)
+        place = sorted(level for level in target if level not in self.orders)
+        return sorted(cancel), replace, place
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+from decimal import Decimal as D
+
+import numpy as np
+from aiohttp import ClientSession
+
+import utils
+from main import Main, logger, handler, alert_handler
+from mock_exchange import MockExchange
+
+LAG_INTERVAL = 0.01
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_exchange(prices, port, tick_size, step_size, min_notional):
+    """Serve the mock exchange in its own process, so it does not add to the lag."""
+
+    async def run():
+        exchange = MockExchange(prices, tick_size, step_size, min_notional)
+        await exchange.serve(port=port)
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+async def measure_lag(lags: list, interval=LAG_INTERVAL):
+    """Record how late the event loop wakes up from a sleep of interval."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {}
+    values = np.array(values) * 1000
+    return {
+        "count": len(values),
+        **{
+            f"p{q}": round(float(np.percentile(values, q)), 3)
+            for q in [50, 90, 99, 99.9]
+        },
+        "max": round(float(values.max()), 3),
+    }
+
+
+async def stop(task):
+    # the wait_for in the recv() of python-binance can swallow a cancel
+    while not task.done():
+        task.cancel()
+        await asyncio.wait([task], timeout=0.1)
+
+
+async def wait_until_up(session, url, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(f"{url}/api/v3/ping"):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def benchmark(args, url) -> dict:
+    grids = {
+        symbol: {
+            "symbol": symbol,
+            "step": args.step,
+            "quote": args.quote,
+            "levels": args.levels,
+        }
+        for symbol in args.symbols
+    }
+    bot = Main(grids, order_limit=args.order_limit, weight_limit=args.weight_limit)
+    lags = []
+    async with ClientSession() as session:
+        await wait_until_up(session, url)
+        tasks = [
+            asyncio.create_task(bot.main()),
+            asyncio.create_task(measure_lag(lags)),
+        ]
+        await asyncio.sleep(args.warmup)
+        async with session.get(f"{url}/mock/stats", params={"reset": "1"}):
+            pass
+        lags.clear()
+
+        await session.post(f"{url}/mock/load", json={"rate": args.rate})
+        await asyncio.sleep(args.duration)
+        await session.post(f"{url}/mock/load", json={"rate": 0})
+        async with session.get(f"{url}/mock/stats") as res:
+            stats = await res.json()
+        scheduler = bot.scheduler.metrics()
+
+        for task in tasks:
+            await stop(task)
+        await bot.client.close_connection()
+
+    latencies = stats.pop("latencies")
+    return {
+        "symbols": len(args.symbols),
+        "levels": args.levels,
+        "rate": args.rate,
+        "duration": args.duration,
+        "fills_per_second": round(stats["fills"] / args.duration, 2),
+        "exchange": stats,
+        "fill_to_order_ms": percentiles(latencies),
+        "loop_lag_ms": percentiles(lags),
+        "scheduler": scheduler,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run Main against the mock exchange under a fill load"
+    )
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=100, help="fills per second")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--levels", type=int, default=1)
+    parser.add_argument("--step", type=float, default=0.005)
+    parser.add_argument("--quote", type=float, default=20)
+    parser.add_argument("--price", type=float, default=100)
+    parser.add_argument("--tick-size", default="0.01")
+    parser.add_argument("--step-size", default="0.001")
+    parser.add_argument("--min-notional", default="10")
+    parser.add_argument(
+        "--order-limit",
+        type=int,
+        default=1000,
+        help="orders per second of the scheduler, Binance allows 10",
+    )
+    parser.add_argument(
+        "--weight-limit",
+        type=int,
+        default=10**6,
+        help="request weight per minute of the scheduler, Binance allows 1200",
+    )
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    # no alerts from a load test, the mock process inherits the handlers too
+    logger.removeHandler(alert_handler)
+    handler.setLevel(args.log_level)
+
+    args.symbols = [f"MOCK{n:03d}USDT" for n in range(args.symbols)]
+    for symbol in args.symbols:
+        utils.filters[symbol] = utils.SymbolFilters(
+            D(args.tick_size), D(args.step_size), D(args.min_notional)
+        )
+
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    exchange = multiprocessing.Process(
+        target=run_exchange,
+        args=(
+            dict.fromkeys(args.symbols, args.price),
+            port,
+            args.tick_size,
+            args.step_size,
+            args.min_notional,
+        ),
+        daemon=True,
+    )
+    exchange.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["MOCK_EXCHANGE_URL"] = url
+        os.environ["FILL_STORE_PATH"] = os.path.join(tmp, "fills")
+        os.environ["SNAPSHOT_FILE"] = os.path.join(tmp, "grids.json")
+        try:
+            report = asyncio.run(benchmark(args, url))
+        finally:
+            exchange.terminate()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import re
+import time
+import queue
+from logging.handlers import QueueHandler
+
+LOG_QUEUE_SIZE = 10000
+ALERT_QUEUE_SIZE = 100
+ALERT_RATE = 20  # alerts per ALERT_INTERVAL, Telegram allows about 20/min
+ALERT_INTERVAL = 60.0
+DEDUP_WINDOW = 600.0
+
+# prices, quantities, order ids and clientOrderIds
+VARIABLE = re.compile(r"[0-9a-f]{16,}|\d+(\.\d+)?")
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that counts and drops records while the queue is full.
+
+    Handlers that block (files, HTTP) run behind the queue in a
+    QueueListener thread, so logging never stalls the event loop.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = {"queue_full": 0}
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped["queue_full"] += 1
+
+
+class AlertQueueHandler(DroppingQueueHandler):
+    """Queues alerts at a limited rate and without repeats.
+
+    Records that differ only in numbers and ids are repeats, they are
+    dropped for DEDUP_WINDOW seconds after the first one was sent and
+    counted on the next one that goes out.
+    """
+
+    def __init__(
+        self,
+        queue,
+        rate=ALERT_RATE,
+        interval=ALERT_INTERVAL,
+        window=DEDUP_WINDOW,
+        clock=time.monotonic,
+    ):
+        super().__init__(queue)
+        self.rate = rate
+        self.interval = interval
+        self.window = window
+        self.clock = clock
+        self.tokens = float(rate)
+        self.updated_at = clock()
+        self.sent: dict[str, list] = {}  # key -> [sent at, repeats dropped since]
+        self.dropped.update(duplicate=0, rate_limited=0)
+
+    def emit(self, record):
+        try:
+            now = self.clock()
+            key = VARIABLE.sub("#", record.getMessage())
+            sent = self.sent.get(key)
+            if sent is not None and now - sent[0] < self.window:
+                sent[1] += 1
+                self.dropped["duplicate"] += 1
+                return
+
+            self.tokens = min(
+                self.rate,
+                self.tokens + (now - self.updated_at) * self.rate / self.interval,
+            )
+            self.updated_at = now
+            if self.tokens < 1:
+                self.dropped["rate_limited"] += 1
+                return
+            self.tokens -= 1
+
+            record = self.prepare(record)
+            if sent is not None and sent[1]:
+                record.msg += f"\n({sent[1]} similar messages dropped)"
+            if len(self.sent) > 1000:
+                self.sent = {
+                    k: v for k, v in self.sent.items() if now - v[0] < self.window
+                }
+            self.sent[key] = [now, 0]
+            self.enqueue(record)
+        except Exception:
+            self.handleError(record)
@@ -3,21 +3,35 @@ import os
 import asyncio
 import logging
 import json
+import queue
+import atexit
 import signal
+import time
+import uuid
 
-import tinydb
-
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueListener
 from telegram_handler import TelegramHandler
 
-from binance import AsyncClient, BinanceSocketManager
+from binance import AsyncClient
 from binance.exceptions import BinanceAPIException
 
-from utils import quantize_qty, quantize_price
-from utils import get_quote, get_step, get_bottom, get_top
+from utils import quantize_qty, quantize_price, load_symbols, EXCHANGE_INFO_RETRY
+from utils import get_quote, get_step, get_bottom, get_top, get_price, in_range
+from store import open_fill_store, FSYNC_INTERVAL
+from scheduler import RequestScheduler, CANCEL, REPLACE, PLACE, OTHER
+from scheduler import ORDER_LIMIT, WEIGHT_LIMIT
+from ladder import Ladder
+from snapshot import GridSnapshot, SNAPSHOT_INTERVAL
+from stream import UserStream, execution_report, BACKFILL_MARGIN
+from recenter import Recenter
+from endpoints import mock_client
+from metrics import registry, serve_metrics, METRICS_HOST, METRICS_PORT
+from logs import DroppingQueueHandler, AlertQueueHandler
+from logs import LOG_QUEUE_SIZE, ALERT_QUEUE_SIZE
 
 logger = logging.getLogger("grid")
-logger.setLevel(logging.DEBUG)
+# LOG_LEVEL=INFO skips the per message debug records altogether
+logger.setLevel(os.environ.get("LOG_LEVEL", "DEBUG"))
 
 formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
@@ -26,7 +40,9 @@ handler.setLevel(logging.INFO)
 handler.setFormatter(formatter)
 
 
-debug_handler = RotatingFileHandler("debug.log", maxBytes=2 ** 30, backupCount=1)
+debug_handler = RotatingFileHandler(
+    os.environ.get("DEBUG_LOG_FILE", "debug.log"), maxBytes=2 ** 30, backupCount=1
+)
 debug_handler.setLevel(logging.DEBUG)
 debug_handler.setFormatter(formatter)
 
@@ -36,185 +52,735 @@ t_handler = TelegramHandler(
 t_handler.setLevel(logging.INFO)
 t_handler.setFormatter(formatter)
 
-logger.addHandler(handler)
-logger.addHandler(debug_handler)
-logger.addHandler(t_handler)
+# the handlers run in listener threads, Telegram in its own so a slow
+# request does not hold back the log files
+queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+alert_handler = AlertQueueHandler(queue.Queue(ALERT_QUEUE_SIZE))
+alert_handler.setLevel(logging.INFO)
+logger.addHandler(queue_handler)
+logger.addHandler(alert_handler)
+
+listeners = [
+    QueueListener(
+        queue_handler.queue, handler, debug_handler, respect_handler_level=True
+    ),
+    QueueListener(alert_handler.queue, t_handler, respect_handler_level=True),
+]
+for listener in listeners:
+    listener.start()
+    atexit.register(listener.stop)
+
+
+exchange_lag = registry.histogram(
+    "grid_exchange_lag_seconds",
+    "Local receive time minus the event (E) and trade (T) time of user data events",
+    "field",
+)
+stage_seconds = registry.histogram(
+    "grid_stage_seconds",
+    "Duration of the stages of the fill to requote cycle",
+    "stage",
+)
+
+
+CLIENT_ORDER_PREFIX = "grid"
+
+
+def new_client_order_id() -> str:
+    return CLIENT_ORDER_PREFIX + uuid.uuid4().hex[:28]
+
+
+async def create_client() -> AsyncClient:
+    """Client of the account, or of the mock exchange at MOCK_EXCHANGE_URL."""
+    url = os.environ.get("MOCK_EXCHANGE_URL")
+    if url:
+        return await mock_client(url)
+    return await AsyncClient.create(
+        os.environ.get("API_KEY"), os.environ.get("API_SECRET")
+    )
 
 
 class Main:
-    def __init__(self, grids):
+    """Grid bot, every symbol is owned by one actor task.
+
+    All changes of a grid dict happen in its actor, which handles the events
+    of its inbox one by one: fills from the user socket and acks/rejects of
+    the orders it placed. Orders get their clientOrderId before they are
+    sent, so a fill is matched to the grid even if the REST response of its
+    placement has not arrived yet.
+    """
+
+    def __init__(
+        self,
+        grids,
+        order_limit=ORDER_LIMIT,
+        weight_limit=WEIGHT_LIMIT,
+        order_count_limit=None,
+        ip_weight_limit=None,
+    ):
         self.client: AsyncClient = None
+        self.scheduler: RequestScheduler = None
+        self.order_limit = order_limit
+        self.weight_limit = weight_limit
+        self.order_count_limit = order_count_limit
+        self.ip_weight_limit = ip_weight_limit
         self.grids: dict[str, dict] = grids
-        self.filled = tinydb.TinyDB("db.json").table("filled")
+        self.filled = open_fill_store()
+        self.snapshot = GridSnapshot()
+        self.stream: UserStream = None
+        self.recenter: Recenter = None
+        self.inboxes: dict[str, asyncio.Queue] = {
+            symbol: asyncio.Queue() for symbol in grids
+        }
 
         self.loop = None
         self.tasks = set()
+        # receive time of the fill the actor is handling, and of the fills
+        # that orders not acked yet were placed for
+        self.fill_received_at = None
+        self.requotes: dict[str, float] = {}
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def post(self, symbol: str, event: dict, received_at=None) -> None:
+        self.inboxes[symbol].put_nowait((time.perf_counter(), received_at, event))
+
+    async def run_grid(self, grid: dict, state=None) -> None:
+        inbox = self.inboxes[grid["symbol"]]
+        # events that arrive meanwhile wait in the inbox
+        try:
+            if state:
+                await self.resume(grid, state)
+            else:
+                self.init_grid(grid)
+        except Exception:
+            logger.exception(f'failed to start the grid of {grid["symbol"]}')
+        while True:
+            posted_at, received_at, event = await inbox.get()
+            started = time.perf_counter()
+            stage_seconds.observe("inbox", started - posted_at)
+            self.fill_received_at = received_at
+            try:
+                self.on_event(grid, event)
+            except Exception:
+                logger.exception("unhandled exception happened in on_event()")
+                logger.error(f"grid: {grid}, event: {event}")
+            finally:
+                self.fill_received_at = None
+            stage_seconds.observe(f'on_{event["e"]}', time.perf_counter() - started)
+
+    def track(self, cid) -> None:
+        """Time the order from the fill being handled to its ack."""
+        if self.fill_received_at is not None:
+            self.requotes[cid] = self.fill_received_at
+
+    def on_event(self, grid: dict, event: dict) -> None:
+        if event["e"] == "recenter":
+            self.recenter_grid(grid, event["p"])
+        elif event["e"] == "executionReport":
+            if "ladder" in grid:
+                self.on_ladder_filled(grid, event)
+            else:
+                self.on_filled(grid, event)
+        elif "ladder" in grid:
+            if event["e"] == "ack":
+                grid["ladder"].ack(event["c"], event["i"])
+            elif event["e"] == "reject":
+                grid["ladder"].reject(event["c"])
+        elif event["e"] == "ack":
+            if grid.get(f'{event["side"]}_cid') == event["c"]:
+                grid[f'{event["side"]}_id'] = event["i"]
+        elif event["e"] == "reject":
+            if grid.get(f'{event["side"]}_cid') == event["c"]:
+                grid[f'{event["side"]}_cid'] = grid[f'{event["side"]}_id'] = None
+
+    def on_filled(self, grid: dict, msg: dict) -> None:
+        if msg["c"] == grid.get("buy_cid"):
+            side, other = "buy", "sell"
+        elif msg["c"] == grid.get("sell_cid"):
+            side, other = "sell", "buy"
+        else:
+            # If the order pair were filled at the same time, the latter one will not
+            # try to cancel or create new orders, but will only record the order
+            # information for statistical analysis
+            logger.warning(f"executionReport does not belong to grid.\n{msg}")
+            return
 
-    async def new_pair(self, grid: dict) -> None:
-        await asyncio.gather(self.buy(grid), self.sell(grid))
+        grid["mid"] = float(msg["p"])
+        cancel = (grid.get(f"{other}_cid"), grid.get(f"{other}_id"))
+        grid["buy_cid"] = grid["sell_cid"] = None
+        grid["buy_id"] = grid["sell_id"] = None
 
-    async def send_order(self, grid, side):
-        symbol = grid["symbol"]
-        ratio = 1 + get_step(grid) if side == "sell" else 1 - get_step(grid)
-        price = quantize_price(symbol, grid["mid"] * ratio)
+        # one new order for the filled side and one cancelReplace of the order
+        # on the other side, instead of a cancel and two new orders
+        self.place(grid, side, priority=REPLACE)
+        self.place(
+            grid, other, cancel=cancel if cancel[0] else None, priority=REPLACE
+        )
 
-        if side == "buy" and price < get_bottom(grid):
-            logger.warning(
-                f"{symbol} break bottom, cancel buy, price: {price}, config: {grid}"
+    def on_break(self, symbol: str, price: float) -> None:
+        self.post(symbol, {"e": "recenter", "p": price})
+
+    def recenter_grid(self, grid: dict, price: float) -> None:
+        """Move the band of the grid along with the price and quote around it."""
+        symbol = grid["symbol"]
+        bottom, top = get_bottom(grid), get_top(grid)
+        if bottom <= price <= top:
+            return
+        ratio = price / grid["start"]
+        grid["band"] = [bottom * ratio, top * ratio]
+        grid["bottom"], grid["top"] = grid["band"]
+        grid["start"] = grid["mid"] = price
+        logger.warning(
+            f"{symbol} recenter at {price}, bottom: {grid['bottom']}, "
+            f"top: {grid['top']}"
+        )
+        if "ladder" in grid:
+            grid["ladder"].mid = grid["ladder"].level_of(price)
+            self.requote_ladder(grid, REPLACE)
+            return
+        # the resting order of either side is moved with cancelReplace
+        for side in ["buy", "sell"]:
+            cid, order_id = grid.get(f"{side}_cid"), grid.get(f"{side}_id")
+            self.place(
+                grid, side, cancel=(cid, order_id) if cid else None, priority=REPLACE
             )
+
+    def on_ladder_filled(self, grid: dict, msg: dict) -> None:
+        ladder: Ladder = grid["ladder"]
+        if ladder.find(msg["c"]) is None:
+            logger.warning(f"executionReport does not belong to grid.\n{msg}")
             return
-        if side == "sell" and price > get_top(grid):
+        ladder.fill(msg["c"])
+        grid["mid"] = float(msg["p"])
+        self.requote_ladder(grid, REPLACE)
+
+    def init_ladder(self, grid: dict) -> None:
+        ladder = Ladder(grid["start"], get_step(grid), grid["levels"])
+        ladder.mid = ladder.level_of(grid["mid"])
+        grid["ladder"] = ladder
+        self.requote_ladder(grid, PLACE)
+
+    def requote_ladder(self, grid: dict, priority) -> None:
+        """Bring the resting orders of the ladder to its target, delta only."""
+        ladder: Ladder = grid["ladder"]
+        symbol = grid["symbol"]
+        bottom, top = get_bottom(grid), get_top(grid)
+        cancel, replace, place = ladder.diff(
+            lambda level, side: bottom <= ladder.price(level)
+            if side == "buy"
+            else ladder.price(level) <= top
+        )
+        target = ladder.target()
+        # an order leaving the window is moved to a new level of the same side
+        # with cancelReplace, what is left over is cancelled
+        spare = {"buy": [], "sell": []}
+        for level in cancel:
+            order = ladder.remove(level)
+            spare[order["side"]].append((order["cid"], order["id"]))
+        for level in replace:
+            order = ladder.remove(level)
+            self.place_level(
+                grid, level, target[level], (order["cid"], order["id"]), priority
+            )
+        for level in place:
+            side = target[level]
+            cancel = spare[side].pop() if spare[side] else None
+            self.place_level(grid, level, side, cancel, priority)
+        for cid, order_id in spare["buy"] + spare["sell"]:
+            self.spawn(self.cancel_order(symbol, cid, order_id))
+
+    def place_level(self, grid, level, side, cancel, priority):
+        ladder: Ladder = grid["ladder"]
+        symbol = grid["symbol"]
+        price = quantize_price(symbol, ladder.price(level))
+        qty = quantize_qty(symbol, get_quote(grid) / price)
+        cid = new_client_order_id()
+        ladder.add(level, side, cid)
+        self.track(cid)
+        self.spawn(self.send_order(symbol, side, price, qty, cid, cancel, priority))
+
+    def quote(self, grid, side):
+        """Return price and quantity of the next order on the side.
+
+        None if the price is out of the grid range.
+        """
+        symbol = grid["symbol"]
+        price = get_price(grid, side)
+        if not in_range(grid, side, price):
+            edge = "bottom" if side == "buy" else "top"
             logger.warning(
-                f"{symbol} break top, cancel sell, price: {price}, config: {grid}"
+                f"{symbol} break {edge}, cancel {side}, price: {price}, config: {grid}"
             )
+            return None
+        return price, quantize_qty(symbol, get_quote(grid) / price)
+
+    def place(self, grid, side, cancel=None, priority=PLACE):
+        """Assign the next order on the side and send it in the background.
+
+        cancel is the (clientOrderId, orderId) of an order to replace, the
+        new order is then sent through cancelReplace.
+        """
+        symbol = grid["symbol"]
+        order = self.quote(grid, side)
+        if order is None:
+            grid[f"{side}_cid"] = grid[f"{side}_id"] = None
+            if cancel:
+                self.spawn(self.cancel_order(symbol, *cancel))
             return
 
-        qty = quantize_qty(symbol, get_quote(grid) / price)
+        price, qty = order
+        cid = new_client_order_id()
+        grid[f"{side}_cid"], grid[f"{side}_id"] = cid, None
+        self.track(cid)
+        self.spawn(self.send_order(symbol, side, price, qty, cid, cancel, priority))
+
+    async def send_order(self, symbol, side, price, qty, cid, cancel, priority):
+        started = time.perf_counter()
         try:
-            f = (
-                self.client.order_limit_buy
-                if side == "buy"
-                else self.client.order_limit_sell
-            )
             logger.debug(
-                f"send order, symbol: {symbol}, side: {side}, price: {price}, quantity: {qty}"
+                "send order, symbol: %s, side: %s, price: %s, quantity: %s, "
+                "clientOrderId: %s, replace: %s",
+                symbol,
+                side,
+                price,
+                qty,
+                cid,
+                cancel,
             )
-            order = await f(symbol=symbol, price=price, quantity=qty)
-            grid[f"{side}_id"] = order["orderId"]
+            if cancel:
+                order = await self.scheduler.submit(
+                    priority,
+                    self.client.cancel_replace_order,
+                    order=True,
+                    symbol=symbol,
+                    side=side.upper(),
+                    type="LIMIT",
+                    timeInForce="GTC",
+                    price=price,
+                    quantity=qty,
+                    newClientOrderId=cid,
+                    cancelOrigClientOrderId=cancel[0],
+                    cancelReplaceMode="STOP_ON_FAILURE",
+                )
+                order = order["newOrderResponse"]
+            else:
+                f = (
+                    self.client.order_limit_buy
+                    if side == "buy"
+                    else self.client.order_limit_sell
+                )
+                order = await self.scheduler.submit(
+                    priority,
+                    f,
+                    order=True,
+                    symbol=symbol,
+                    price=price,
+                    quantity=qty,
+                    newClientOrderId=cid,
+                )
+            self.post(symbol, {"e": "ack", "side": side, "c": cid, "i": order["orderId"]})
+            acked = time.perf_counter()
+            stage_seconds.observe("send_order", acked - started)
+            if cid in self.requotes:
+                stage_seconds.observe("fill_to_ack", acked - self.requotes[cid])
         except BinanceAPIException as e:
             if e.code == -2010 and "insufficient balance" in e.message:
-                grid[f"{side}_id"] = None
+                self.post(symbol, {"e": "reject", "side": side, "c": cid})
                 logger.warning(f"{symbol} insufficient balance, side: {side}")
+            elif e.code == -2022:
+                # the cancel failed, so the new order was not attempted
+                self.cancel_failed(symbol, *cancel)
+                await self.send_order(symbol, side, price, qty, cid, None, priority)
+            elif e.code == -2021:
+                # the cancel succeeded but the new order was rejected
+                self.post(symbol, {"e": "reject", "side": side, "c": cid})
+                logger.warning(
+                    f"{symbol} order replaced but the new order failed, side: {side}, "
+                    f"reason: {e.message}"
+                )
             else:
                 raise
         except Exception as e:
             logger.exception("unhandled exception happened in send_order()")
-            logger.error(f"grid: {grid}, price: {price}, qty: {qty}, side: {side}")
-
-    async def buy(self, grid) -> None:
-        await self.send_order(grid, "buy")
-
-    async def sell(self, grid) -> None:
-        await self.send_order(grid, "sell")
+            logger.error(
+                f"symbol: {symbol}, price: {price}, qty: {qty}, side: {side}, clientOrderId: {cid}"
+            )
+        finally:
+            self.requotes.pop(cid, None)
 
-    async def cancel_order(self, symbol, order_id):
+    async def cancel_order(self, symbol, cid, order_id=None):
+        started = time.perf_counter()
         try:
-            await self.client.cancel_order(symbol=symbol, orderId=order_id)
+            await self.scheduler.submit(
+                CANCEL,
+                self.client.cancel_order,
+                symbol=symbol,
+                origClientOrderId=cid,
+            )
+            stage_seconds.observe("cancel_order", time.perf_counter() - started)
         except BinanceAPIException as e:
             if e.code == -2011 and e.message == "Unknown order sent.":
-                Filled = tinydb.Query()
-                ids = self.filled.update(
-                    {"cancel": True},
-                    (Filled.symbol == symbol) & (Filled.i == order_id),
-                )
-                if ids:
-                    logger.warning(
-                        "Failed to cancel the order but a filled record was found in the database."
-                        "This should be because the orders on both sides were filled at the same time."
-                        f"symbol: {symbol}, orderId: {order_id}."
-                    )
-                else:
-                    logger.error(
-                        "Failed to cancel the order and no filled record was found in the database."
-                        "This should be because the order was unexpectedly cancelled."
-                        f"symbol: {symbol}, orderId: {order_id}."
-                    )
+                self.cancel_failed(symbol, cid, order_id)
         except Exception:
             logger.exception("unhandled exception happened in cancel()")
-            logger.error(f"symbol: {symbol}, orderId: {order_id}")
+            logger.error(f"symbol: {symbol}, clientOrderId: {cid}, orderId: {order_id}")
+
+    def cancel_failed(self, symbol, cid, order_id):
+        if order_id and self.filled.mark_cancel(symbol, order_id):
+            logger.warning(
+                "Failed to cancel the order but a filled record was found in the database."
+                "This should be because the orders on both sides were filled at the same time."
+                f"symbol: {symbol}, clientOrderId: {cid}, orderId: {order_id}."
+            )
+        else:
+            logger.error(
+                "Failed to cancel the order and no filled record was found in the database."
+                "This should be because the order was unexpectedly cancelled."
+                f"symbol: {symbol}, clientOrderId: {cid}, orderId: {order_id}."
+            )
 
     async def handle_msg(self, msg):
+        received_at = time.perf_counter()
+        now = time.time() * 1000
         logger.debug(msg)
+        if "E" in msg:
+            exchange_lag.observe("event", (now - msg["E"]) / 1000)
         if (
             msg["e"] == "executionReport"
             and msg["X"] == "FILLED"
             and msg["s"] in self.grids
         ):
+            if self.filled.find(msg["s"], msg["i"]) is not None:
+                logger.info(f'{msg["s"]} fill of order {msg["i"]} is handled already')
+                return
+            exchange_lag.observe("trade", (now - msg["T"]) / 1000)
             self.filled.insert(msg)
-            grid = self.grids[msg["s"]]
+            self.post(msg["s"], msg, received_at)
+            stage_seconds.observe("handle_msg", time.perf_counter() - received_at)
+
+    async def backfill(self, since, replay=True):
+        """Fetch the fills since the time in ms that are not in the store.
+
+        They are replayed through handle_msg, or only stored if replay is
+        False. myTrades finds the orders traded in the gap, allOrders paged
+        from the oldest of them gives their clientOrderIds.
+        """
+        missed = await asyncio.gather(
+            *(self.backfill_symbol(symbol, since) for symbol in self.grids)
+        )
+        missed = sorted((msg for msgs in missed for msg in msgs), key=lambda m: m["T"])
+        for msg in missed:
+            logger.warning(f'{msg["s"]} backfill missed fill of order {msg["i"]}')
+            if replay:
+                await self.handle_msg(msg)
+            elif self.filled.find(msg["s"], msg["i"]) is None:
+                self.filled.insert(msg)
+        logger.info(f"backfilled {len(missed)} fills since {since}")
+
+    async def backfill_symbol(self, symbol, since) -> list[dict]:
+        trades, params = [], {"startTime": since}
+        while True:
+            page = await self.scheduler.submit(
+                OTHER,
+                self.client.get_my_trades,
+                weight=20,
+                symbol=symbol,
+                limit=1000,
+                **params,
+            )
+            trades += page
+            if len(page) < 1000:
+                break
+            params = {"fromId": page[-1]["id"] + 1}
+
+        by_order: dict[int, list] = {}
+        for trade in trades:
+            if self.filled.find(symbol, trade["orderId"]) is None:
+                by_order.setdefault(trade["orderId"], []).append(trade)
+        if not by_order:
+            return []
+        reports, wanted = [], set(by_order)
+        while wanted:
+            orders = await self.scheduler.submit(
+                OTHER,
+                self.client.get_all_orders,
+                weight=20,
+                symbol=symbol,
+                orderId=min(wanted),
+                limit=1000,
+            )
+            for order in orders:
+                order_id = order["orderId"]
+                if order_id in wanted:
+                    wanted.discard(order_id)
+                    if order["status"] == "FILLED":
+                        reports.append(execution_report(order, by_order[order_id]))
+            if len(orders) < 1000:
+                break
+            # the next page starts at the oldest order still missing
+            last = orders[-1]["orderId"]
+            wanted = {order_id for order_id in wanted if order_id > last}
+        return reports
+
+    async def on_gap(self, since):
+        try:
+            await self.backfill(since)
+        except Exception:
+            logger.exception(f"failed to backfill the fills since {since}")
+
+    def init_grid(self, grid):
+        sell_above, buy_below = grid.get("sell_above"), grid.get("buy_below")
+        if grid.get("levels", 1) > 1:
+            grid["mid"] = grid["start"]
+            self.init_ladder(grid)
+        elif sell_above and buy_below:
+            logger.error(
+                f'{grid["symbol"]} sell_above and buy_below are set at the same time.'
+            )
+        elif sell_above:
+            grid["mid"] = sell_above
+            self.place(grid, "sell")
+        elif buy_below:
+            grid["mid"] = buy_below
+            self.place(grid, "buy")
+        else:
+            grid["mid"] = grid["start"]
+            self.place(grid, "buy")
+            self.place(grid, "sell")
+
+    def find_fill(self, symbol, cid, order_id):
+        """The stored fill of an order of the snapshot, None if there is none.
+
+        The orderId is None if the snapshot was saved before the order was
+        acked, its clientOrderId is always known.
+        """
+        if order_id is not None:
+            return self.filled.find(symbol, order_id)
+        return self.filled.find_client_order(symbol, cid)
+
+    async def resume(self, grid, state):
+        """Continue the grid from its snapshot after a restart.
+
+        Orders of the snapshot that are still open are kept. Missing ones
+        whose fill is in the store are replayed as fills, the others were
+        cancelled and are placed again. Open orders of the bot that are not
+        in the snapshot are cancelled.
+        """
+        symbol = grid["symbol"]
+        orders = await self.scheduler.submit(
+            OTHER, self.client.get_open_orders, weight=6, symbol=symbol
+        )
+        open_orders = {order["clientOrderId"]: order for order in orders}
 
-            confirming = False
-            if msg["i"] not in [grid.get("buy_id"), grid.get("sell_id")]:
-                # Due to network delay, buy_id or sell_id may not be set in time
-                # wait for 10 seconds to reduce this possibility
-                logger.warning(
-                    f"executionReport may not belong to grid. Wait for 5 seconds to confirm.\n{msg}"
-                )
-                confirming = True
-                await asyncio.sleep(5)
+        ladder = state.get("ladder")
+        if (ladder is not None) != (grid.get("levels", 1) > 1) or (
+            ladder
+            and (ladder["levels"], ladder["step"]) != (grid["levels"], get_step(grid))
+        ):
+            logger.warning(f"{symbol} config changed, starting the grid over")
+            res = await self.scheduler.submit(
+                OTHER, self.client.get_symbol_ticker, symbol=symbol
+            )
+            grid["start"] = float(res["price"])
+            self.cancel_orphans(symbol, open_orders)
+            self.init_grid(grid)
+            return
 
-            if msg["i"] in [grid.get("buy_id"), grid.get("sell_id")]:
-                if confirming:
-                    logger.warning(
-                        f"executionReport has been confirmed to belong to grid. orderId: {msg['i']}"
-                    )
-                grid["mid"] = float(msg["p"])
-                if msg["i"] == grid.get("buy_id"):
-                    cancel_id = grid.get("sell_id")
+        grid["start"], grid["mid"] = state["start"], state["mid"]
+        if state.get("band") and grid.get("recenter"):
+            grid["band"] = state["band"]
+            grid["bottom"], grid["top"] = state["band"]
+        fills, missing = [], []
+        if ladder is not None:
+            grid["ladder"] = ladder = Ladder.from_state(ladder)
+            for level, order in list(ladder.orders.items()):
+                if order["cid"] in open_orders:
+                    ladder.ack(order["cid"], open_orders.pop(order["cid"])["orderId"])
+                    continue
+                fill = self.find_fill(symbol, order["cid"], order["id"])
+                if fill:
+                    fills.append(fill)
                 else:
-                    cancel_id = grid.get("buy_id")
-
-                # If the order pair were filled at the same time, the latter one will not
-                # try to cancel or create new orders, but will only record the order
-                # information for statistical analysis
-                grid["buy_id"] = grid["sell_id"] = None
-
-                if cancel_id:
-                    asyncio.create_task(
-                        self.cancel_order(symbol=msg["s"], order_id=cancel_id)
-                    )
-                asyncio.create_task(self.new_pair(grid))
-
-    async def init(self):
-        for grid in self.grids.values():
-            sell_above, buy_below = grid.get("sell_above"), grid.get("buy_below")
-            if sell_above and buy_below:
-                logger.error(
-                    f'{grid["symbol"]} sell_above and buy_below are set at the same time.'
-                )
-            elif sell_above:
-                grid["mid"] = sell_above
-                asyncio.create_task(self.sell(grid))
-            elif buy_below:
-                grid["mid"] = buy_below
-                asyncio.create_task(self.buy(grid))
-            else:
-                grid["mid"] = grid["start"]
-                asyncio.create_task(self.new_pair(grid))
+                    ladder.remove(level)
+                    missing.append(level)
+        else:
+            for side in ["buy", "sell"]:
+                cid, order_id = state[f"{side}_cid"], state[f"{side}_id"]
+                if cid is None:
+                    continue
+                grid[f"{side}_cid"], grid[f"{side}_id"] = cid, order_id
+                if cid in open_orders:
+                    grid[f"{side}_id"] = open_orders.pop(cid)["orderId"]
+                    continue
+                fill = self.find_fill(symbol, cid, order_id)
+                if fill:
+                    fills.append(fill)
+                else:
+                    grid[f"{side}_cid"] = grid[f"{side}_id"] = None
+                    missing.append(side)
 
-    def cleanup(self):
+        self.cancel_orphans(symbol, open_orders)
+        logger.info(
+            f"{symbol} resumed, mid: {grid['mid']}, fills to replay: {len(fills)}, "
+            f"orders to place again: {missing}"
+        )
+        for fill in sorted(fills, key=lambda fill: fill["T"]):
+            self.on_event(grid, fill)
+        if fills:
+            return
+        if ladder is not None:
+            self.requote_ladder(grid, PLACE)
+        else:
+            for side in missing:
+                self.place(grid, side)
+
+    def cancel_orphans(self, symbol, open_orders):
+        for cid, order in open_orders.items():
+            if cid.startswith(CLIENT_ORDER_PREFIX):
+                logger.warning(f"{symbol} cancel orphaned order {cid}")
+                self.spawn(self.cancel_order(symbol, cid, order["orderId"]))
+
+    async def save_snapshots(self):
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            try:
+                await self.snapshot.save(self.grids)
+            except Exception:
+                logger.exception("failed to save the snapshot")
+
+    async def sync_filled(self):
+        while True:
+            await asyncio.sleep(FSYNC_INTERVAL)
+            self.filled.sync()
+
+    async def refresh_filters(self):
+        """Refetch expired symbol filters off the loop, quantizing never waits."""
+        while True:
+            await asyncio.sleep(EXCHANGE_INFO_RETRY)
+            try:
+                await asyncio.to_thread(load_symbols, list(self.grids))
+            except Exception:
+                logger.exception("failed to refresh the symbol filters")
+
+    async def cleanup(self):
+        """Cancel the orders and wait for it.
+
+        The snapshot keeps the cancelled orders, so a restart places them
+        again.
+        """
         logger.warning("cleaning up")
+        self.filled.sync()
+        await self.snapshot.save(self.grids)
+        cancels = []
         for grid in self.grids.values():
-            buy_id, sell_id = grid.get("buy_id"), grid.get("sell_id")
-            logger.debug(
-                f'{grid["symbol"]} order to cancel: buy_id={buy_id}, sell_id={sell_id}'
-            )
-            if buy_id:
-                asyncio.create_task(self.cancel_order(grid["symbol"], buy_id))
-            if sell_id:
-                asyncio.create_task(self.cancel_order(grid["symbol"], sell_id))
+            if "ladder" in grid:
+                for order in grid["ladder"].orders.values():
+                    cancels.append(
+                        self.cancel_order(grid["symbol"], order["cid"], order["id"])
+                    )
+                continue
+            for side in ["buy", "sell"]:
+                cid, order_id = grid.get(f"{side}_cid"), grid.get(f"{side}_id")
+                logger.debug(
+                    "%s order to cancel: %s_cid=%s, %s_id=%s",
+                    grid["symbol"],
+                    side,
+                    cid,
+                    side,
+                    order_id,
+                )
+                if cid:
+                    cancels.append(self.cancel_order(grid["symbol"], cid, order_id))
+        await asyncio.gather(*cancels)
+        logger.warning(f"cancelled {len(cancels)} orders")
+
+    def export_metrics(self):
+        self.scheduler.export_metrics(registry)
+        registry.gauge(
+            "grid_log_dropped",
+            "Dropped log records and alerts, by reason",
+            lambda: {
+                **{f"log_{k}": v for k, v in queue_handler.dropped.items()},
+                **{f"alert_{k}": v for k, v in alert_handler.dropped.items()},
+            },
+            "reason",
+        )
+        registry.gauge(
+            "grid_inbox_depth",
+            "Events waiting in the inbox of every grid actor",
+            lambda: {symbol: inbox.qsize() for symbol, inbox in self.inboxes.items()},
+            "symbol",
+        )
 
     async def main(self):
         logger.info("start")
         self.loop = get_running_loop()
-        self.loop.add_signal_handler(signal.SIGINT, self.cleanup)
-        self.loop.add_signal_handler(signal.SIGTERM, self.cleanup)
-        self.client = await AsyncClient.create(
-            os.environ.get("API_KEY"), os.environ.get("API_SECRET")
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            self.loop.add_signal_handler(sig, lambda: self.spawn(self.cleanup()))
+        self.client = await create_client()
+
+        self.scheduler = RequestScheduler(
+            self.client,
+            weight_limit=self.weight_limit,
+            order_limit=self.order_limit,
+            order_count_limit=self.order_count_limit,
+            ip_weight_limit=self.ip_weight_limit,
         )
-
-        prices = await self.client.get_all_tickers()
-        prices = {price["symbol"]: float(price["price"]) for price in prices}
-        for grid in self.grids.values():
-            grid["mid"] = grid["start"] = float(prices[grid["symbol"]])
-
-        bsm = BinanceSocketManager(self.client)
-        us = bsm.user_socket()
-        async with us as s:
-            asyncio.create_task(self.init())
+        self.scheduler.start()
+        self.export_metrics()
+        port = int(os.environ.get("METRICS_PORT", METRICS_PORT))
+        if port:
+            try:
+                await serve_metrics(os.environ.get("METRICS_HOST", METRICS_HOST), port)
+            except OSError as e:
+                logger.error(f"failed to serve metrics on port {port}: {e}")
+
+        states = self.snapshot.load()
+        cold = [grid for symbol, grid in self.grids.items() if symbol not in states]
+        if cold:
+            prices = await self.client.get_all_tickers()
+            prices = {price["symbol"]: float(price["price"]) for price in prices}
+            for grid in cold:
+                grid["mid"] = grid["start"] = float(prices[grid["symbol"]])
+
+        self.stream = UserStream(
+            self.client, self.on_gap, os.environ.get("MOCK_EXCHANGE_URL")
+        )
+        await self.stream.open()
+        try:
+            saved_at = self.snapshot.saved_at()
+            if saved_at is not None:
+                # fills while the bot was down, resume replays them
+                await self.backfill(saved_at - BACKFILL_MARGIN, replay=False)
+            for symbol, grid in self.grids.items():
+                self.spawn(self.run_grid(grid, states.get(symbol)))
+            self.spawn(self.sync_filled())
+            self.spawn(self.save_snapshots())
+            self.spawn(self.refresh_filters())
+            recentered = {
+                symbol: grid
+                for symbol, grid in self.grids.items()
+                if grid.get("recenter")
+            }
+            if recentered:
+                self.recenter = Recenter(
+                    self.client,
+                    recentered,
+                    self.on_break,
+                    os.environ.get("MOCK_EXCHANGE_URL"),
+                )
+                self.spawn(self.recenter.run())
+                self.spawn(self.recenter.watch())
             while True:
-                msg = await s.recv()
-                asyncio.create_task(self.handle_msg(msg))
+                msg = await self.stream.recv()
+                await self.handle_msg(msg)
+        finally:
+            await self.stream.close()
 
 
 def load_config():
@@ -226,5 +792,7 @@ def load_config():
     return grids
 
 
-grids = load_config()
-asyncio.run(Main(grids).main())
+if __name__ == "__main__":
+    grids = load_config()
+    load_symbols(list(grids))
+    asyncio.run(Main(grids).main())
@@ -0,0 +1,167 @@
+import bisect
+import logging
+
+from aiohttp import web
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# seconds, from a fast local step up to a stalled REST request
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+logger = logging.getLogger("grid.metrics")
+
+
+class Histogram:
+    """Cumulative histogram of one label combination."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class HistogramFamily:
+    """Histograms of one metric name, one per label value."""
+
+    def __init__(self, name, help, label, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.children: dict[str, Histogram] = {}
+
+    def labels(self, value) -> Histogram:
+        child = self.children.get(value)
+        if child is None:
+            child = self.children[value] = Histogram(self.buckets)
+        return child
+
+    def observe(self, value, seconds: float) -> None:
+        self.labels(value).observe(seconds)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, child in sorted(self.children.items()):
+            label = f'{self.label}="{value}"'
+            total = 0
+            for bound, count in zip(self.buckets, child.counts):
+                total += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {total}')
+            total += child.counts[-1]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {total}')
+            lines.append(f"{self.name}_sum{{{label}}} {child.sum}")
+            lines.append(f"{self.name}_count{{{label}}} {total}")
+        return lines
+
+
+class Gauge:
+    """Value read from f() at scrape time, f returns a number or {label: number}."""
+
+    def __init__(self, name, help, f, label=None):
+        self.name = name
+        self.help = help
+        self.f = f
+        self.label = label
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.f()
+        if self.label is None:
+            lines.append(f"{self.name} {value}")
+        else:
+            for key, item in value.items():
+                lines.append(f'{self.name}{{{self.label}="{key}"}} {item}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, name, help, label, buckets=BUCKETS) -> HistogramFamily:
+        metric = HistogramFamily(name, help, label, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, f, label=None) -> Gauge:
+        metric = Gauge(name, help, f, label)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines += metric.render()
+            except Exception:
+                logger.exception(f"failed to render {metric.name}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def add_label(line: str, label: str, value: str) -> str:
+    name, _, rest = line.partition(" ")
+    if "{" in name:
+        return line.replace("{", f'{{{label}="{value}",', 1)
+    return f'{name}{{{label}="{value}"}} {rest}'
+
+
+def merge_metrics(texts: dict[str, str], label: str) -> str:
+    """Merge the scrapes of several processes, keyed by the value of label.
+
+    The samples of a metric from all processes are kept together under one
+    HELP and TYPE line, as the text format requires.
+    """
+    families: dict[str, list[str]] = {}
+    for value, text in texts.items():
+        lines = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                name = line.split(" ", 3)[2]
+                lines = families.get(name)
+                if lines is None:
+                    lines = families[name] = [line]
+                elif line not in lines[:2]:
+                    lines.insert(1, line)
+            elif line and lines is not None:
+                lines.append(add_label(line, label, value))
+    return "\n".join(line for lines in families.values() for line in lines) + "\n"
+
+
+async def serve_metrics(host=METRICS_HOST, port=METRICS_PORT, registry=registry):
+    """Serve the registry in the Prometheus text format on /metrics."""
+
+    async def metrics(request):
+        return web.Response(
+            text=registry.render(), content_type="text/plain", charset="utf-8"
+        )
+
+    app = web.Application()
+    app.add_routes([web.get("/metrics", metrics)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,16 @@
+#%%
+import sys
+from tinydb import TinyDB
+from store import JournalFillStore
+
+t = TinyDB("db.json").table("filled")
+j = JournalFillStore("fills")
+if len(j):
+    sys.exit(f"journal already contains {len(j)} fills, refusing to migrate twice")
+for item in t.all():
+    cancel = item.pop("cancel", False)
+    j.insert(item)
+    if cancel:
+        j.mark_cancel(item["s"], item["i"])
+j.close()
+print(f"migrated {len(j)} fills from db.json to fills/")
@@ -0,0 +1,590 @@
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import itertools
+from collections import deque
+from decimal import Decimal as D
+
+from aiohttp import web, WSMsgType
+
+WEIGHT_INTERVAL = 60.0
+ORDER_INTERVAL = 10.0
+MEAN_REVERSION = 10.0
+
+logger = logging.getLogger("grid.mock")
+
+
+class MockExchange:
+    """Local stand-in for the spot REST API, the user data and bookTicker streams.
+
+    Limit orders rest until fill() is called, which sends an executionReport
+    to every user data subscriber. Both the websocket API subscription used by
+    recent python-binance versions and the listenKey stream of older ones are
+    served. The time from a fill to the next order of its symbol is recorded
+    as the fill-to-new-order latency.
+    """
+
+    def __init__(
+        self, prices, tick_size="0.0001", step_size="0.001", min_notional="10"
+    ):
+        self.prices: dict[str, float] = dict(prices)
+        self.start_prices = dict(prices)
+        self.tick_size = tick_size
+        self.step_size = step_size
+        self.min_notional = min_notional
+
+        self.orders: dict[int, dict] = {}  # open orders by orderId
+        self.filled: list[dict] = []  # filled orders and their trades
+        self.trades: list[dict] = []
+        self.cids: dict[tuple[str, str], int] = {}  # (symbol, clientOrderId)
+        self.order_ids = itertools.count(1)
+        self.trade_ids = itertools.count(1)
+        self.subscribers: dict[web.WebSocketResponse, int] = {}
+        self.subscription_ids = itertools.count()
+        # bookTicker subscribers and the symbols they follow
+        self.tickers: dict[web.WebSocketResponse, set[str]] = {}
+        self.update_ids = itertools.count(1)
+        # every open websocket, closed on shutdown so cleanup does not wait
+        self.sockets: set[web.WebSocketResponse] = set()
+
+        self.weights = deque()
+        self.order_times = deque()
+        self.filled_at: dict[str, float] = {}
+        self.latencies: list[float] = []
+        self.counts = {
+            "orders": 0,
+            "cancels": 0,
+            "replaces": 0,
+            "fills": 0,
+            "errors": 0,
+            "drops": 0,
+        }
+        self.load = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.on_shutdown.append(self.close_sockets)
+        app.add_routes(
+            [
+                web.get("/api/v3/ping", self.ping),
+                web.get("/api/v3/time", self.server_time),
+                web.get("/api/v3/ticker/price", self.ticker_price),
+                web.get("/api/v3/exchangeInfo", self.exchange_info),
+                web.post("/api/v3/order", self.new_order),
+                web.delete("/api/v3/order", self.cancel_order),
+                web.get("/api/v3/order", self.get_order),
+                web.post("/api/v3/order/cancelReplace", self.cancel_replace),
+                web.get("/api/v3/openOrders", self.open_orders),
+                web.get("/api/v3/allOrders", self.all_orders),
+                web.get("/api/v3/myTrades", self.my_trades),
+                web.post("/api/v3/userDataStream", self.listen_key),
+                web.put("/api/v3/userDataStream", self.listen_key),
+                web.delete("/api/v3/userDataStream", self.listen_key),
+                web.get("/ws-api/v3", self.websocket_api),
+                web.get("/ws/{listen_key}", self.user_stream),
+                web.get("/stream", self.market_stream),
+                web.get("/mock/stats", self.get_stats),
+                web.post("/mock/load", self.set_load),
+                web.post("/mock/drop", self.drop),
+                web.post("/mock/price", self.set_price),
+            ]
+        )
+        return app
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"mock exchange listening on http://{host}:{port}")
+        return runner
+
+    # responses
+
+    def respond(self, data, status=200, weight=1, order=False):
+        now = time.monotonic()
+        self.weights.append((now, weight))
+        while now - self.weights[0][0] >= WEIGHT_INTERVAL:
+            self.weights.popleft()
+        if order:
+            self.order_times.append(now)
+        while self.order_times and now - self.order_times[0] >= ORDER_INTERVAL:
+            self.order_times.popleft()
+        headers = {
+            "x-mbx-used-weight-1m": str(sum(w for _, w in self.weights)),
+            "x-mbx-order-count-10s": str(len(self.order_times)),
+        }
+        return web.json_response(data, status=status, headers=headers)
+
+    def error(self, code, msg, status=400, data=None, **kwargs):
+        self.counts["errors"] += 1
+        body = {"code": code, "msg": msg}
+        if data is not None:
+            body["data"] = data
+        return self.respond(body, status=status, **kwargs)
+
+    @staticmethod
+    async def params(request) -> dict:
+        params = dict(request.query)
+        if request.can_read_body:
+            params.update(await request.post())
+        return params
+
+    # orders
+
+    def find(self, params):
+        if "orderId" in params:
+            return self.orders.get(int(params["orderId"]))
+        order_id = self.cids.get((params["symbol"], params.get("origClientOrderId")))
+        return self.orders.get(order_id)
+
+    def place(self, params) -> dict:
+        symbol = params["symbol"]
+        if symbol not in self.prices:
+            raise ValueError((-1121, "Invalid symbol."))
+        cid = params.get("newClientOrderId") or f"mock{next(self.order_ids)}"
+        if (symbol, cid) in self.cids:
+            raise ValueError((-2010, "Duplicate order sent."))
+
+        started = self.filled_at.pop(symbol, None)
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+
+        now = int(time.time() * 1000)
+        order = {
+            "symbol": symbol,
+            "orderId": next(self.order_ids),
+            "orderListId": -1,
+            "clientOrderId": cid,
+            "transactTime": now,
+            "price": params["price"],
+            "origQty": params["quantity"],
+            "executedQty": "0",
+            "cummulativeQuoteQty": "0",
+            "status": "NEW",
+            "timeInForce": params.get("timeInForce", "GTC"),
+            "type": params.get("type", "LIMIT"),
+            "side": params["side"],
+            "time": now,
+            "updateTime": now,
+            "workingTime": now,
+        }
+        self.orders[order["orderId"]] = order
+        self.cids[(symbol, cid)] = order["orderId"]
+        self.counts["orders"] += 1
+        return order
+
+    def remove(self, order) -> dict:
+        del self.orders[order["orderId"]]
+        del self.cids[(order["symbol"], order["clientOrderId"])]
+        return dict(order, status="CANCELED")
+
+    async def ping(self, request):
+        return self.respond({})
+
+    async def server_time(self, request):
+        return self.respond({"serverTime": int(time.time() * 1000)})
+
+    async def ticker_price(self, request):
+        symbol = request.query.get("symbol")
+        if symbol:
+            return self.respond({"symbol": symbol, "price": str(self.prices[symbol])})
+        return self.respond(
+            [{"symbol": s, "price": str(p)} for s, p in self.prices.items()], weight=4
+        )
+
+    async def exchange_info(self, request):
+        symbols = [
+            {
+                "symbol": symbol,
+                "status": "TRADING",
+                "filters": [
+                    {"filterType": "PRICE_FILTER", "tickSize": self.tick_size},
+                    {"filterType": "LOT_SIZE", "stepSize": self.step_size},
+                    {"filterType": "NOTIONAL", "minNotional": self.min_notional},
+                ],
+            }
+            for symbol in self.prices
+        ]
+        return self.respond({"symbols": symbols}, weight=20)
+
+    async def new_order(self, request):
+        try:
+            order = self.place(await self.params(request))
+        except ValueError as e:
+            return self.error(*e.args[0], order=True)
+        return self.respond(order, order=True)
+
+    async def cancel_order(self, request):
+        order = self.find(await self.params(request))
+        if order is None:
+            return self.error(-2011, "Unknown order sent.")
+        self.counts["cancels"] += 1
+        return self.respond(self.remove(order))
+
+    async def get_order(self, request):
+        order = self.find(await self.params(request))
+        if order is None:
+            return self.error(-2013, "Order does not exist.", weight=4)
+        return self.respond(order, weight=4)
+
+    async def cancel_replace(self, request):
+        params = await self.params(request)
+        order = self.find(
+            {
+                "symbol": params["symbol"],
+                "origClientOrderId": params.get("cancelOrigClientOrderId"),
+                **(
+                    {"orderId": params["cancelOrderId"]}
+                    if "cancelOrderId" in params
+                    else {}
+                ),
+            }
+        )
+        if order is None:
+            # STOP_ON_FAILURE, the new order is not attempted
+            return self.error(
+                -2022,
+                "Order cancel-replace failed.",
+                data={
+                    "cancelResult": "FAILURE",
+                    "newOrderResult": "NOT_ATTEMPTED",
+                    "cancelResponse": {"code": -2011, "msg": "Unknown order sent."},
+                    "newOrderResponse": None,
+                },
+                order=True,
+            )
+        cancelled = self.remove(order)
+        try:
+            new_order = self.place(params)
+        except ValueError as e:
+            code, msg = e.args[0]
+            return self.error(
+                -2021,
+                "Order cancel-replace partially failed.",
+                data={
+                    "cancelResult": "SUCCESS",
+                    "newOrderResult": "FAILURE",
+                    "cancelResponse": cancelled,
+                    "newOrderResponse": {"code": code, "msg": msg},
+                },
+                order=True,
+            )
+        self.counts["replaces"] += 1
+        return self.respond(
+            {
+                "cancelResult": "SUCCESS",
+                "newOrderResult": "SUCCESS",
+                "cancelResponse": cancelled,
+                "newOrderResponse": new_order,
+            },
+            order=True,
+        )
+
+    async def open_orders(self, request):
+        symbol = request.query.get("symbol")
+        orders = [o for o in self.orders.values() if symbol in (None, o["symbol"])]
+        return self.respond(orders, weight=6 if symbol else 80)
+
+    async def all_orders(self, request):
+        """Open and filled orders of the symbol, cancelled ones are not kept."""
+        symbol, params = request.query["symbol"], request.query
+        orders = [
+            o
+            for o in self.filled + list(self.orders.values())
+            if o["symbol"] == symbol
+            and o["orderId"] >= int(params.get("orderId", 0))
+            and o["time"] >= int(params.get("startTime", 0))
+        ]
+        orders.sort(key=lambda o: o["orderId"])
+        return self.respond(orders[: int(params.get("limit", 500))], weight=20)
+
+    async def my_trades(self, request):
+        symbol, params = request.query["symbol"], request.query
+        trades = [
+            t
+            for t in self.trades
+            if t["symbol"] == symbol
+            and t["id"] >= int(params.get("fromId", 0))
+            and t["time"] >= int(params.get("startTime", 0))
+        ]
+        return self.respond(trades[: int(params.get("limit", 500))], weight=20)
+
+    async def listen_key(self, request):
+        return self.respond({"listenKey": "mock"})
+
+    async def close_sockets(self, app) -> None:
+        for ws in list(self.sockets):
+            await ws.close()
+
+    # user data stream
+
+    async def websocket_api(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.sockets.add(ws)
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                req = json.loads(msg.data)
+                result = {}
+                if req["method"].startswith("userDataStream.subscribe"):
+                    self.subscribers[ws] = next(self.subscription_ids)
+                    result = {"subscriptionId": self.subscribers[ws]}
+                elif req["method"] == "userDataStream.unsubscribe":
+                    self.subscribers.pop(ws, None)
+                await ws.send_json({"id": req["id"], "status": 200, "result": result})
+        finally:
+            self.subscribers.pop(ws, None)
+            self.sockets.discard(ws)
+        return ws
+
+    async def user_stream(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.sockets.add(ws)
+        self.subscribers[ws] = None
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            self.subscribers.pop(ws, None)
+            self.sockets.discard(ws)
+        return ws
+
+    # market streams
+
+    async def market_stream(self, request):
+        """Combined stream, only <symbol>@bookTicker streams are sent."""
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.sockets.add(ws)
+        self.tickers[ws] = {
+            stream.split("@")[0].upper()
+            for stream in request.query.get("streams", "").split("/")
+            if stream.endswith("@bookTicker")
+        }
+        try:
+            for symbol in self.tickers[ws]:
+                await self.send_book_ticker(symbol, [ws])
+            async for _ in ws:
+                pass
+        finally:
+            self.tickers.pop(ws, None)
+            self.sockets.discard(ws)
+        return ws
+
+    async def send_book_ticker(self, symbol, subscribers=None) -> None:
+        """The price as best bid and ask one tick apart."""
+        if not self.tickers:
+            return
+        price, tick = D(str(self.prices[symbol])), D(self.tick_size)
+        ticker = {
+            "u": next(self.update_ids),
+            "s": symbol,
+            "b": str(price - tick),
+            "B": "1",
+            "a": str(price + tick),
+            "A": "1",
+        }
+        msg = json.dumps({"stream": f"{symbol.lower()}@bookTicker", "data": ticker})
+        for ws in subscribers or list(self.tickers):
+            if symbol not in self.tickers.get(ws, ()):
+                continue
+            try:
+                await ws.send_str(msg)
+            except ConnectionResetError:
+                self.tickers.pop(ws, None)
+
+    async def set_price(self, request):
+        """Move the market price of a symbol, {"symbol": ..., "price": ...}."""
+        params = await request.json()
+        self.prices[params["symbol"]] = float(params["price"])
+        await self.send_book_ticker(params["symbol"])
+        return web.json_response(params)
+
+    async def fill(self, order) -> dict:
+        """Fill the open order completely and send its executionReport."""
+        del self.orders[order["orderId"]]
+        del self.cids[(order["symbol"], order["clientOrderId"])]
+        now = int(time.time() * 1000)
+        price, qty = D(order["price"]), D(order["origQty"])
+        quote = str(price * qty)
+        event = {
+            "e": "executionReport",
+            "E": now,
+            "s": order["symbol"],
+            "c": order["clientOrderId"],
+            "S": order["side"],
+            "o": order["type"],
+            "f": order["timeInForce"],
+            "q": order["origQty"],
+            "p": order["price"],
+            "x": "TRADE",
+            "X": "FILLED",
+            "i": order["orderId"],
+            "l": order["origQty"],
+            "z": order["origQty"],
+            "L": order["price"],
+            "n": "0",
+            "N": None,
+            "T": now,
+            "t": next(self.trade_ids),
+            "m": True,
+            "O": order["transactTime"],
+            "Z": quote,
+            "Y": quote,
+            "Q": "0",
+        }
+        self.filled.append(
+            dict(
+                order,
+                status="FILLED",
+                executedQty=order["origQty"],
+                cummulativeQuoteQty=quote,
+                updateTime=now,
+            )
+        )
+        self.trades.append(
+            {
+                "symbol": order["symbol"],
+                "id": event["t"],
+                "orderId": order["orderId"],
+                "orderListId": -1,
+                "price": order["price"],
+                "qty": order["origQty"],
+                "quoteQty": quote,
+                "commission": "0",
+                "commissionAsset": None,
+                "time": now,
+                "isBuyer": order["side"] == "BUY",
+                "isMaker": True,
+                "isBestMatch": True,
+            }
+        )
+        self.prices[order["symbol"]] = float(price)
+        await self.send_book_ticker(order["symbol"])
+        self.counts["fills"] += 1
+        self.filled_at.setdefault(order["symbol"], time.perf_counter())
+        for ws, subscription_id in list(self.subscribers.items()):
+            msg = event
+            if subscription_id is not None:
+                msg = {"subscriptionId": subscription_id, "event": event}
+            try:
+                await ws.send_str(json.dumps(msg))
+            except ConnectionResetError:
+                self.subscribers.pop(ws, None)
+        return event
+
+    def pick(self):
+        """The open order a market move would hit first on a random symbol.
+
+        Prices revert to where they started, buys get more likely the
+        higher the price went, so the grids stay within their range.
+        """
+        if not self.orders:
+            return None
+        symbol = random.choice([o["symbol"] for o in self.orders.values()])
+        drift = self.prices[symbol] / self.start_prices[symbol] - 1
+        side = "BUY" if random.random() < 0.5 + drift * MEAN_REVERSION else "SELL"
+        orders = [o for o in self.orders.values() if o["symbol"] == symbol]
+        same_side = [o for o in orders if o["side"] == side] or orders
+        if same_side[0]["side"] == "BUY":
+            return max(same_side, key=lambda o: D(o["price"]))
+        return min(same_side, key=lambda o: D(o["price"]))
+
+    async def generate_fills(self, rate, poisson=True):
+        """Fill open orders at rate fills per second until cancelled.
+
+        Arrivals are a Poisson process unless poisson is False, fills that
+        fall behind schedule are sent back to back to keep the rate.
+        """
+        next_at = time.perf_counter()
+        while True:
+            next_at += random.expovariate(rate) if poisson else 1 / rate
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            order = self.pick()
+            if order is not None:
+                await self.fill(order)
+
+    async def set_load(self, request):
+        params = await request.json()
+        if self.load is not None:
+            self.load.cancel()
+            self.load = None
+        if params.get("rate"):
+            self.load = asyncio.create_task(
+                self.generate_fills(params["rate"], params.get("poisson", True))
+            )
+        return web.json_response({"rate": params.get("rate", 0)})
+
+    async def drop(self, request):
+        """Close every user data connection, then fill n orders nobody hears of."""
+        params = await request.json() if request.can_read_body else {}
+        subscribers, self.subscribers = list(self.subscribers), {}
+        for ws in subscribers:
+            await ws.close()
+        self.counts["drops"] += 1
+        fills = []
+        for _ in range(params.get("fills", 0)):
+            order = self.pick()
+            if order is not None:
+                fills.append(await self.fill(order))
+        return web.json_response({"closed": len(subscribers), "fills": fills})
+
+    def stats(self) -> dict:
+        return {
+            **self.counts,
+            "open_orders": len(self.orders),
+            "latencies": list(self.latencies),
+        }
+
+    async def get_stats(self, request):
+        stats = self.stats()
+        if request.query.get("reset"):
+            self.latencies.clear()
+            self.counts = dict.fromkeys(self.counts, 0)
+        return web.json_response(stats)
+
+
+def parse_prices(text) -> dict[str, float]:
+    return {
+        symbol: float(price)
+        for symbol, price in (item.split("=") for item in text.split(","))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the local mock exchange")
+    parser.add_argument("prices", help="SYMBOL=price,SYMBOL=price,...")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rate", type=float, default=0, help="fills per second")
+    parser.add_argument("--tick-size", default="0.0001")
+    parser.add_argument("--step-size", default="0.001")
+    parser.add_argument("--min-notional", default="10")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def run():
+        exchange = MockExchange(
+            parse_prices(args.prices),
+            args.tick_size,
+            args.step_size,
+            args.min_notional,
+        )
+        await exchange.serve(args.host, args.port)
+        if args.rate:
+            exchange.load = asyncio.create_task(exchange.generate_fills(args.rate))
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
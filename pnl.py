@@ -0,0 +1,526 @@
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from archive import to_columns
+from stats import FillStats
+
+COLUMNS = [
+    "cancel",
+    "created_at",
+    "symbol",
+    "price",
+    "side",
+    "filled_at",
+    "trade_base",
+    "trade_quote",
+    "trade_comm",
+    "base",
+    "quote",
+    "comm",
+    "trade_base_profit",
+    "base_profit",
+    "trade_quote_profit",
+    "quote_profit",
+    "profit_in_quote",
+    "value_change_in_quote",
+]
+
+
+def pair_trades(is_buy):
+    """LIFO-pair BUY and SELL fills the way the buy/sell index stacks do.
+
+    Fill i moves the position from p[i-1] to p[i]. Fills crossing the same
+    edge (p[i-1] + p[i]) alternate between opening and closing, so a stable
+    sort by edge puts every close right after its open.
+
+    Returns the open indices, the close indices and the indices still open.
+    """
+    n = len(is_buy)
+    if n == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+    step = np.where(is_buy, 1, -1)
+    edge = 2 * np.cumsum(step) - step
+    order = np.argsort(edge, kind="stable")
+    edge = edge[order]
+    first = np.r_[True, edge[1:] != edge[:-1]]
+    last = np.r_[first[1:], True]
+    index = np.arange(n)
+    rank = index - np.maximum.accumulate(np.where(first, index, 0))
+    closing = np.flatnonzero(rank % 2 == 1)
+    unmatched = np.sort(order[(rank % 2 == 0) & last])
+    return order[closing - 1], order[closing], unmatched
+
+
+def trade_profits(is_buy, trade_base, trade_quote, trade_comm):
+    """Vectorized trade_base_profit and trade_quote_profit of each close."""
+    open_index, close_index, unmatched = pair_trades(is_buy)
+    trade_base_profit = np.zeros(len(is_buy))
+    trade_quote_profit = np.zeros(len(is_buy))
+    trade_base_profit[close_index] = trade_base[close_index] + trade_base[open_index]
+    trade_quote_profit[close_index] = (
+        trade_quote[close_index] + trade_quote[open_index]
+    ) - (trade_comm[open_index] + trade_comm[close_index])
+    return trade_base_profit, trade_quote_profit, unmatched
+
+
+def pnl_frame(symbol, columns, opened=None, totals=None):
+    """The COLUMNS of a chunk of fills given as archive columns.
+
+    opened are the is_buy, trade_base, trade_quote and trade_comm arrays of
+    the fills still open before the chunk and totals the base, quote, comm,
+    base_profit and quote_profit after them, both None for the first chunk.
+    Returns the DataFrame with filled_at in ms, the open fills after the
+    chunk and their indices into opened followed by the chunk.
+    """
+    is_buy = np.asarray(columns["S"])
+    price = np.asarray(columns["p"])
+    quote_quantity = np.asarray(columns["Z"])
+    buy = np.where(is_buy, 1, -1)
+    fills = {
+        "is_buy": is_buy,
+        "trade_base": buy * np.asarray(columns["q"]),
+        "trade_quote": buy * quote_quantity * (-1),
+        "trade_comm": quote_quantity * 0.001,
+    }
+    skip = 0
+    if opened is not None:
+        skip = len(opened["is_buy"])
+        fills = {k: np.concatenate([opened[k], v]) for k, v in fills.items()}
+    trade_base_profit, trade_quote_profit, unmatched = trade_profits(
+        fills["is_buy"], fills["trade_base"], fills["trade_quote"], fills["trade_comm"]
+    )
+    opened = {k: v[unmatched] for k, v in fills.items()}
+    trade_base, trade_quote, trade_comm = (
+        fills[k][skip:] for k in ["trade_base", "trade_quote", "trade_comm"]
+    )
+    trade_base_profit = trade_base_profit[skip:]
+    trade_quote_profit = trade_quote_profit[skip:]
+    base0, quote0, comm0, base_profit0, quote_profit0 = totals or (0.0,) * 5
+    base = base0 + np.cumsum(trade_base)
+    quote = quote0 + np.cumsum(trade_quote)
+    comm = comm0 + np.cumsum(trade_comm)
+    base_profit = base_profit0 + np.cumsum(trade_base_profit)
+    quote_profit = quote_profit0 + np.cumsum(trade_quote_profit)
+    df = pd.DataFrame(
+        {
+            "cancel": np.where(columns["cancel"], "*", ""),
+            "created_at": np.asarray(columns["O"]),
+            "symbol": symbol,
+            "price": price,
+            "side": np.where(is_buy, "BUY", "SELL"),
+            "filled_at": np.asarray(columns["T"]),
+            "trade_base": trade_base,
+            "trade_quote": trade_quote,
+            "trade_comm": trade_comm,
+            "base": base,
+            "quote": quote,
+            "comm": comm,
+            "trade_base_profit": trade_base_profit,
+            "base_profit": base_profit,
+            "trade_quote_profit": trade_quote_profit,
+            "quote_profit": quote_profit,
+            "profit_in_quote": base_profit * price + quote_profit,
+            "value_change_in_quote": base * price + quote - comm,
+        }
+    )
+    return df, opened, unmatched
+
+
+class LedgerStream:
+    """The ledger of fills that come in chunks, for exports.
+
+    Only the running totals and the fills still open are kept between
+    chunks, so the memory does not grow with the history.
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.opened = None
+        self.totals = None
+
+    def frame(self, columns) -> pd.DataFrame:
+        """The rows of the next chunk of fills, like SymbolLedger.frame()."""
+        if not len(columns["i"]):
+            return empty_frame()
+        df, self.opened, _ = pnl_frame(
+            self.symbol, columns, self.opened, self.totals
+        )
+        last = df.iloc[-1]
+        self.totals = tuple(
+            float(last[k])
+            for k in ["base", "quote", "comm", "base_profit", "quote_profit"]
+        )
+        return to_frame(df)
+
+
+class SymbolLedger:
+    """Per-symbol P&L state that is fed with fills in order.
+
+    Keeps the running base/quote/commission totals, the open buy/sell legs
+    and the time bucketed FillStats, so each fill costs O(1). The rows are
+    only built for frame() and page(): the first batch from its columns,
+    which may be memory-mapped from the archive, in vectorized passes, the
+    fills added after it from the rows add() keeps.
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.count = 0
+        self.base = self.quote = self.comm = 0.0
+        self.base_profit = self.quote_profit = 0.0
+        # (row, trade_base, trade_quote, trade_comm) of the fills still open
+        self.buy_legs = []
+        self.sell_legs = []
+        self.last_price = self.last_time = None
+        self.stats = FillStats()
+        # the first batch until frame() or page() turn it into df, with the
+        # rows of it cancelled meanwhile
+        self.columns = None
+        self.batch = 0
+        self.cancelled = set()
+        # filled_at in ms and orderId of every row, the ones added since
+        # the last time_index() in lists
+        self.times = np.array([], dtype=np.int64)
+        self.order_ids = np.array([], dtype=np.int64)
+        self.new_times = []
+        self.new_order_ids = []
+        self.times_sorted = True
+        self.order = None
+        self.pending = []
+        self.df = None
+
+    def __len__(self):
+        return self.count
+
+    def extend(self, msgs):
+        if len(self) or not msgs:
+            for msg in msgs:
+                self.add(msg)
+        else:
+            self.extend_columns(to_columns(msgs))
+
+    def extend_columns(self, columns):
+        """Load the first fills of the ledger from archive columns."""
+        if len(self):
+            raise ValueError(f"{self.symbol} ledger is not empty")
+        if not len(columns["i"]):
+            return
+
+        df, opened, unmatched = pnl_frame(self.symbol, columns)
+        last = df.iloc[-1]
+        self.count = self.batch = len(df)
+        self.columns = columns
+        self.base = float(last.base)
+        self.quote = float(last.quote)
+        self.comm = float(last.comm)
+        self.base_profit = float(last.base_profit)
+        self.quote_profit = float(last.quote_profit)
+        self.last_price = float(last.price)
+        self.last_time = int(columns["T"][-1])
+        self.times = np.asarray(columns["T"])
+        self.order_ids = np.asarray(columns["i"])
+        self.times_sorted = bool(np.all(self.times[1:] >= self.times[:-1]))
+        self.stats.extend(
+            self.times,
+            np.asarray(columns["S"]),
+            np.asarray(columns["Z"]),
+            (df.trade_base_profit * df.price + df.trade_quote_profit).values,
+            df.trade_comm.values,
+        )
+        legs = list(
+            zip(
+                unmatched.tolist(),
+                opened["trade_base"].tolist(),
+                opened["trade_quote"].tolist(),
+                opened["trade_comm"].tolist(),
+            )
+        )
+        if len(unmatched) and opened["is_buy"][0]:
+            self.buy_legs = legs
+        else:
+            self.sell_legs = legs
+
+    def add(self, msg):
+        i = len(self)
+        side = msg["S"]
+        price = float(msg["p"])
+        quote_quantity = float(msg["Z"])
+        buy = -1 if side == "SELL" else 1
+        trade_base = buy * float(msg["q"])
+        trade_quote = buy * quote_quantity * (-1)
+        trade_comm = quote_quantity * 0.001
+        self.base += trade_base
+        self.quote += trade_quote
+        self.comm += trade_comm
+
+        leg = (i, trade_base, trade_quote, trade_comm)
+        opened = None
+        if side == "BUY":
+            if self.sell_legs:
+                opened = self.sell_legs.pop()
+            else:
+                self.buy_legs.append(leg)
+        else:
+            if self.buy_legs:
+                opened = self.buy_legs.pop()
+            else:
+                self.sell_legs.append(leg)
+
+        trade_base_profit = trade_quote_profit = 0.0
+        if opened is not None:
+            _, open_base, open_quote, open_comm = opened
+            trade_base_profit = trade_base + open_base
+            trade_quote_profit = (trade_quote + open_quote) - (open_comm + trade_comm)
+        self.base_profit += trade_base_profit
+        self.quote_profit += trade_quote_profit
+        self.last_price, self.last_time = price, int(msg["T"])
+        self.stats.add(
+            self.last_time,
+            side == "BUY",
+            quote_quantity,
+            trade_base_profit * price + trade_quote_profit,
+            trade_comm,
+        )
+
+        self.count += 1
+        self.new_times.append(self.last_time)
+        self.new_order_ids.append(int(msg["i"]))
+        self.pending.append(
+            (
+                "*" if msg.get("cancel") == True else "",
+                int(msg["O"]),
+                msg["s"],
+                price,
+                side,
+                int(msg["T"]),
+                trade_base,
+                trade_quote,
+                trade_comm,
+                self.base,
+                self.quote,
+                self.comm,
+                trade_base_profit,
+                self.base_profit,
+                trade_quote_profit,
+                self.quote_profit,
+                self.base_profit * price + self.quote_profit,
+                self.base * price + self.quote - self.comm,
+            )
+        )
+
+    def cancel(self, order_id):
+        self.time_index()
+        found = np.flatnonzero(self.order_ids == order_id)
+        if not len(found):
+            return
+        i = int(found[0])
+        done = self.batch if self.df is None else len(self.df)
+        if self.df is not None and i < done:
+            self.df.iloc[i, 0] = "*"
+        elif i < done:
+            self.cancelled.add(i)
+        else:
+            self.pending[i - done] = ("*",) + self.pending[i - done][1:]
+
+    def build(self):
+        """Turn the first batch into df, once its rows are needed."""
+        if self.columns is None:
+            return
+        df, _, _ = pnl_frame(self.symbol, self.columns)
+        if self.cancelled:
+            df.iloc[sorted(self.cancelled), 0] = "*"
+        self.df = to_frame(df)
+        self.columns = None
+        self.cancelled = set()
+
+    def time_index(self):
+        """Return filled_at in ms of the rows, and their order by time.
+
+        The order is None while the rows are in time order, which they are
+        unless fills were backfilled late.
+        """
+        if self.new_times:
+            new = np.array(self.new_times, dtype=np.int64)
+            if self.times_sorted:
+                self.times_sorted = bool(
+                    np.all(new[1:] >= new[:-1])
+                    and (not len(self.times) or new[0] >= self.times[-1])
+                )
+            self.times = np.concatenate([self.times, new])
+            self.order_ids = np.concatenate(
+                [self.order_ids, np.array(self.new_order_ids, dtype=np.int64)]
+            )
+            self.new_times, self.new_order_ids = [], []
+            self.order = None
+        if not self.times_sorted and self.order is None:
+            self.order = np.argsort(self.times, kind="stable")
+        return self.times, self.order
+
+    def page(self, before=None, limit=100):
+        """Return the trades filled before the time in ms, newest first.
+
+        At most limit trades, plus the ones filled in the same ms as the
+        oldest of them, so a next page before that time skips none. The
+        second value is the time to pass as before for the next page, None
+        on the last page. Costs O(limit) apart from new fills.
+        """
+        times, order = self.time_index()
+        ordered = times if order is None else times[order]
+        end = len(ordered) if before is None else int(np.searchsorted(ordered, before))
+        start = max(end - limit, 0)
+        if start:
+            start = int(np.searchsorted(ordered, ordered[start]))
+        positions = np.arange(start, end) if order is None else order[start:end]
+        next_before = int(ordered[start]) if start else None
+        return self.rows(positions[::-1]), next_before
+
+    def rows(self, positions):
+        """Return the rows at the positions as a DataFrame, without frame()."""
+        self.build()
+        done = 0 if self.df is None else len(self.df)
+        old = positions[positions < done]
+        new = positions[positions >= done]
+        parts = [] if self.df is None else [self.df.iloc[old]]
+        if len(new):
+            rows = [self.pending[i - done] for i in new]
+            parts.append(to_frame(pd.DataFrame(rows, columns=COLUMNS)))
+        if not parts:
+            return empty_frame()
+        # back from old rows then new rows to the order of positions
+        found = np.r_[old, new]
+        index = np.argsort(found)
+        return pd.concat(parts).iloc[index[np.searchsorted(found[index], positions)]]
+
+    def frame(self):
+        """Return the per-trade DataFrame, indexed by filled_at."""
+        self.build()
+        if self.pending:
+            data = to_frame(pd.DataFrame(self.pending, columns=COLUMNS))
+            self.df = data if self.df is None else pd.concat([self.df, data])
+            self.pending = []
+        return self.df
+
+    def summary(self, price=None) -> dict:
+        """Totals of the ledger, the value change is taken at price if given."""
+        last_price = self.last_price or 0.0
+        if price is None:
+            price = last_price
+        buy, sell, volume, _, fees = self.stats.total
+        return {
+            "fills": len(self),
+            "buy": int(buy),
+            "sell": int(sell),
+            "volume": volume,
+            "fees": fees,
+            "profit": self.base_profit * last_price + self.quote_profit,
+            "value_change": self.base * price + self.quote - self.comm,
+        }
+
+
+def analyze(symbol, fills, price=None) -> tuple[pd.DataFrame, dict]:
+    """Per-trade ledger and summary of the fills of one symbol.
+
+    fills are executionReport dicts with s, p, q, Z, S, O, T and i, in the
+    order they were filled. The ledger has the COLUMNS indexed by filled_at,
+    see SymbolLedger.summary for the summary.
+    """
+    ledger = SymbolLedger(symbol)
+    ledger.extend(fills)
+    df = ledger.frame()
+    if df is None:
+        df = empty_frame()
+    return df, ledger.summary(price)
+
+
+def to_timestamp(ms):
+    return pd.Timestamp(ms, unit="ms", tz="UTC").tz_convert("Asia/Shanghai")
+
+
+def empty_frame():
+    return to_frame(pd.DataFrame([], columns=COLUMNS))
+
+
+def to_frame(data):
+    for column in ["created_at", "filled_at"]:
+        data[column] = pd.to_datetime(
+            data[column], unit="ms", utc=True
+        ).dt.tz_convert("Asia/Shanghai")
+    return data.set_index("filled_at")
+
+
+def synthetic_fills(n, symbol="BENCHUSDT", seed=0) -> list[dict]:
+    """n fills of a 1% grid walking randomly around a price of 1, one per second."""
+    rng = np.random.default_rng(seed)
+    is_buy = rng.random(n) < 0.5
+    price = 1.01 ** -np.cumsum(np.where(is_buy, 1, -1))
+    filled_at = 1_600_000_000_000 + np.arange(n, dtype=np.int64) * 1000
+    return [
+        {
+            "s": symbol,
+            "p": f"{p:.8f}",
+            "q": "10",
+            "Z": f"{p * 10:.8f}",
+            "S": "BUY" if buy else "SELL",
+            "O": t - 1000,
+            "T": t,
+            "i": i,
+        }
+        for i, (buy, p, t) in enumerate(
+            zip(is_buy.tolist(), price.tolist(), filled_at.tolist())
+        )
+    ]
+
+
+def benchmark(n, incremental, repeat=3) -> dict:
+    """Best fills per second of a cold analyze() and of ledger updates."""
+    fills = synthetic_fills(n + incremental)
+    cold = update = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        analyze("BENCHUSDT", fills[:n])
+        cold = min(cold, time.perf_counter() - started)
+
+        ledger = SymbolLedger("BENCHUSDT")
+        ledger.extend(fills[:n])
+        ledger.frame()
+        started = time.perf_counter()
+        for fill in fills[n:]:
+            ledger.add(fill)
+        ledger.frame()
+        update = min(update, time.perf_counter() - started)
+    return {
+        "fills": n,
+        "incremental_fills": incremental,
+        "cold_fills_per_second": round(n / cold),
+        "incremental_fills_per_second": round(incremental / update),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the fills per second of the P&L ledger"
+    )
+    parser.add_argument("--fills", type=int, default=1_000_000)
+    parser.add_argument("--incremental", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--min-cold", type=float, help="fail below this fills/s")
+    parser.add_argument("--min-incremental", type=float, help="fail below this fills/s")
+    args = parser.parse_args()
+
+    result = benchmark(args.fills, args.incremental, args.repeat)
+    print(json.dumps(result, indent=2))
+    for key, limit in [
+        ("cold_fills_per_second", args.min_cold),
+        ("incremental_fills_per_second", args.min_incremental),
+    ]:
+        if limit is not None and result[key] < limit:
+            raise SystemExit(f"{key} {result[key]} is below {limit}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import time
+import asyncio
+import logging
+import threading
+
+from binance import AsyncClient, BinanceSocketManager
+
+PRICE_TTL = 10.0
+RECONNECT_DELAY = 5.0
+
+logger = logging.getLogger("grid.prices")
+
+
+class PriceCache:
+    """Last price of every symbol, shared by all threads of a process.
+
+    !miniTicker@arr only sends the symbols whose price changed, so a quiet
+    symbol keeps its price as long as updates keep coming. All prices are
+    treated as missing once there was no update for ttl seconds, ttl=None
+    never expires them.
+    """
+
+    def __init__(self, ttl=PRICE_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.prices: dict[str, float] = {}
+        self.updated_at = None
+        self.lock = threading.Lock()
+
+    def update(self, prices: dict[str, float]) -> None:
+        with self.lock:
+            self.prices.update(prices)
+            self.updated_at = self.clock()
+
+    def get(self, symbol):
+        with self.lock:
+            if self.updated_at is None:
+                return None
+            if self.ttl is not None and self.clock() - self.updated_at > self.ttl:
+                return None
+            return self.prices.get(symbol)
+
+
+class TickerStream:
+    """Feeds a PriceCache from the !miniTicker@arr stream in a daemon thread.
+
+    fetch() is the REST fallback used when the stream is not up yet.
+    """
+
+    def __init__(self, cache: PriceCache, client, reconnect_delay=RECONNECT_DELAY):
+        self.cache = cache
+        self.client = client
+        self.reconnect_delay = reconnect_delay
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=lambda: asyncio.run(self.run()), name="ticker-stream", daemon=True
+        )
+        self.thread.start()
+
+    async def run(self):
+        while True:
+            try:
+                client = await AsyncClient.create()
+                try:
+                    async with BinanceSocketManager(client).miniticker_socket() as s:
+                        while True:
+                            self.handle_msg(await s.recv())
+                finally:
+                    await client.close_connection()
+            except Exception:
+                logger.exception("ticker stream failed, reconnecting")
+            await asyncio.sleep(self.reconnect_delay)
+
+    def handle_msg(self, msg):
+        if isinstance(msg, list):
+            # an empty update still tells the stream is alive
+            self.cache.update({ticker["s"]: float(ticker["c"]) for ticker in msg})
+        else:
+            logger.warning(f"unexpected miniTicker message: {msg}")
+
+    def fetch(self) -> dict[str, float]:
+        res = self.client.get_all_tickers()
+        return {item["symbol"]: float(item["price"]) for item in res}
+
+
+class StubTickerStream:
+    """Local stand-in for TickerStream serving fixed prices, for tests."""
+
+    def __init__(self, cache: PriceCache, prices: dict[str, float]):
+        self.cache = cache
+        self.prices = prices
+
+    def start(self):
+        self.cache.update(self.prices)
+
+    def fetch(self) -> dict[str, float]:
+        return dict(self.prices)
@@ -0,0 +1,87 @@
+import time
+import asyncio
+import logging
+
+from binance import BinanceSocketManager
+
+from utils import get_bottom, get_top
+from endpoints import point_socket_manager
+
+CHECK_INTERVAL = 1.0
+RECONNECT_WAIT = 1.0
+MAX_RECONNECT_WAIT = 60.0
+
+logger = logging.getLogger("grid.recenter")
+
+
+class Recenter:
+    """Watches the price of the grids that have "recenter" set.
+
+    "recenter" is a dwell time in seconds. The price is the middle of the
+    best bid and ask from the bookTicker stream. Once it has been below
+    get_bottom or above get_top of its grid for the dwell time,
+    on_break(symbol, price) is called and the dwell starts over, until the
+    grid was moved and the price is back inside the band. The last price is
+    also checked every CHECK_INTERVAL, a quiet book sends no updates.
+    """
+
+    def __init__(self, client, grids, on_break, url=None, clock=time.monotonic):
+        self.client = client
+        self.grids = grids
+        self.on_break = on_break
+        self.url = url
+        self.clock = clock
+        self.prices: dict[str, float] = {}
+        self.outside_since: dict[str, float] = {}
+
+    def update(self, symbol, price) -> None:
+        self.prices[symbol] = price
+        self.check(symbol)
+
+    def check(self, symbol) -> None:
+        grid, price = self.grids.get(symbol), self.prices[symbol]
+        if grid is None or "start" not in grid:
+            # the grid has not started yet
+            return
+        now = self.clock()
+        if get_bottom(grid) <= price <= get_top(grid):
+            self.outside_since.pop(symbol, None)
+            return
+        since = self.outside_since.setdefault(symbol, now)
+        if now - since >= grid["recenter"]:
+            self.outside_since[symbol] = now
+            self.on_break(symbol, price)
+
+    def handle_msg(self, msg) -> None:
+        if msg.get("e") == "error":
+            raise ConnectionError(msg.get("m"))
+        ticker = msg["data"]
+        self.update(ticker["s"], (float(ticker["b"]) + float(ticker["a"])) / 2)
+
+    async def run(self):
+        streams = [f"{symbol.lower()}@bookTicker" for symbol in self.grids]
+        wait = RECONNECT_WAIT
+        while True:
+            try:
+                bsm = BinanceSocketManager(self.client)
+                if self.url:
+                    point_socket_manager(bsm, self.url)
+                async with bsm.multiplex_socket(streams) as socket:
+                    while True:
+                        self.handle_msg(await socket.recv())
+                        wait = RECONNECT_WAIT
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"bookTicker stream failed: {e!r}, retry in {wait}s")
+            # no decisions on prices from before the gap
+            self.prices.clear()
+            self.outside_since.clear()
+            await asyncio.sleep(wait)
+            wait = min(wait * 2, MAX_RECONNECT_WAIT)
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            for symbol in list(self.prices):
+                self.check(symbol)
@@ -0,0 +1,275 @@
+import time
+import asyncio
+import logging
+import itertools
+import contextvars
+from collections import deque
+
+from binance.exceptions import BinanceAPIException
+
+from metrics import registry
+
+# request priorities, lower runs first
+CANCEL = 0
+REPLACE = 1
+PLACE = 2
+OTHER = 3
+PRIORITY_NAMES = {CANCEL: "cancel", REPLACE: "replace", PLACE: "place", OTHER: "other"}
+
+WEIGHT_LIMIT = 1200
+WEIGHT_INTERVAL = 60.0
+ORDER_LIMIT = 10
+ORDER_INTERVAL = 1.0
+ORDER_COUNT_LIMIT = 100  # orders per account in ORDER_COUNT_INTERVAL
+ORDER_COUNT_INTERVAL = 10.0
+BAN_BACKOFF = 60.0
+POLL_INTERVAL = 0.05
+
+logger = logging.getLogger("grid.scheduler")
+
+wait_seconds = registry.histogram(
+    "grid_scheduler_wait_seconds", "Time requests spent queued, by priority", "priority"
+)
+rest_seconds = registry.histogram(
+    "grid_rest_seconds", "Round trip of REST requests, by client method", "method"
+)
+
+
+class RequestScheduler:
+    """Runs REST requests of an AsyncClient in priority order within rate limits.
+
+    Request weight and order count are tracked locally over sliding windows
+    and reconciled with the X-MBX-USED-WEIGHT-1M and X-MBX-ORDER-COUNT-*
+    headers of the responses, so requests made outside the scheduler are
+    accounted for too. A -1003 / 429 / 418 response pauses the queue until
+    Retry-After. The headers are read from the response of each request,
+    the client only keeps the last one of all.
+    """
+
+    def __init__(
+        self,
+        client,
+        weight_limit=WEIGHT_LIMIT,
+        order_limit=ORDER_LIMIT,
+        order_interval=ORDER_INTERVAL,
+        order_count_limit=None,
+        ip_weight_limit=None,
+    ):
+        self.client = client
+        # weight_limit is the part of the IP limit this process may use, the
+        # used weight in the headers is of the whole IP, by default the same
+        self.weight_limit = weight_limit
+        self.ip_weight_limit = ip_weight_limit or weight_limit
+        self.order_limit = order_limit
+        self.order_interval = order_interval
+        # the X-MBX-ORDER-COUNT-10S limit, by default the rate of order_limit
+        if order_count_limit is None:
+            order_count_limit = order_limit * ORDER_COUNT_INTERVAL / order_interval
+        self.order_count_limit = order_count_limit
+
+        self.queue = asyncio.PriorityQueue()
+        self.seq = itertools.count()
+        self.worker = None
+        self.tasks = set()
+        # the response of the request run by the current execute() task
+        self.response = contextvars.ContextVar("response", default=None)
+        self.capture_responses()
+
+        self.weights = deque()  # (time, weight) in the last WEIGHT_INTERVAL
+        self.orders = deque()  # times of orders in the last order_interval
+        self.order_counts = deque()  # times of orders in the last 10 seconds
+        self.server_weight = (0.0, 0)  # (time, X-MBX-USED-WEIGHT-1M)
+        self.server_orders = (0.0, 0)  # (time, X-MBX-ORDER-COUNT-10S)
+        self.paused_until = 0.0
+
+        self.depth = {priority: 0 for priority in PRIORITY_NAMES}
+        self.waits = {priority: [0, 0.0, 0.0] for priority in PRIORITY_NAMES}
+
+    def start(self):
+        self.worker = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+
+    async def submit(self, priority, f, *args, weight=1, order=False, **kwargs):
+        """Queue f(*args, **kwargs) and return its result once it ran."""
+        future = asyncio.get_running_loop().create_future()
+        self.depth[priority] += 1
+        await self.queue.put(
+            (
+                priority,
+                next(self.seq),
+                time.monotonic(),
+                weight,
+                order,
+                f,
+                args,
+                kwargs,
+                future,
+            )
+        )
+        return await future
+
+    async def run(self):
+        while True:
+            item = await self.queue.get()
+            while (delay := self.delay(item[3], item[4])) > 0:
+                await asyncio.sleep(min(delay, POLL_INTERVAL))
+                # let a more urgent request that arrived meanwhile go first
+                if not self.queue.empty():
+                    other = self.queue.get_nowait()
+                    if other < item:
+                        item, other = other, item
+                    self.queue.put_nowait(other)
+
+            priority, _, queued_at, weight, order, f, args, kwargs, future = item
+            now = time.monotonic()
+            self.weights.append((now, weight))
+            if order:
+                self.orders.append(now)
+                self.order_counts.append(now)
+            self.depth[priority] -= 1
+            stats = self.waits[priority]
+            stats[0] += 1
+            stats[1] += now - queued_at
+            stats[2] = max(stats[2], now - queued_at)
+            wait_seconds.observe(PRIORITY_NAMES[priority], now - queued_at)
+            task = asyncio.create_task(self.execute(f, args, kwargs, future))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    def delay(self, weight, order) -> float:
+        """Seconds to wait before a request of the weight may be sent."""
+        now = time.monotonic()
+        while self.weights and now - self.weights[0][0] >= WEIGHT_INTERVAL:
+            self.weights.popleft()
+        while self.orders and now - self.orders[0] >= self.order_interval:
+            self.orders.popleft()
+        while self.order_counts and now - self.order_counts[0] >= ORDER_COUNT_INTERVAL:
+            self.order_counts.popleft()
+
+        if now < self.paused_until:
+            return self.paused_until - now
+        local = sum(w for _, w in self.weights)
+        if (
+            local + weight > self.weight_limit
+            or self.used_weight(now) + weight > self.ip_weight_limit
+        ):
+            if self.weights:
+                return max(WEIGHT_INTERVAL - (now - self.weights[0][0]), 0.01)
+            return 1.0
+        if order and len(self.orders) >= self.order_limit:
+            return max(self.order_interval - (now - self.orders[0]), 0.001)
+        if order and self.used_orders(now) >= self.order_count_limit:
+            if self.order_counts:
+                oldest = self.order_counts[0]
+            else:
+                oldest = self.server_orders[0]
+            return max(ORDER_COUNT_INTERVAL - (now - oldest), 0.001)
+        return 0.0
+
+    def used_weight(self, now):
+        local = sum(weight for _, weight in self.weights)
+        updated_at, server = self.server_weight
+        if now - updated_at < WEIGHT_INTERVAL:
+            return max(local, server)
+        return local
+
+    def used_orders(self, now):
+        local = len(self.order_counts)
+        updated_at, server = self.server_orders
+        if now - updated_at < ORDER_COUNT_INTERVAL:
+            return max(local, server)
+        return local
+
+    def capture_responses(self):
+        """Keep the response of each request in the task that made it."""
+        handle_response = getattr(self.client, "_handle_response", None)
+        if handle_response is None:
+            return
+
+        async def capture(response):
+            self.response.set(response)
+            return await handle_response(response)
+
+        self.client._handle_response = capture
+
+    async def execute(self, f, args, kwargs, future):
+        started = time.perf_counter()
+        try:
+            result = await f(*args, **kwargs)
+        except BinanceAPIException as e:
+            if e.code == -1003 or e.status_code in (418, 429):
+                self.pause(e.response)
+            self.read_headers(e.response)
+            future.set_exception(e)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            self.read_headers(self.response.get())
+            future.set_result(result)
+        finally:
+            rest_seconds.observe(f.__name__, time.perf_counter() - started)
+
+    def read_headers(self, response):
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return
+        now = time.monotonic()
+        weight = headers.get("x-mbx-used-weight-1m")
+        if weight is not None:
+            self.server_weight = (now, int(weight))
+        orders = headers.get("x-mbx-order-count-10s")
+        if orders is not None:
+            self.server_orders = (now, int(orders))
+
+    def pause(self, response):
+        headers = getattr(response, "headers", None) or {}
+        delay = float(headers.get("Retry-After", BAN_BACKOFF))
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        logger.warning(f"rate limit hit, pausing requests for {delay} seconds")
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        return {
+            "queue_depth": {
+                PRIORITY_NAMES[priority]: depth
+                for priority, depth in self.depth.items()
+            },
+            "wait_seconds": {
+                PRIORITY_NAMES[priority]: {
+                    "count": count,
+                    "mean": total / count if count else 0.0,
+                    "max": longest,
+                }
+                for priority, (count, total, longest) in self.waits.items()
+            },
+            "used_weight": self.used_weight(now),
+            "order_count_10s": self.server_orders[1],
+            "paused_for": max(self.paused_until - now, 0.0),
+        }
+
+    def export_metrics(self, registry):
+        """Expose the queue and rate limit state as gauges of the registry."""
+        registry.gauge(
+            "grid_scheduler_queue_depth",
+            "Requests waiting in the scheduler, by priority",
+            lambda: self.metrics()["queue_depth"],
+            "priority",
+        )
+        registry.gauge(
+            "grid_used_weight",
+            "Request weight used in the last minute",
+            lambda: self.used_weight(time.monotonic()),
+        )
+        registry.gauge(
+            "grid_order_count_10s",
+            "X-MBX-ORDER-COUNT-10S of the last response",
+            lambda: self.server_orders[1],
+        )
+        registry.gauge(
+            "grid_paused_seconds",
+            "Seconds until the rate limit pause ends",
+            lambda: max(self.paused_until - time.monotonic(), 0.0),
+        )
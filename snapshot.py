@@ -0,0 +1,60 @@
+import os
+import json
+import asyncio
+
+SNAPSHOT_INTERVAL = 1.0
+
+# runtime state of a grid, the rest of the grid dict comes from config.json
+STATE_KEYS = ["start", "mid", "buy_cid", "buy_id", "sell_cid", "sell_id"]
+
+
+def grid_state(grid) -> dict:
+    state = {key: grid.get(key) for key in STATE_KEYS}
+    if "band" in grid:
+        # bottom and top of a recentered grid
+        state["band"] = grid["band"]
+    if "ladder" in grid:
+        state["ladder"] = grid["ladder"].state()
+    return state
+
+
+class GridSnapshot:
+    """The state of all grids in one JSON file, replaced atomically.
+
+    The state is serialized on the event loop so it is consistent across
+    grids, the file is written in a thread and only when it changed.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("SNAPSHOT_FILE", "grids.json")
+        self.last = None
+
+    def load(self) -> dict[str, dict]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def saved_at(self):
+        """Time of the last write in ms, None without a snapshot."""
+        if not os.path.exists(self.path):
+            return None
+        return int(os.path.getmtime(self.path) * 1000)
+
+    def dumps(self, grids) -> str:
+        return json.dumps(
+            {symbol: grid_state(grid) for symbol, grid in grids.items()}, indent=2
+        )
+
+    def write(self, data: str) -> None:
+        with open(self.path + ".tmp", "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+    async def save(self, grids) -> None:
+        data = self.dumps(grids)
+        if data != self.last:
+            await asyncio.to_thread(self.write, data)
+            self.last = data
@@ -0,0 +1,109 @@
+import numpy as np
+
+MINUTE = 60_000
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# bucket size -> how long its buckets are kept, in ms, None keeps them all
+RESOLUTIONS = {MINUTE: DAY, HOUR: 30 * DAY, DAY: None}
+FIELDS = ["buy", "sell", "volume", "profit", "fees"]
+
+
+class FillStats:
+    """Fill counts, quote volume, realized profit and fees of one symbol.
+
+    The sums are kept per minute for a day, per hour for 30 days and per day
+    for the whole history, and updated on every fill, so a window like the
+    last hour or the last 7 days costs a sum over its buckets instead of a
+    pass over the fills. Windows are exact to the bucket they start in.
+    """
+
+    def __init__(self):
+        self.buckets: dict[int, dict[int, list[float]]] = {
+            size: {} for size in RESOLUTIONS
+        }
+        self.total = [0.0] * len(FIELDS)
+        self.latest = 0
+        # buckets before this time were dropped, per size
+        self.horizon = dict.fromkeys(RESOLUTIONS, 0)
+
+    def add(self, time, is_buy, volume, profit, fees) -> None:
+        row = (float(is_buy), float(not is_buy), volume, profit, fees)
+        self.merge(self.total, row)
+        self.latest = max(self.latest, time)
+        for size in RESOLUTIONS:
+            start = time - time % size
+            if self.expired(size, start):
+                # too late for this resolution, the coarser ones count it
+                self.horizon[size] = max(self.horizon[size], start + size)
+                continue
+            self.merge(self.bucket(size, start), row)
+
+    def extend(self, time, is_buy, volume, profit, fees) -> None:
+        """Add the fills of whole arrays at once."""
+        if not len(time):
+            return
+        time = np.asarray(time, dtype=np.int64)
+        is_buy = np.asarray(is_buy, dtype=np.bool_)
+        values = np.stack([is_buy, ~is_buy, volume, profit, fees]).astype(np.float64)
+        self.merge(self.total, values.sum(axis=1).tolist())
+        self.latest = max(self.latest, int(time.max()))
+        for size, retention in RESOLUTIONS.items():
+            start = time - time % size
+            keep = slice(None)
+            if retention is not None:
+                keep = start >= self.latest - retention - size
+                if not keep.all():
+                    dropped = int(start[~keep].max()) + size
+                    self.horizon[size] = max(self.horizon[size], dropped)
+            keys, inverse = np.unique(start[keep], return_inverse=True)
+            sums = [
+                np.bincount(inverse, weights=column[keep], minlength=len(keys))
+                for column in values
+            ]
+            for key, row in zip(keys.tolist(), zip(*(s.tolist() for s in sums))):
+                self.merge(self.bucket(size, key), row)
+
+    def expired(self, size, start) -> bool:
+        """True if the bucket is past the retention of its size."""
+        retention = RESOLUTIONS[size]
+        return retention is not None and start < self.latest - retention - size
+
+    @staticmethod
+    def merge(bucket, row) -> None:
+        for j, value in enumerate(row):
+            bucket[j] += value
+
+    def bucket(self, size, start) -> list[float]:
+        buckets = self.buckets[size]
+        bucket = buckets.get(start)
+        if bucket is not None:
+            return bucket
+        bucket = [0.0] * len(FIELDS)
+        last = next(reversed(buckets), None)
+        buckets[start] = bucket
+        if last is not None and start < last:
+            # a late fill, keep the buckets in time order
+            self.buckets[size] = dict(sorted(buckets.items()))
+        buckets = self.buckets[size]
+        while self.expired(size, next(iter(buckets))):
+            del buckets[next(iter(buckets))]
+            self.horizon[size] = next(iter(buckets), start)
+        return bucket
+
+    def since(self, time, size=None) -> dict[str, float]:
+        """Sums of the fills from time in ms on, from the finest kept buckets."""
+        if size is None:
+            size = next(s for s in RESOLUTIONS if time >= self.horizon[s])
+        start = time - time % size
+        window = [0.0] * len(FIELDS)
+        for key, row in reversed(self.buckets[size].items()):
+            if key < start:
+                break
+            self.merge(window, row)
+        return dict(zip(FIELDS, window))
+
+    def series(self, size=DAY) -> list[tuple[int, dict[str, float]]]:
+        return [
+            (start, dict(zip(FIELDS, row))) for start, row in self.buckets[size].items()
+        ]
@@ -0,0 +1,308 @@
+import os
+import abc
+import glob
+import json
+import time
+
+import tinydb
+
+SEGMENT_SIZE = 64 * 2**20
+FSYNC_EVERY = 64
+FSYNC_INTERVAL = 1.0
+
+
+class FillStore(abc.ABC):
+    """Storage of FILLED executionReports.
+
+    Fills are identified by (symbol, orderId), that is msg["s"] and msg["i"].
+    """
+
+    @abc.abstractmethod
+    def insert(self, msg: dict) -> None:
+        pass
+
+    @abc.abstractmethod
+    def mark_cancel(self, symbol: str, order_id: int) -> bool:
+        """Mark the filled order as cancel, return False if it is not found."""
+
+    @abc.abstractmethod
+    def find(self, symbol: str, order_id: int):
+        """The fill of the order, None if it is not found."""
+
+    @abc.abstractmethod
+    def find_client_order(self, symbol: str, client_order_id: str):
+        """The fill of the order by its clientOrderId, msg["c"]."""
+
+    @abc.abstractmethod
+    def all(self) -> list[dict]:
+        pass
+
+    @property
+    def records(self) -> list[dict]:
+        """The fills as records, see JournalFillStore."""
+        return [{"op": "fill", "msg": msg} for msg in self.all()]
+
+    def refresh(self) -> list[dict]:
+        """Pick up changes made by other processes, return them as records."""
+        return []
+
+    def __len__(self) -> int:
+        return len(self.all())
+
+    def sync(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.sync()
+
+
+class TinyFillStore(FillStore):
+    """The legacy store, TinyDB rewrites the whole file on every change.
+
+    Cancel marks update the fill in place, so they only show up in records
+    of fills that have not been read yet.
+    """
+
+    def __init__(self, path="db.json"):
+        self.table = tinydb.TinyDB(path).table("filled")
+        self.seen = 0
+
+    def insert(self, msg):
+        self.table.insert(msg)
+
+    def mark_cancel(self, symbol, order_id):
+        Filled = tinydb.Query()
+        ids = self.table.update(
+            {"cancel": True}, (Filled.s == symbol) & (Filled.i == order_id)
+        )
+        return bool(ids)
+
+    def find(self, symbol, order_id):
+        Filled = tinydb.Query()
+        return self.table.get((Filled.s == symbol) & (Filled.i == order_id))
+
+    def find_client_order(self, symbol, client_order_id):
+        Filled = tinydb.Query()
+        return self.table.get((Filled.s == symbol) & (Filled.c == client_order_id))
+
+    def all(self):
+        return self.table.all()
+
+    def refresh(self):
+        fills = self.table.all()
+        new = [{"op": "fill", "msg": msg} for msg in fills[self.seen :]]
+        self.seen = len(fills)
+        return new
+
+    def __len__(self):
+        return len(self.table)
+
+
+def segment_path(path, segment):
+    return os.path.join(path, f"{segment:08d}.jsonl")
+
+
+def segments(path):
+    return sorted(
+        int(name[:-6]) for name in os.listdir(path) if name.endswith(".jsonl")
+    )
+
+
+def read_journal(path, position=None):
+    """Records of the journal from the position on, read one line at a time.
+
+    Unlike JournalFillStore it keeps nothing in memory, for reads of the
+    whole history.
+    """
+    segment, offset = position or (0, 0)
+    for s in segments(path):
+        if s < segment:
+            continue
+        with open(segment_path(path, s), "rb") as f:
+            f.seek(offset if s == segment else 0)
+            for line in f:
+                # the writer may be in the middle of the last line
+                if line.endswith(b"\n"):
+                    yield json.loads(line)
+
+
+class JournalFillStore(FillStore):
+    """Append-only journal of fills split into numbered JSONL segments.
+
+    Every change is one line appended to the last segment, either
+    {"op": "fill", "msg": {...}} or {"op": "cancel", "s": ..., "i": ...}.
+    Lines are flushed to the OS immediately so readers in other processes
+    see them, fsync is batched by count and by time.
+
+    Only the fills are kept in memory, with their cancel marks applied, and
+    the cancels of fills before the start position.
+    """
+
+    def __init__(
+        self,
+        path="fills",
+        segment_size=SEGMENT_SIZE,
+        fsync_every=FSYNC_EVERY,
+        fsync_interval=FSYNC_INTERVAL,
+        position=None,
+    ):
+        self.path = path
+        self.segment_size = segment_size
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        os.makedirs(path, exist_ok=True)
+
+        self.fills: list[dict] = []
+        self.index: dict[tuple, dict] = {}
+        self.client_index: dict[tuple, dict] = {}
+        # cancels of fills that were read before the start position
+        self.cancels: list[dict] = []
+
+        # position up to which the journal has been read: (segment, offset),
+        # records before the given start position are skipped
+        self.position = tuple(position) if position else (0, 0)
+        self.file = None
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        self.refresh()
+
+    def segment_path(self, segment):
+        return segment_path(self.path, segment)
+
+    def segments(self):
+        return segments(self.path)
+
+    def refresh(self) -> list[dict]:
+        """Read records appended by other processes, return the new ones."""
+        new = []
+        segment, offset = self.position
+        for s in self.segments():
+            if s < segment:
+                continue
+            if s > segment:
+                offset = 0
+            with open(self.segment_path(s), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+            # the writer may be in the middle of a line
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                if line:
+                    new.append(self.apply(json.loads(line)))
+            segment, offset = s, offset + end
+        self.position = (segment, offset)
+        return new
+
+    def apply(self, record):
+        if record["op"] == "fill":
+            msg = record["msg"]
+            self.fills.append(msg)
+            self.index[(msg["s"], msg["i"])] = msg
+            if "c" in msg:
+                self.client_index[(msg["s"], msg["c"])] = msg
+        elif record["op"] == "cancel":
+            msg = self.index.get((record["s"], record["i"]))
+            if msg is not None:
+                msg["cancel"] = True
+            else:
+                self.cancels.append(record)
+        return record
+
+    def append(self, record):
+        segment, offset = self.position
+        if self.file is None or offset >= self.segment_size:
+            if self.file is not None:
+                self.sync()
+                self.file.close()
+            if segment == 0 or offset >= self.segment_size:
+                segment, offset = segment + 1, 0
+            self.file = open(self.segment_path(segment), "ab")
+
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        self.file.write(line)
+        self.file.flush()
+        self.position = (segment, offset + len(line))
+        self.apply(record)
+
+        self.pending += 1
+        if (
+            self.pending >= self.fsync_every
+            or time.monotonic() - self.last_sync >= self.fsync_interval
+        ):
+            self.sync()
+
+    def insert(self, msg):
+        self.append({"op": "fill", "msg": msg})
+
+    def mark_cancel(self, symbol, order_id):
+        if (symbol, order_id) not in self.index:
+            return False
+        self.append({"op": "cancel", "s": symbol, "i": order_id})
+        return True
+
+    def find(self, symbol, order_id):
+        return self.index.get((symbol, order_id))
+
+    def find_client_order(self, symbol, client_order_id):
+        return self.client_index.get((symbol, client_order_id))
+
+    def all(self):
+        return self.fills
+
+    @property
+    def records(self):
+        """The fills, then the cancels of the fills before the start position."""
+        return super().records + self.cancels
+
+    def __len__(self):
+        return len(self.fills)
+
+    def sync(self):
+        if self.file is not None and self.pending:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+def fill_store_path() -> str:
+    """FILL_STORE_PATH, or the default path of the FILL_STORE kind."""
+    if os.environ.get("FILL_STORE", "journal") == "journal":
+        return os.environ.get("FILL_STORE_PATH", "fills")
+    return os.environ.get("FILL_STORE_PATH", "db.json")
+
+
+def shard_path(path: str, name: str) -> str:
+    """Path of the file of a shard of the supervisor, <root>-<name><ext>."""
+    root, ext = os.path.splitext(path)
+    return f"{root}-{name}{ext}"
+
+
+def shard_names(path: str) -> list[str]:
+    """Names of the shards that have a file next to path, see shard_path."""
+    root, ext = os.path.splitext(path)
+    paths = glob.glob(f"{glob.escape(root)}-*{glob.escape(ext)}")
+    return sorted(p[len(root) + 1 : len(p) - len(ext)] for p in paths)
+
+
+def open_fill_store(position=None, path=None) -> FillStore:
+    """Open the store selected by the FILL_STORE environment variable.
+
+    position is where to start reading the journal, see archive.FillArchive.
+    path defaults to fill_store_path().
+    """
+    kind = os.environ.get("FILL_STORE", "journal")
+    path = path or fill_store_path()
+    if kind == "journal":
+        return JournalFillStore(path, position=position)
+    elif kind == "tinydb":
+        if position:
+            raise ValueError("the tinydb store can not be read from a position")
+        return TinyFillStore(path)
+    raise ValueError(f"unknown FILL_STORE: {kind}")
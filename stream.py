@@ -0,0 +1,118 @@
+import time
+import asyncio
+import logging
+
+from binance import BinanceSocketManager
+
+from endpoints import point_socket_manager
+
+RESUBSCRIBE_WAIT = 1.0
+MAX_RESUBSCRIBE_WAIT = 60.0
+BACKFILL_MARGIN = 5000  # ms before the last event, covers clock skew
+
+# events after which the subscription no longer delivers anything
+GAP_EVENTS = {"error", "listenKeyExpired", "eventStreamTerminated"}
+
+logger = logging.getLogger("grid.stream")
+
+
+def execution_report(order: dict, trades: list[dict]) -> dict:
+    """Rebuild the FILLED executionReport of an order from allOrders and myTrades."""
+    trades = sorted(trades, key=lambda trade: trade["id"])
+    last = trades[-1]
+    return {
+        "e": "executionReport",
+        "E": order["updateTime"],
+        "s": order["symbol"],
+        "c": order["clientOrderId"],
+        "S": order["side"],
+        "o": order["type"],
+        "f": order["timeInForce"],
+        "q": order["origQty"],
+        "p": order["price"],
+        "x": "TRADE",
+        "X": "FILLED",
+        "i": order["orderId"],
+        "l": last["qty"],
+        "z": order["executedQty"],
+        "L": last["price"],
+        "n": str(sum(float(trade["commission"]) for trade in trades)),
+        "N": last["commissionAsset"],
+        "T": last["time"],
+        "t": last["id"],
+        "m": last["isMaker"],
+        "O": order["time"],
+        "Z": order["cummulativeQuoteQty"],
+        "Y": last["quoteQty"],
+        "Q": "0",
+    }
+
+
+class UserStream:
+    """User data stream that subscribes again after it was lost.
+
+    python-binance reconnects the websocket, but the subscription of the user
+    data stream does not survive that. After an error or the end of the
+    stream the socket is opened again and on_gap(since) is awaited before the
+    next message is returned, since is in ms and lies before the last event
+    that was received.
+    """
+
+    def __init__(self, client, on_gap, url=None):
+        self.client = client
+        self.on_gap = on_gap
+        self.url = url
+        self.socket = None
+        self.last_event_time = None
+        self.gaps = 0
+
+    async def open(self) -> None:
+        bsm = BinanceSocketManager(self.client)
+        if self.url:
+            point_socket_manager(bsm, self.url)
+        socket = bsm.user_socket()
+        await socket.__aenter__()
+        self.socket = socket
+        if self.last_event_time is None:
+            self.last_event_time = int(time.time() * 1000)
+
+    async def close(self) -> None:
+        socket, self.socket = self.socket, None
+        if socket is None:
+            return
+        try:
+            await socket.__aexit__(None, None, None)
+        except Exception as e:
+            # the subscription is usually gone with the old connection
+            logger.debug(f"failed to close the user data stream: {e!r}")
+
+    async def reopen(self) -> None:
+        wait = RESUBSCRIBE_WAIT
+        while True:
+            try:
+                await self.open()
+                break
+            except Exception as e:
+                logger.error(f"failed to subscribe to the user data stream: {e!r}")
+            await asyncio.sleep(wait)
+            wait = min(wait * 2, MAX_RESUBSCRIBE_WAIT)
+        self.gaps += 1
+        since = self.last_event_time - BACKFILL_MARGIN
+        logger.warning(f"user data stream subscribed again, backfill since {since}")
+        await self.on_gap(since)
+
+    async def recv(self) -> dict:
+        while True:
+            if self.socket is None:
+                await self.reopen()
+            try:
+                msg = await self.socket.recv()
+            except Exception as e:
+                msg = {"e": "error", "m": repr(e)}
+            if msg.get("e") in GAP_EVENTS:
+                logger.warning(f"user data stream lost: {msg}")
+                await self.close()
+                continue
+            if "E" in msg:
+                self.last_event_time = max(self.last_event_time, msg["E"])
+            return msg
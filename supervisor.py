@@ -0,0 +1,294 @@
+import os
+import re
+import time
+import hashlib
+import signal
+import asyncio
+import logging
+import argparse
+import multiprocessing
+
+from aiohttp import web, ClientSession, ClientTimeout
+
+from metrics import Registry, merge_metrics, METRICS_HOST, METRICS_PORT
+from scheduler import ORDER_LIMIT, WEIGHT_LIMIT, ORDER_COUNT_LIMIT
+from logs import ALERT_RATE
+from store import fill_store_path, shard_path
+
+RESTART_WAIT = 1.0
+MAX_RESTART_WAIT = 60.0
+HEALTHY_AFTER = 60.0  # seconds a shard has to run to reset the restart backoff
+WATCH_INTERVAL = 1.0
+SCRAPE_TIMEOUT = 2.0
+STOP_TIMEOUT = 10.0  # time the shards get to cancel their orders
+
+logger = logging.getLogger("grid.supervisor")
+
+
+def shard_config(grids: dict, shards: int) -> dict[str, dict]:
+    """Split the pairs of config.json into shards named <account>-<n>.
+
+    A pair belongs to the account of its "account" key, "main" if unset, and
+    to shard sha1(symbol) % shards of it. A pair stays in its shard, with
+    its snapshot and fills, as long as the number of shards is the same.
+    """
+    config: dict[str, dict] = {}
+    for symbol, grid in sorted(grids.items()):
+        account = grid.get("account", "main")
+        digest = hashlib.sha1(symbol.encode()).hexdigest()
+        name = f"{account}-{int(digest, 16) % shards}"
+        config.setdefault(name, {})[symbol] = grid
+    return config
+
+
+def account_env(account: str) -> dict:
+    """API key of the account, API_KEY_<ACCOUNT> or API_KEY for main."""
+    if account == "main":
+        suffix = ""
+    else:
+        suffix = "_" + re.sub(r"\W", "_", account).upper()
+    env = {}
+    for key in ["API_KEY", "API_SECRET"]:
+        value = os.environ.get(key + suffix)
+        if value is None:
+            raise ValueError(f"{key + suffix} is not set for account {account}")
+        env[key] = value
+    return env
+
+
+def run_shard(name, grids, env, order_limit, weight_limit, alert_rate):
+    """Entry of a shard process, runs one Main for its part of the config."""
+    os.environ.update(env)
+    # imported here, the logging of main reads the environment of the shard
+    from main import Main, formatter, handler, debug_handler, t_handler
+    from main import alert_handler
+
+    shard_formatter = logging.Formatter(
+        formatter._fmt.replace("%(name)s", f"{name} - %(name)s")
+    )
+    for h in [handler, debug_handler, t_handler]:
+        h.setFormatter(shard_formatter)
+    alert_handler.rate = alert_handler.tokens = alert_rate
+    # the order count header is of the whole account, the used weight of the IP
+    bot = Main(grids, order_limit, weight_limit, ORDER_COUNT_LIMIT, WEIGHT_LIMIT)
+    asyncio.run(bot.main())
+
+
+class Shard:
+    def __init__(self, name, grids, env, order_limit, weight_limit, alert_rate):
+        self.name = name
+        self.grids = grids
+        self.env = env
+        self.args = (name, grids, env, order_limit, weight_limit, alert_rate)
+        self.process: multiprocessing.Process = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.restart_at = 0.0
+        self.wait = RESTART_WAIT
+        self.scraped = False
+
+    @property
+    def metrics_url(self) -> str:
+        return f'http://127.0.0.1:{self.env["METRICS_PORT"]}/metrics'
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def start(self, context) -> None:
+        self.process = context.Process(
+            target=run_shard, args=self.args, name=self.name, daemon=True
+        )
+        self.process.start()
+        self.started_at = time.monotonic()
+        logger.info(f"shard {self.name} started, pid {self.process.pid}")
+
+    def health(self) -> dict:
+        return {
+            "alive": self.alive(),
+            "pid": self.process.pid if self.process else None,
+            "exitcode": self.process.exitcode if self.process else None,
+            "uptime": time.monotonic() - self.started_at if self.alive() else 0.0,
+            "restarts": self.restarts,
+            "symbols": len(self.grids),
+            "metrics": self.scraped,
+        }
+
+
+class Supervisor:
+    """Runs every shard in its own process and restarts the ones that die.
+
+    Each shard has its own AsyncClient, user data stream, fill store,
+    snapshot and metrics port. The supervisor serves the metrics of all
+    shards on one /metrics, labelled by shard, and their state on /health.
+    A shard that does not answer in time is left out of the scrape.
+    """
+
+    def __init__(self, shards: list[Shard]):
+        self.shards = shards
+        self.context = multiprocessing.get_context("spawn")
+        self.stopping = False
+        self.session: ClientSession = None
+        self.registry = Registry()
+        self.registry.gauge(
+            "grid_shard_up",
+            "1 if the shard process is running",
+            lambda: {shard.name: int(shard.alive()) for shard in self.shards},
+            "shard",
+        )
+        self.registry.gauge(
+            "grid_shard_restarts",
+            "Restarts of the shard process",
+            lambda: {shard.name: shard.restarts for shard in self.shards},
+            "shard",
+        )
+
+    async def watch(self):
+        while not self.stopping:
+            now = time.monotonic()
+            for shard in self.shards:
+                if shard.alive() or now < shard.restart_at:
+                    continue
+                if shard.process is None:
+                    shard.start(self.context)
+                    continue
+                if shard.restart_at == 0.0:
+                    if now - shard.started_at > HEALTHY_AFTER:
+                        shard.wait = RESTART_WAIT
+                    logger.error(
+                        f"shard {shard.name} exited with {shard.process.exitcode}, "
+                        f"restarting in {shard.wait} seconds"
+                    )
+                    shard.restart_at = now + shard.wait
+                    shard.wait = min(shard.wait * 2, MAX_RESTART_WAIT)
+                    continue
+                shard.restart_at = 0.0
+                shard.restarts += 1
+                shard.start(self.context)
+            await asyncio.sleep(WATCH_INTERVAL)
+
+    async def scrape(self, shard: Shard):
+        if not shard.alive():
+            return None
+        try:
+            async with self.session.get(shard.metrics_url) as res:
+                shard.scraped = res.status == 200
+                return await res.text() if shard.scraped else None
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.debug(f"failed to scrape shard {shard.name}: {e!r}")
+            shard.scraped = False
+            return None
+
+    async def metrics(self, request):
+        texts = await asyncio.gather(*(self.scrape(shard) for shard in self.shards))
+        merged = merge_metrics(
+            {shard.name: text for shard, text in zip(self.shards, texts) if text},
+            "shard",
+        )
+        return web.Response(
+            text=self.registry.render() + merged,
+            content_type="text/plain",
+            charset="utf-8",
+        )
+
+    async def health(self, request):
+        health = {shard.name: shard.health() for shard in self.shards}
+        ok = all(shard["alive"] for shard in health.values())
+        return web.json_response(health, status=200 if ok else 503)
+
+    async def stop(self):
+        """Let the shards cancel their orders, then end them."""
+        self.stopping = True
+        logger.warning("stopping the shards")
+        for shard in self.shards:
+            if shard.alive():
+                os.kill(shard.process.pid, signal.SIGTERM)
+        await asyncio.sleep(STOP_TIMEOUT)
+        for shard in self.shards:
+            if shard.alive():
+                shard.process.kill()
+            if shard.process is not None:
+                shard.process.join()
+
+    async def main(self, host=METRICS_HOST, port=METRICS_PORT):
+        loop = asyncio.get_running_loop()
+        done = asyncio.Event()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(sig, done.set)
+
+        self.session = ClientSession(timeout=ClientTimeout(total=SCRAPE_TIMEOUT))
+        app = web.Application()
+        app.add_routes(
+            [web.get("/metrics", self.metrics), web.get("/health", self.health)]
+        )
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"supervisor of {len(self.shards)} shards on http://{host}:{port}")
+
+        watcher = asyncio.create_task(self.watch())
+        await done.wait()
+        watcher.cancel()
+        await self.stop()
+        await self.session.close()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the grids of config.json in several processes"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=os.cpu_count(), help="processes per account"
+    )
+    args = parser.parse_args()
+
+    # imported here, so the shard processes import main with their own env
+    from main import load_config
+    from utils import load_symbols
+
+    grids = load_config()
+    # once for all shards, they then read the filters from the cache file
+    load_symbols(list(grids))
+
+    config = shard_config(grids, args.shards)
+    per_account: dict[str, int] = {}
+    for name in config:
+        account = name.rsplit("-", 1)[0]
+        per_account[account] = per_account.get(account, 0) + 1
+
+    host = os.environ.get("METRICS_HOST", METRICS_HOST)
+    port = int(os.environ.get("METRICS_PORT", METRICS_PORT))
+    fill_path = fill_store_path()
+    shards = []
+    for n, (name, shard_grids) in enumerate(config.items()):
+        account = name.rsplit("-", 1)[0]
+        env = {
+            **account_env(account),
+            "FILL_STORE_PATH": shard_path(fill_path, name),
+            "SNAPSHOT_FILE": shard_path(
+                os.environ.get("SNAPSHOT_FILE", "grids.json"), name
+            ),
+            "DEBUG_LOG_FILE": shard_path(
+                os.environ.get("DEBUG_LOG_FILE", "debug.log"), name
+            ),
+            "METRICS_HOST": "127.0.0.1",
+            "METRICS_PORT": str(port + 1 + n),
+        }
+        # orders per second are limited per account and the weight per IP,
+        # every shard gets its part and also checks the response headers
+        # against the whole limit
+        shards.append(
+            Shard(
+                name,
+                shard_grids,
+                env,
+                max(ORDER_LIMIT // per_account[account], 1),
+                max(WEIGHT_LIMIT // len(config), 1),
+                max(ALERT_RATE // len(config), 1),
+            )
+        )
+    asyncio.run(Supervisor(shards).main(host, port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import os
+import json
+import heapq
+import argparse
+import itertools
+import tempfile
+from decimal import Decimal as D
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import utils
+from pnl import SymbolLedger
+from backtest import load_ticks, backtest, set_filters
+
+PARAMS = ["step", "bottom_ratio", "top_ratio", "quote"]
+
+# arrays of the worker process, memory-mapped from the files of the parent
+times = prices = None
+
+
+def init_worker(times_path, prices_path, symbol, filters):
+    global times, prices
+    times = np.load(times_path, mmap_mode="r")
+    prices = np.load(prices_path, mmap_mode="r")
+    utils.filters[symbol] = filters
+
+
+def score(symbol, fills, last_price) -> dict:
+    """Final profit and value change of the fills, see SymbolLedger.summary."""
+    ledger = SymbolLedger(symbol)
+    ledger.extend(fills)
+    summary = ledger.summary(last_price)
+    return {key: summary[key] for key in ["fills", "profit", "value_change"]}
+
+
+def run(grid):
+    fills = backtest(grid, times, prices)
+    return grid, score(grid["symbol"], fills, float(prices[-1]))
+
+
+def parse_values(text, kind=float):
+    return [kind(value) for value in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Backtest every combination of grid parameters in parallel"
+    )
+    parser.add_argument("symbol")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--step", default="0.003,0.005,0.01")
+    parser.add_argument("--bottom-ratio", default="0.9,0.95")
+    parser.add_argument("--top-ratio", default="1.05,1.1")
+    parser.add_argument("--quote", default="20")
+    parser.add_argument("--tick-size", help="skip loading the exchange info")
+    parser.add_argument("--step-size")
+    parser.add_argument("--min-notional", default="10")
+    parser.add_argument(
+        "--rank", default="value_change", choices=["value_change", "profit"]
+    )
+    parser.add_argument("--top", type=int, default=20, help="rows of the ranked table")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--results", help="append every result to this CSV file")
+    parser.add_argument("--write-config", help="merge the best config into this file")
+    args = parser.parse_args()
+
+    if args.tick_size and args.step_size:
+        set_filters(args.symbol, args.tick_size, args.step_size, args.min_notional)
+    else:
+        utils.load_symbols([args.symbol])
+
+    all_times, all_prices = load_ticks(args.files)
+    start = float(all_prices[0])
+    grids = [
+        {
+            "symbol": args.symbol,
+            "start": start,
+            "step": step,
+            "bottom_ratio": bottom_ratio,
+            "top_ratio": top_ratio,
+            "quote": quote,
+        }
+        for step, bottom_ratio, top_ratio, quote in itertools.product(
+            parse_values(args.step),
+            parse_values(args.bottom_ratio),
+            parse_values(args.top_ratio),
+            parse_values(args.quote, D),
+        )
+    ]
+    print(f"{len(grids)} configs over {len(all_prices)} ticks, {args.workers} workers")
+
+    best = []
+    with tempfile.TemporaryDirectory() as tmp:
+        times_path = os.path.join(tmp, "times.npy")
+        prices_path = os.path.join(tmp, "prices.npy")
+        np.save(times_path, all_times)
+        np.save(prices_path, all_prices)
+        del all_times, all_prices
+
+        with ProcessPoolExecutor(
+            args.workers,
+            initializer=init_worker,
+            initargs=(
+                times_path,
+                prices_path,
+                args.symbol,
+                utils.filters[args.symbol],
+            ),
+        ) as pool:
+            futures = [pool.submit(run, grid) for grid in grids]
+            for n, future in enumerate(as_completed(futures), 1):
+                grid, result = future.result()
+                row = {key: grid[key] for key in PARAMS} | result
+                row["quote"] = float(row["quote"])
+                print(f"[{n}/{len(grids)}] {json.dumps(row)}")
+                if args.results:
+                    pd.DataFrame([row]).to_csv(
+                        args.results,
+                        mode="a",
+                        header=not os.path.exists(args.results),
+                        index=False,
+                    )
+                item = (row[args.rank], n, row)
+                if len(best) < args.top:
+                    heapq.heappush(best, item)
+                else:
+                    heapq.heappushpop(best, item)
+
+    table = pd.DataFrame([row for _, _, row in sorted(best, reverse=True)])
+    print(table.to_string())
+
+    if args.write_config and not table.empty:
+        config = {}
+        if os.path.exists(args.write_config):
+            with open(args.write_config) as f:
+                config = json.load(f)
+        # only the swept parameters, levels, recenter etc. stay as they are,
+        # an absolute bottom/top would take precedence over the ratios
+        grid = config.setdefault(args.symbol, {})
+        for key in ["bottom", "top"]:
+            grid.pop(key, None)
+        grid.update({key: float(table.iloc[0][key]) for key in PARAMS})
+        with open(args.write_config, "w") as f:
+            json.dump(config, f, indent=4)
+        print(f"best config of {args.symbol} written to {args.write_config}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import os
+import sys
+import socket
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# main opens its log file and the fill store at import, keep them out of the tree
+WORKDIR = tempfile.mkdtemp(prefix="grid-tests-")
+os.environ.setdefault("DEBUG_LOG_FILE", os.path.join(WORKDIR, "debug.log"))
+os.environ.setdefault("FILL_STORE_PATH", os.path.join(WORKDIR, "fills"))
+os.environ.setdefault("SNAPSHOT_FILE", os.path.join(WORKDIR, "grids.json"))
+os.environ.setdefault("EXCHANGE_INFO_FILE", os.path.join(WORKDIR, "exchange_info.json"))
+
+
+@pytest.fixture
+def no_alerts():
+    """Keep the warnings of the bot away from Telegram."""
+    import main
+
+    main.logger.removeHandler(main.alert_handler)
+    yield
+    main.logger.addHandler(main.alert_handler)
+
+
+@pytest.fixture
+def port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from analysis import Analyzer, MAX_TRADES_PAGE
+from pnl import synthetic_fills
+from store import JournalFillStore
+
+SYMBOL = "BENCHUSDT"
+
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    prices = tmp_path / "prices.json"
+    prices.write_text(json.dumps({SYMBOL: 1.0}))
+    monkeypatch.setenv("PRICES_FILE", str(prices))
+    monkeypatch.setenv("FILL_STORE_PATH", str(tmp_path / "fills"))
+    monkeypatch.setenv("ARCHIVE_PATH", str(tmp_path / "archive"))
+    store = JournalFillStore(str(tmp_path / "fills"))
+    for msg in synthetic_fills(MAX_TRADES_PAGE + 10):
+        store.insert(msg)
+    store.close()
+    return Analyzer()
+
+
+@pytest.mark.parametrize(
+    "limit, rows", [(-5, 1), (0, 1), (10, 10), (10**6, MAX_TRADES_PAGE)]
+)
+def test_trades_page_limit_is_clamped(analyzer, limit, rows):
+    page = analyzer.trades_page(SYMBOL, limit=limit)
+    assert len(page["rows"]) == rows
+    assert page["before"] is not None
@@ -0,0 +1,90 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from main import Main
+from scheduler import RequestScheduler
+from stream import UserStream
+from endpoints import mock_client
+from mock_exchange import MockExchange
+
+SYMBOL = "BBBUSDT"
+MIDDLE = 1_100
+
+pytestmark = pytest.mark.usefixtures("no_alerts")
+
+
+async def until(check, timeout=20.0):
+    async def poll():
+        while not check():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+async def drop_and_backfill(port):
+    """Fill two orders while the user data stream is down.
+
+    MIDDLE orders placed between them are filled before the drop, so
+    allOrders from the older one needs a second page to reach the newer
+    one and myTrades returns the middle fills again. Returns the
+    clientOrderIds handed to the grid, in order, and the gaps of the stream.
+    """
+    url = f"http://127.0.0.1:{port}"
+    exchange = MockExchange({SYMBOL: 100.0})
+    runner = await exchange.serve(port=port)
+    bot = Main({SYMBOL: {"symbol": SYMBOL}})
+    bot.client = await mock_client(url)
+    bot.scheduler = RequestScheduler(bot.client)
+    bot.scheduler.start()
+    bot.stream = UserStream(bot.client, bot.on_gap, url)
+
+    async def pump():
+        while True:
+            await bot.handle_msg(await bot.stream.recv())
+
+    inbox = bot.inboxes[SYMBOL]
+    task = None
+    try:
+        await bot.stream.open()
+        task = asyncio.create_task(pump())
+
+        def order(side, price):
+            params = {"symbol": SYMBOL, "side": side, "price": price, "quantity": "1"}
+            return exchange.place(params)
+
+        first = order("BUY", "90")
+        middle = [order("SELL", "110") for _ in range(MIDDLE)]
+        last = order("SELL", "120")
+        for o in middle:
+            await exchange.fill(o)
+        await until(lambda: inbox.qsize() == MIDDLE)
+
+        # only first and last are still open, the drop fills both
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{url}/mock/drop", json={"fills": 2}) as resp:
+                missed = (await resp.json())["fills"]
+        assert len(missed) == 2
+        await until(lambda: inbox.qsize() >= MIDDLE + 2)
+        # a late copy of a backfilled fill is dropped by the store lookup
+        await bot.handle_msg(missed[0])
+        events = [inbox.get_nowait()[2] for _ in range(inbox.qsize())]
+        return [e["c"] for e in events], first, middle, last, bot.stream.gaps
+    finally:
+        if task is not None:
+            task.cancel()
+        await bot.stream.close()
+        bot.scheduler.stop()
+        await bot.client.close_connection()
+        await runner.cleanup()
+
+
+def test_drop_resubscribe_backfill_dedup(port, tmp_path, monkeypatch):
+    monkeypatch.setenv("FILL_STORE_PATH", str(tmp_path / "fills"))
+    cids, first, middle, last, gaps = asyncio.run(drop_and_backfill(port))
+    assert gaps == 1
+    assert cids[:MIDDLE] == [o["clientOrderId"] for o in middle]
+    assert sorted(cids[MIDDLE:]) == sorted(
+        [first["clientOrderId"], last["clientOrderId"]]
+    )
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from main import Main
+from scheduler import RequestScheduler, REPLACE
+from endpoints import mock_client
+from mock_exchange import MockExchange
+
+SYMBOL = "AAAUSDT"
+
+pytestmark = pytest.mark.usefixtures("no_alerts")
+
+
+async def replace(port, cid, cancel=None):
+    """cancelReplace the resting sell with a new sell of cid on a fresh mock.
+
+    Returns the events posted to the grid and the open orders after it. An
+    order "grid-other" rests on the buy side, cancel defaults to the sell.
+    """
+    exchange = MockExchange({SYMBOL: 100.0})
+    runner = await exchange.serve(port=port)
+    bot = Main({SYMBOL: {"symbol": SYMBOL}})
+    bot.client = await mock_client(f"http://127.0.0.1:{port}")
+    bot.scheduler = RequestScheduler(bot.client)
+    bot.scheduler.start()
+    try:
+        exchange.place(
+            {
+                "symbol": SYMBOL,
+                "side": "BUY",
+                "price": "99",
+                "quantity": "1",
+                "newClientOrderId": "grid-other",
+            }
+        )
+        resting = exchange.place(
+            {"symbol": SYMBOL, "side": "SELL", "price": "101", "quantity": "1"}
+        )
+        if cancel is None:
+            cancel = (resting["clientOrderId"], resting["orderId"])
+        await bot.send_order(SYMBOL, "sell", "102", "1", cid, cancel, REPLACE)
+        inbox = bot.inboxes[SYMBOL]
+        events = [inbox.get_nowait()[2] for _ in range(inbox.qsize())]
+        return events, {o["clientOrderId"]: o for o in exchange.orders.values()}
+    finally:
+        bot.scheduler.stop()
+        await bot.client.close_connection()
+        await runner.cleanup()
+
+
+def test_cancel_failed_sends_the_new_order(port):
+    # -2022: the order to cancel is gone, the new order was not attempted
+    events, orders = asyncio.run(replace(port, "grid-new", ("grid-gone", None)))
+    assert [(e["e"], e["c"]) for e in events] == [("ack", "grid-new")]
+    assert orders["grid-new"]["price"] == "102"
+    assert len(orders) == 3
+
+
+def test_new_order_rejected_after_the_cancel(port):
+    # -2021: the sell was cancelled, its replacement reuses a clientOrderId
+    events, orders = asyncio.run(replace(port, "grid-other"))
+    assert [(e["e"], e["c"]) for e in events] == [("reject", "grid-other")]
+    assert list(orders) == ["grid-other"]
+    assert orders["grid-other"]["side"] == "BUY"
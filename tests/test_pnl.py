@@ -0,0 +1,129 @@
+import pandas as pd
+
+from pnl import SymbolLedger, analyze, synthetic_fills, to_frame, COLUMNS
+from archive import to_columns
+
+SYMBOL = "BENCHUSDT"
+
+
+def reference_frame(fills):
+    """The ledger the way Analyzer.one_symbol_df built it before pnl.py.
+
+    The pairs come from the buy/sell index stacks and the profit of each
+    close is added one pair at a time, over lists instead of iloc so a
+    million fills take seconds.
+    """
+    data = pd.DataFrame(fills, columns=["s", "p", "q", "Z", "S", "O", "T", "cancel"])
+    data.columns = [
+        "symbol",
+        "price",
+        "base_quantity",
+        "quote_quantity",
+        "side",
+        "created_at",
+        "filled_at",
+        "cancel",
+    ]
+    data = data.astype(
+        {
+            "symbol": str,
+            "price": float,
+            "base_quantity": float,
+            "quote_quantity": float,
+            "side": str,
+            "created_at": int,
+            "filled_at": int,
+        }
+    )
+    s = pd.Series("", index=data.index)
+    s[data.cancel == True] = "*"
+    data["cancel"] = s
+
+    data["buy"] = 1
+    data.loc[data.side == "SELL", "buy"] = -1
+    data["trade_base"] = data.buy * data.base_quantity
+    data["trade_quote"] = data.buy * data.quote_quantity * (-1)
+    data["trade_comm"] = data.quote_quantity * 0.001
+    data["base"] = data.trade_base.cumsum()
+    data["quote"] = data.trade_quote.cumsum()
+    data["comm"] = data.trade_comm.cumsum()
+
+    buy_indices = []
+    sell_indices = []
+    trade_pairs = []
+    for i, side in enumerate(data.side):
+        if side == "BUY":
+            if sell_indices:
+                trade_pairs.append((i, sell_indices.pop()))
+            else:
+                buy_indices.append(i)
+        else:
+            if buy_indices:
+                trade_pairs.append((buy_indices.pop(), i))
+            else:
+                sell_indices.append(i)
+
+    trade_base = data.trade_base.tolist()
+    trade_quote = data.trade_quote.tolist()
+    trade_comm = data.trade_comm.tolist()
+    trade_base_profit = [0.0] * len(data)
+    trade_quote_profit = [0.0] * len(data)
+    for trade_pair in trade_pairs:
+        open_index, close_index = min(trade_pair), max(trade_pair)
+        trade_base_profit[close_index] = (
+            trade_base[close_index] + trade_base[open_index]
+        )
+        trade_comm_pair = trade_comm[open_index] + trade_comm[close_index]
+        trade_quote_profit[close_index] = (
+            trade_quote[close_index] + trade_quote[open_index]
+        ) - trade_comm_pair
+    data["trade_base_profit"] = trade_base_profit
+    data["trade_quote_profit"] = trade_quote_profit
+
+    data["base_profit"] = data.trade_base_profit.cumsum()
+    data["quote_profit"] = data.trade_quote_profit.cumsum()
+
+    data["profit_in_quote"] = data.base_profit * data.price + data.quote_profit
+    data["value_change_in_quote"] = data.base * data.price + data.quote - data.comm
+    return to_frame(data.reindex(columns=COLUMNS))
+
+
+def check(n):
+    fills = synthetic_fills(n)
+    for fill in fills[::97]:
+        fill["cancel"] = True
+    df, summary = analyze(SYMBOL, fills)
+    pd.testing.assert_frame_equal(df, reference_frame(fills), check_exact=True)
+    assert summary["fills"] == n
+
+
+def test_matches_the_stack_loop():
+    check(20_000)
+
+
+def test_matches_the_stack_loop_on_a_million_fills():
+    check(1_000_000)
+
+
+def test_ledger_matches_after_adds_cancels_and_pages():
+    fills = synthetic_fills(5_000)
+    cancelled = fills[100::97]
+    ledger = SymbolLedger(SYMBOL)
+    ledger.extend_columns(to_columns(fills[:4_000]))
+    ledger.cancel(cancelled[0]["i"])
+    for fill in fills[4_000:]:
+        ledger.add(fill)
+    # the batch rows are built by the first page, cancel both before and after
+    for fill in cancelled[1:20]:
+        ledger.cancel(fill["i"])
+    ledger.page(limit=50)
+    for fill in cancelled[20:]:
+        ledger.cancel(fill["i"])
+    for fill in cancelled:
+        fill["cancel"] = True
+    expected = reference_frame(fills)
+    newest, before = ledger.page(before=int(fills[-500]["T"]), limit=50)
+    assert len(ledger) == len(fills)
+    pd.testing.assert_frame_equal(newest, expected.iloc[-501:-551:-1])
+    assert before == int(fills[-550]["T"])
+    pd.testing.assert_frame_equal(ledger.frame(), expected, check_exact=True)
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from main import Main
+from scheduler import RequestScheduler
+from endpoints import mock_client
+from mock_exchange import MockExchange
+
+SYMBOL = "CCCUSDT"
+
+pytestmark = pytest.mark.usefixtures("no_alerts")
+
+
+def fill(cid, order_id, side, price):
+    return {
+        "e": "executionReport",
+        "s": SYMBOL,
+        "c": cid,
+        "S": side,
+        "X": "FILLED",
+        "i": order_id,
+        "p": price,
+        "q": "1",
+        "Z": price,
+        "O": 1,
+        "T": 2,
+    }
+
+
+async def resume(port, state, fills):
+    """Resume the grid from state with no open orders on the exchange.
+
+    Returns the grid and the sides the bot placed orders on.
+    """
+    exchange = MockExchange({SYMBOL: 100.0})
+    runner = await exchange.serve(port=port)
+    grid = {"symbol": SYMBOL}
+    bot = Main({SYMBOL: grid})
+    bot.client = await mock_client(f"http://127.0.0.1:{port}")
+    bot.scheduler = RequestScheduler(bot.client)
+    bot.scheduler.start()
+    placed = []
+    bot.place = lambda grid, side, **kwargs: placed.append(side)
+    try:
+        for msg in fills:
+            bot.filled.insert(msg)
+        await bot.resume(grid, state)
+        return grid, placed
+    finally:
+        bot.scheduler.stop()
+        await bot.client.close_connection()
+        await runner.cleanup()
+
+
+@pytest.mark.parametrize("acked", [True, False])
+def test_fill_of_the_snapshot_is_replayed(port, tmp_path, monkeypatch, acked):
+    # the snapshot may be saved before the ack of the buy set its orderId
+    monkeypatch.setenv("FILL_STORE_PATH", str(tmp_path / "fills"))
+    state = {
+        "start": 100.0,
+        "mid": 100.0,
+        "buy_cid": "grid-buy",
+        "buy_id": 11 if acked else None,
+        "sell_cid": "grid-sell",
+        "sell_id": 12,
+    }
+    fills = [fill("grid-buy", 11, "BUY", "99.5")]
+    grid, placed = asyncio.run(resume(port, state, fills))
+    assert grid["mid"] == 99.5
+    assert placed == ["buy", "sell"]
+
+
+def test_order_without_a_fill_is_placed_again(port, tmp_path, monkeypatch):
+    monkeypatch.setenv("FILL_STORE_PATH", str(tmp_path / "fills"))
+    state = {
+        "start": 100.0,
+        "mid": 100.0,
+        "buy_cid": "grid-buy",
+        "buy_id": None,
+        "sell_cid": None,
+        "sell_id": None,
+    }
+    fills = [fill("grid-other", 11, "BUY", "99.5")]
+    grid, placed = asyncio.run(resume(port, state, fills))
+    assert grid["mid"] == 100.0
+    assert placed == ["buy"]
@@ -0,0 +1,149 @@
+import os
+import sys
+import subprocess
+
+import tinydb
+
+from conftest import ROOT
+from store import JournalFillStore, TinyFillStore, segments
+from archive import FillArchive, FillSource
+
+
+def fill(i, symbol="AAAUSDT"):
+    return {
+        "e": "executionReport",
+        "s": symbol,
+        "i": i,
+        "c": f"c{i}",
+        "S": "BUY",
+        "p": "1",
+        "q": "1",
+        "Z": "1",
+        "O": i,
+        "T": i,
+    }
+
+
+def test_insert_find_and_mark_cancel(tmp_path):
+    store = JournalFillStore(str(tmp_path / "fills"))
+    for i in range(3):
+        store.insert(fill(i))
+    assert len(store) == 3
+    assert store.find("AAAUSDT", 1)["c"] == "c1"
+    assert store.find("BBBUSDT", 1) is None
+    assert store.mark_cancel("AAAUSDT", 1)
+    assert not store.mark_cancel("AAAUSDT", 9)
+    assert store.find("AAAUSDT", 1)["cancel"] is True
+    assert store.find_client_order("AAAUSDT", "c2")["i"] == 2
+    assert store.find_client_order("BBBUSDT", "c2") is None
+    # one record per fill, the cancel mark is on the fill
+    assert [r["op"] for r in store.records] == ["fill"] * 3
+    store.close()
+
+
+def test_cancel_is_replayed_on_open(tmp_path):
+    path = str(tmp_path / "fills")
+    store = JournalFillStore(path)
+    store.insert(fill(1))
+    store.insert(fill(2))
+    store.mark_cancel("AAAUSDT", 2)
+    store.close()
+
+    store = JournalFillStore(path)
+    assert len(store) == 2
+    assert "cancel" not in store.find("AAAUSDT", 1)
+    assert store.find("AAAUSDT", 2)["cancel"] is True
+
+
+def test_cancel_of_a_fill_before_the_start_position(tmp_path):
+    path = str(tmp_path / "fills")
+    store = JournalFillStore(path)
+    store.insert(fill(1))
+    position = store.position
+    store.insert(fill(2))
+    store.mark_cancel("AAAUSDT", 1)
+    store.close()
+
+    store = JournalFillStore(path, position=position)
+    assert [msg["i"] for msg in store.all()] == [2]
+    assert store.records[-1] == {"op": "cancel", "s": "AAAUSDT", "i": 1}
+
+
+def test_segment_rollover(tmp_path):
+    path = str(tmp_path / "fills")
+    store = JournalFillStore(path, segment_size=200)
+    reader = JournalFillStore(path)
+    for i in range(20):
+        store.insert(fill(i))
+    store.mark_cancel("AAAUSDT", 0)
+    store.close()
+    assert len(segments(path)) > 5
+
+    new = reader.refresh()
+    assert [r["op"] for r in new] == ["fill"] * 20 + ["cancel"]
+    assert [msg["i"] for msg in reader.all()] == list(range(20))
+    assert reader.find("AAAUSDT", 0)["cancel"] is True
+    assert len(JournalFillStore(path)) == 20
+
+    # a writer opened again appends to the last segment
+    store = JournalFillStore(path, segment_size=200)
+    store.insert(fill(20))
+    store.close()
+    assert len(JournalFillStore(path)) == 21
+
+
+def test_fill_source_reads_the_archive_then_the_journal(tmp_path):
+    path, archive_path = str(tmp_path / "fills"), str(tmp_path / "archive")
+    store = JournalFillStore(path)
+    store.insert(fill(1))
+    store.insert(fill(2))
+    archive = FillArchive(archive_path)
+    archive.compact(JournalFillStore(path, position=archive.position))
+    store.insert(fill(3))
+    store.mark_cancel("AAAUSDT", 1)
+    store.sync()
+
+    source = FillSource(path, archive_path)
+    assert len(source.archive.load("AAAUSDT")["i"]) == 2
+    first = source.new_records()
+    assert [r["msg"]["i"] for r in first if r["op"] == "fill"] == [3]
+    assert [r["i"] for r in first if r["op"] == "cancel"] == [1]
+    assert source.new_records() == []
+    store.insert(fill(4))
+    store.sync()
+    assert [r["msg"]["i"] for r in source.new_records()] == [4]
+    store.close()
+
+
+def test_tinydb_refresh(tmp_path):
+    path = str(tmp_path / "db.json")
+    store = TinyFillStore(path)
+    store.insert(fill(1))
+    assert [r["msg"]["i"] for r in store.refresh()] == [1]
+    TinyFillStore(path).insert(fill(2))
+    assert [r["msg"]["i"] for r in store.refresh()] == [2]
+    assert store.find_client_order("AAAUSDT", "c2")["i"] == 2
+
+
+def test_migrate_journal(tmp_path):
+    table = tinydb.TinyDB(str(tmp_path / "db.json")).table("filled")
+    table.insert(fill(1))
+    table.insert({**fill(2), "cancel": True})
+    script = os.path.join(ROOT, "migrate_journal.py")
+    env = {**os.environ, "PYTHONPATH": ROOT}
+
+    done = subprocess.run(
+        [sys.executable, script], cwd=tmp_path, env=env, capture_output=True
+    )
+    assert done.returncode == 0, done.stderr
+    store = JournalFillStore(str(tmp_path / "fills"))
+    assert [msg["i"] for msg in store.all()] == [1, 2]
+    assert "cancel" not in store.find("AAAUSDT", 1)
+    assert store.find("AAAUSDT", 2)["cancel"] is True
+
+    # refuses to migrate the same fills twice
+    again = subprocess.run(
+        [sys.executable, script], cwd=tmp_path, env=env, capture_output=True
+    )
+    assert again.returncode != 0
+    assert len(JournalFillStore(str(tmp_path / "fills"))) == 2
@@ -1,45 +1,153 @@
 import os
+import json
+import time
 from decimal import Decimal as D
+from typing import NamedTuple
+
 from binance import Client
 
 DEFAULT_STEP = 0.005
 DEFAULT_BOTTOM_RATIO = 0.95
 DEFAULT_TOP_RATIO = 1.05
 
-client = Client(os.environ.get("API_KEY"), os.environ.get("API_SECRET"))
-
-step_sizes = {}
-tick_sizes = {}
-min_notionals = {}
-
-res = client.get_exchange_info()
-
-for symbol in res["symbols"]:
-    name = symbol["symbol"]
-    tick_sizes[name] = symbol["filters"][0]["tickSize"].rstrip("0").rstrip(".")
-    step_sizes[name] = symbol["filters"][2]["stepSize"].rstrip("0").rstrip(".")
-    min_notionals[name] = symbol["filters"][3]["minNotional"].rstrip("0").rstrip(".")
+EXCHANGE_INFO_FILE = os.environ.get("EXCHANGE_INFO_FILE", "exchange_info.json")
+EXCHANGE_INFO_TTL = 24 * 3600
+EXCHANGE_INFO_RETRY = 60  # seconds until a failed refresh of stale filters is retried
+
+client = None
+filters: dict[str, "SymbolFilters"] = {}
+# time after which the filters of a symbol are fetched again, filters set
+# directly in filters, like the backtests do, never expire
+expires: dict[str, float] = {}
+
+
+class SymbolFilters(NamedTuple):
+    tick_size: D
+    step_size: D
+    min_notional: D
+
+
+def get_client() -> Client:
+    """Client of the account, or of the mock exchange at MOCK_EXCHANGE_URL."""
+    global client
+    if client is None:
+        url = os.environ.get("MOCK_EXCHANGE_URL")
+        if url:
+            client = Client("mock", "mock", ping=False)
+            client.API_URL = f"{url}/api"
+        else:
+            client = Client(os.environ.get("API_KEY"), os.environ.get("API_SECRET"))
+    return client
+
+
+def strip(value: str) -> str:
+    return value.rstrip("0").rstrip(".")
+
+
+def parse_filters(info: dict) -> dict:
+    """Pick the sizes out of an exchangeInfo symbol by filterType."""
+    by_type = {f["filterType"]: f for f in info["filters"]}
+    notional = by_type.get("NOTIONAL") or by_type["MIN_NOTIONAL"]
+    return {
+        "tickSize": strip(by_type["PRICE_FILTER"]["tickSize"]),
+        "stepSize": strip(by_type["LOT_SIZE"]["stepSize"]),
+        "minNotional": strip(notional["minNotional"]),
+        "updated_at": time.time(),
+    }
+
+
+def load_symbols(symbols) -> None:
+    """Load the filters of the symbols, from the disk cache if fresh.
+
+    Missing or expired symbols are fetched together in one exchangeInfo
+    request and written back to the cache. If the request fails, symbols
+    with expired filters keep them for EXCHANGE_INFO_RETRY seconds.
+    """
+    now = time.time()
+    missing = [
+        symbol
+        for symbol in symbols
+        if symbol not in filters or now > expires.get(symbol, float("inf"))
+    ]
+    if not missing:
+        return
+
+    cache = {}
+    if os.path.exists(EXCHANGE_INFO_FILE):
+        with open(EXCHANGE_INFO_FILE) as f:
+            cache = json.load(f)
+
+    stale = [
+        symbol
+        for symbol in missing
+        if symbol not in cache
+        or now - cache[symbol]["updated_at"] > EXCHANGE_INFO_TTL
+    ]
+    if stale:
+        try:
+            res = get_client()._get(
+                "exchangeInfo",
+                data={"symbols": json.dumps(stale, separators=(",", ":"))},
+            )
+        except Exception:
+            if any(symbol not in filters for symbol in stale):
+                raise
+            for symbol in stale:
+                expires[symbol] = now + EXCHANGE_INFO_RETRY
+            return
+        for info in res["symbols"]:
+            if info["symbol"] in stale:
+                cache[info["symbol"]] = parse_filters(info)
+        with open(EXCHANGE_INFO_FILE + ".tmp", "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(EXCHANGE_INFO_FILE + ".tmp", EXCHANGE_INFO_FILE)
+
+    for symbol in missing:
+        item = cache[symbol]
+        filters[symbol] = SymbolFilters(
+            D(item["tickSize"]), D(item["stepSize"]), D(item["minNotional"])
+        )
+        expires[symbol] = item["updated_at"] + EXCHANGE_INFO_TTL
+
+
+def get_filters(symbol) -> SymbolFilters:
+    # expired filters are refreshed by Main.refresh_filters, not from here
+    if symbol not in filters:
+        load_symbols([symbol])
+    return filters[symbol]
 
 
 def quantize_qty(symbol, qty):
-    return D(qty).quantize(D(step_sizes[symbol]))
+    return D(qty).quantize(get_filters(symbol).step_size)
 
 
 def quantize_price(symbol, qty):
-    return D(qty).quantize(D(tick_sizes[symbol]))
+    return D(qty).quantize(get_filters(symbol).tick_size)
 
 
 def get_quote(grid):
     if "quote" in grid:
-        return grid["quote"]
+        return D(str(grid["quote"]))
     else:
-        return D(min_notionals[grid["symbol"]]) * D("1.05")
+        return get_filters(grid["symbol"]).min_notional * D("1.05")
 
 
 def get_step(grid):
     return grid.get("step", DEFAULT_STEP)
 
 
+def get_price(grid, side):
+    """Price of the next order on the side, one step away from grid["mid"]."""
+    ratio = 1 + get_step(grid) if side == "sell" else 1 - get_step(grid)
+    return quantize_price(grid["symbol"], grid["mid"] * ratio)
+
+
+def in_range(grid, side, price):
+    if side == "buy":
+        return price >= get_bottom(grid)
+    return price <= get_top(grid)
+
+
 def get_bottom(grid):
     if "bottom" in grid:
         bottom = grid["bottom"]
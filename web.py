@@ -1,20 +1,15 @@
 import json
 import pandas as pd
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, url_for, request, redirect
+from flask import Response, stream_with_context
 from flask import g
 
-from web_utils import Analyzer
-from analysis import Analyzer as A
+from analysis import analytics, TRADES_PAGE
+from export import export_chunks, to_ms, FORMATS
 
 app = Flask(__name__)
 
 
-# @app.route("/")
-# def index():
-#     info = Analyzer().info()
-#     j = json.dumps(info, indent=2)
-#     return render_template("index.html", text=j)
-
 with open("config.json") as f:
     grids = json.load(f)
     config_symbols = list(grids.keys())
@@ -22,11 +17,11 @@ with open("config.json") as f:
 
 @app.context_processor
 def inject_symbols():
-    A().symbols
+    symbols = analytics.start().symbols
     return {
         "trading_symbols": config_symbols,
         "not_trading_symbols": [
-            symbol for symbol in A().symbols if symbol not in config_symbols
+            symbol for symbol in symbols if symbol not in config_symbols
         ],
     }
 
@@ -38,29 +33,69 @@ def table():
 
 @app.route("/trades/<symbol>")
 def trades(symbol):
-    table = Analyzer().one_table(symbol.upper())
-    return render_template("index_table.html", html=table)
+    return redirect(url_for("symbol_detail", symbol=symbol))
 
 
 @app.route("/")
 def test():
-    a = A()
-    return render_template("index_table.html", table=a.all_states_table())
+    return render_template(
+        "index_table.html",
+        table=analytics.start().states_table,
+        chart=url_for("profit"),
+    )
+
+
+@app.route("/api/profit")
+@app.route("/api/profit/<symbol>")
+def profit(symbol=None):
+    return jsonify(analytics.start().analyzer.profit_series(symbol))
 
 
 @app.route("/<symbol>")
 def symbol_detail(symbol):
-    a = A()
+    service = analytics.start()
     names = [symbol, symbol.upper(), symbol + "USDT", (symbol + "USDT").upper()]
     s = None
     for name in names:
-        if name in a.symbols:
+        if name in service.symbols:
             s = name
     if not s:
-        return f"{symbol} not found, available symbols are: {a.symbols}"
+        return f"{symbol} not found, available symbols are: {service.symbols}"
 
     return render_template(
         "symbol_detail.html",
-        table_state=a.symbol_state_table(s),
-        table_trades=a.symbol_trades_table(s),
+        table_state=service.analyzer.symbol_state_table(s),
+        trades=url_for("trades_page", symbol=s),
+        export=url_for("export", symbol=s),
+    )
+
+
+@app.route("/api/trades/<symbol>")
+def trades_page(symbol):
+    service = analytics.start()
+    if symbol not in service.symbols:
+        return jsonify({"error": f"{symbol} not found"}), 404
+    before = request.args.get("before", type=int)
+    limit = request.args.get("limit", TRADES_PAGE, type=int)
+    return jsonify(service.analyzer.trades_page(symbol, before, limit))
+
+
+@app.route("/api/export/<symbol>")
+def export(symbol):
+    if symbol not in analytics.start().symbols:
+        return jsonify({"error": f"{symbol} not found"}), 404
+    fmt = request.args.get("format", "csv")
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format must be one of {FORMATS}"}), 400
+    try:
+        start, end = to_ms(request.args.get("start")), to_ms(request.args.get("end"))
+        chunks = export_chunks(symbol, fmt, start, end)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ImportError:
+        return jsonify({"error": "Parquet export needs pyarrow"}), 501
+    return Response(
+        stream_with_context(chunks),
+        mimetype="text/csv" if fmt == "csv" else "application/octet-stream",
+        headers={"Content-Disposition": f"attachment; filename={symbol}.{fmt}"},
     )